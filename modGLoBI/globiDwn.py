@@ -3,25 +3,45 @@ import pandas as pd
 import re
 import gzip
 import argparse
-
-
-#extract taxonomic ids according to categories file
-def extr(catg, fx2):
-    res2 = None  # Initialize the result variable
-    for i in range(len(catg)):  # Loop over rows in `catg`
-        #print(catg.iloc[i, :])  # Print the current category
-        # Perform regex search on the first column of `fx2`
-        pattern = rf"{catg.iloc[i, 0]}[A-Z0-9]+"
-        matches = [re.findall(pattern, str(val)) for val in fx2.iloc[:, 0]]
-        # Extract unique matches
-        #cols = pd.unique([item for sublist in matches for item in sublist]) #gives future warning
-        cols = list(set(item for sublist in matches for item in sublist))
-        res1 = pd.DataFrame({catg.iloc[i, 0]: [match[0] if match else None for match in matches]})
-        # Remove the category prefix from the matched strings
-        res1[catg.iloc[i, 0]] = res1[catg.iloc[i, 0]].str.replace(catg.iloc[i, 0], "", regex=False)
-        # Combine the result with previous results
-        res2 = pd.concat([res2, res1], axis=1) if res2 is not None else res1
-    return res2
+import sys
+import os
+import queue
+import threading
+import collections
+import multiprocessing
+
+sys.path.append('../src/functions')
+import staging
+from gzip_writer import ParallelGzipWriter
+
+
+# columns of the GloBI interactions file which are kept in the new interactions file
+colsNames = ["sourceTaxonId","sourceTaxonName","sourceLifeStageId","sourceLifeStageName","sourceBodyPartId",
+"sourceBodyPartName","sourcePhysiologicalStateId","sourcePhysiologicalStateName","sourceSexId", "sourceTaxonPhylumName", "sourceTaxonKingdomName",
+"sourceSexName","interactionTypeName","interactionTypeId","targetTaxonId",
+"targetTaxonName","targetLifeStageId","targetLifeStageName","targetBodyPartId","targetBodyPartName",
+"targetPhysiologicalStateId","targetPhysiologicalStateName","targetSexId","targetSexName", "targetTaxonPhylumName", "targetTaxonKingdomName",
+"decimalLatitude","decimalLongitude","localityId","localityName",
+"eventDate","referenceCitation","referenceDoi","referenceUrl",
+"sourceCitation","sourceNamespace","sourceArchiveURI","sourceDOI"]
+
+
+#compile the extractor of the taxonomic ids of all categories of the categories file
+def compileExtractor(catg):
+    # one optional lookahead per category, each capturing the first id of its category in a named group, so that a
+    # single search of every value gives the ids of all categories
+    lookaheads = "".join(rf"(?=(?:.*?{category}(?P<cat{k}>[A-Z0-9]+))?)" for k, category in enumerate(catg.iloc[:, 0]))
+    return re.compile(rf"^{lookaheads}", re.DOTALL)
+
+
+#extract taxonomic ids according to categories file, for several columns at once
+def extr(catg, extractor, fx2):
+    # stack the columns to extract all of them in one pass
+    values = pd.concat([fx2[column] for column in fx2.columns], ignore_index=True)
+    res = values.str.extract(extractor)
+    res.columns = list(catg.iloc[:, 0])  # the ids without the category prefix, NaN if there is no id of the category
+    n = len(fx2)
+    return [res.iloc[k * n:(k + 1) * n].reset_index(drop=True) for k in range(len(fx2.columns))]
 
 
 #try catch to see if the number of rows are not equal
@@ -35,64 +55,98 @@ def tryCatch(x1,x2,errorX):
         raise  # Re-raise the exception to stop execution
 
 
-# extract and write new interactions file for triple generation
-def generateIds(categories,intxnFile,outputFile,cs=100000):
-    dfCatg = pd.read_csv(categories, sep = "\t")
-    i = 1
-    for chunk in pd.read_csv(intxnFile, compression="gzip", sep="\t", dtype=str,  quoting=3, chunksize=cs):
+# transform a chunk of the GloBI interactions file into the rows of the new interactions file, in a worker process
+def transformChunk(task):
+    chunk, dfCatg, extractor = task
+    # Remove if source or target taxon main Ids are no:match, or if their names are null
+    keep = (chunk['sourceTaxonId'] != "no:match") & (chunk['targetTaxonId'] != "no:match") & (chunk['sourceTaxonName'] != "no name") & (chunk['targetTaxonName'] != "no name")
+    dfGlobi = chunk[keep].reset_index(drop=True)
 
+    dfSource, dfTarget = extr(dfCatg, extractor, dfGlobi[['sourceTaxonIds', 'targetTaxonIds']])
+#        dfSource.columns = ["source_COL", "source_ENVO", "source_EOL", "source_FB", "source_FBC", "source_GBIF", "source_IF", "source_IRMNG", "source_ITIS", "source_NBN", "source_NCBI", "source_PBDB", "source_SLB", "source_SPECCODE", "source_TAXON", "source_W", "source_WD", "source_WORMS"]
+    dfSource.columns = ["source_WD"]
+    tryCatch(len(dfGlobi),len(dfSource),"Source")
 
-        print("Processing chunk ",i)
-        #print("NOW dfglobi-shape", chunk.shape)
-        chunk = chunk[(chunk['sourceTaxonId'] != "no:match") & (chunk['targetTaxonId'] != "no:match")] # Remove if both source and target taxon main Ids are no:match
-        chunk = chunk[(chunk['sourceTaxonId'] != "no:match") & (chunk['sourceTaxonName'] != "no name")] # Remove if sourceTaxonId and sourceTaxonName are null
-        chunk = chunk[(chunk['targetTaxonId'] != "no:match") & (chunk['targetTaxonName'] != "no name")] # Remove if both sourceTaxonId and sourceTaxonName are null
-        #print("THEN dfglobi-shape", chunk.shape)
-        dfGlobi = chunk.reset_index(drop=True)
+    #dfTarget.columns = ["target_COL", "target_ENVO", "target_EOL", "target_FB", "target_FBC", "target_GBIF", "target_IF", "target_IRMNG", "target_ITIS", "target_NBN", "target_NCBI", "target_PBDB", "target_SLB", "target_SPECCODE", "target_TAXON", "target_W", "target_WD", "target_WORMS"]
+    dfTarget.columns = ["target_WD"]
+    tryCatch(len(dfGlobi),len(dfTarget),"Target")
 
-        dfSource = extr(dfCatg,pd.DataFrame(dfGlobi['sourceTaxonIds']))
-#        dfSource.columns = ["source_COL", "source_ENVO", "source_EOL", "source_FB", "source_FBC", "source_GBIF", "source_IF", "source_IRMNG", "source_ITIS", "source_NBN", "source_NCBI", "source_PBDB", "source_SLB", "source_SPECCODE", "source_TAXON", "source_W", "source_WD", "source_WORMS"]
-        dfSource.columns = ["source_WD"]   
-        tryCatch(len(dfGlobi),len(dfSource),"Source")
-        #print("SOURCE")
-        #print(dfSource)
-    
-        dfTarget = extr(dfCatg,pd.DataFrame(dfGlobi['targetTaxonIds']))
-        #dfTarget.columns = ["target_COL", "target_ENVO", "target_EOL", "target_FB", "target_FBC", "target_GBIF", "target_IF", "target_IRMNG", "target_ITIS", "target_NBN", "target_NCBI", "target_PBDB", "target_SLB", "target_SPECCODE", "target_TAXON", "target_W", "target_WD", "target_WORMS"]
-        dfTarget.columns = ["target_WD"]
-        tryCatch(len(dfGlobi),len(dfTarget),"Target")
-        #print("TARGET")
-        #print(dfTarget)
-
-
-        dfAll = pd.concat([dfSource, dfTarget], axis=1)
-        colsNames = ["sourceTaxonId","sourceTaxonName","sourceLifeStageId","sourceLifeStageName","sourceBodyPartId",
-        "sourceBodyPartName","sourcePhysiologicalStateId","sourcePhysiologicalStateName","sourceSexId", "sourceTaxonPhylumName", "sourceTaxonKingdomName",
-        "sourceSexName","interactionTypeName","interactionTypeId","targetTaxonId",
-        "targetTaxonName","targetLifeStageId","targetLifeStageName","targetBodyPartId","targetBodyPartName",
-        "targetPhysiologicalStateId","targetPhysiologicalStateName","targetSexId","targetSexName", "targetTaxonPhylumName", "targetTaxonKingdomName",
-        "decimalLatitude","decimalLongitude","localityId","localityName",
-        "eventDate","referenceCitation","referenceDoi","referenceUrl",
-        "sourceCitation","sourceNamespace","sourceArchiveURI","sourceDOI"]
-        tryCatch(len(dfGlobi),len(dfAll),"All")
-        #print("ALL")
-        #print(dfAll)
-
-        # Subset to keep only the selected columns
-        dfGlobi = dfGlobi[colsNames]
-    
-        # Concatenate fN and fNFinal_res column-wise
-        dfFinal = pd.concat([dfGlobi, dfAll], axis=1)
-        #print("FINAL")
-        #print(dfFinal)
-        with gzip.open(outputFile, "at", encoding="utf-8") as out_file:  # Append mode
-            if i == 1:
-                out_file.write(dfFinal.to_csv(index=False, sep='\t'))
-            else:
-                out_file.write(dfFinal.to_csv(index=False, sep='\t', header=False))
+    dfAll = pd.concat([dfSource, dfTarget], axis=1)
+    tryCatch(len(dfGlobi),len(dfAll),"All")
 
-        del dfGlobi, dfAll, dfSource, dfTarget
-        i = i + 1
+    # Subset to keep only the selected columns, followed by the extracted ids
+    return pd.concat([dfGlobi[colsNames], dfAll], axis=1)
+
+
+# read the chunks of the GloBI interactions file in a thread, which decompresses and parses the next chunks while the
+# workers transform the previous ones. The queue is bounded, so the reader waits when the workers are behind.
+def readChunks(intxnFile, cs, chunkQueue):
+    try:
+        for chunk in pd.read_csv(intxnFile, compression="gzip", sep="\t", dtype=str,  quoting=3, chunksize=cs):
+            chunkQueue.put(chunk)
+        chunkQueue.put(None)
+    except Exception as e:
+        chunkQueue.put(e)  # raised again by generateIds
+
+
+# extract and write new interactions file for triple generation
+def generateIds(categories,intxnFile,outputFile,cs=100000,workers=None):
+    """
+    Read the GloBI interactions file in a reader thread, transform its chunks in a pool of worker processes
+    (transformChunk), and write them in input order to one open output stream, compressed in parallel. The output
+    file of a failed run is removed.
+
+    :param workers: Number of worker processes, the number of CPUs by default.
+    """
+    dfCatg = pd.read_csv(categories, sep = "\t")
+    extractor = compileExtractor(dfCatg)
+    workers = workers or os.cpu_count() or 1
+
+    header = True
+
+    # write the transformed chunks, in the order of the input
+    def writeChunk(dfFinal):
+        nonlocal header
+        if isinstance(writer, ParallelGzipWriter):
+            writer.write(dfFinal.to_csv(index=False, sep='\t', header=header))
+        else:
+            writer.write(dfFinal)  # one row group per chunk
+        header = False
+
+    # the worker processes are forked before the reader thread and the compression threads are started, so that no
+    # worker inherits a lock held by one of them
+    with multiprocessing.get_context("fork").Pool(workers) as pool:
+        chunkQueue = queue.Queue(maxsize=2)
+        reader = threading.Thread(target=readChunks, args=(intxnFile, cs, chunkQueue), daemon=True)
+        reader.start()
+        # an output file ending with .parquet is written as a Parquet staging file instead of a gzipped TSV file
+        if staging.is_parquet(outputFile):
+            writer = staging.ParquetStagingWriter(outputFile)
+        else:
+            writer = ParallelGzipWriter(outputFile)
+
+        # the partial output of a failed run is removed, so that it is never taken for a complete file
+        try:
+            with writer:
+                pending = collections.deque()
+                i = 1
+                while True:
+                    chunk = chunkQueue.get()
+                    if chunk is None:
+                        break
+                    if isinstance(chunk, Exception):
+                        raise chunk
+                    print("Processing chunk ",i)
+                    pending.append(pool.apply_async(transformChunk, ((chunk, dfCatg, extractor),)))
+                    if len(pending) > workers:  # keep at most one chunk per worker waiting to be written
+                        writeChunk(pending.popleft().get())
+                    i = i + 1
+                while pending:
+                    writeChunk(pending.popleft().get())
+        except BaseException:
+            if os.path.exists(outputFile):
+                os.remove(outputFile)
+            raise
 
 
 # Main execution
@@ -106,6 +160,7 @@ if __name__ == "__main__":
     parser.add_argument('inputFile', type=str, help="Enter the GloBI gzip file")
     parser.add_argument('catgFile', type=str, help="Enter the categories file")
     parser.add_argument('outputFile', type=str, help="Enter the output file name")
+    parser.add_argument('--workers', type=int, default=0, help="Number of worker processes transforming the chunks (0 for the number of CPUs)")
 
     # Parse the arguments
     args = parser.parse_args()
@@ -114,5 +169,5 @@ if __name__ == "__main__":
     outputFile = args.outputFile
     chunksize = 1000000
     #chunksize = 5
-    generateIds(categories,intxnFile,outputFile,chunksize)
+    generateIds(categories,intxnFile,outputFile,chunksize,args.workers)
 
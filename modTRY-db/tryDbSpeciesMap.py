@@ -2,39 +2,71 @@ import pandas as pd
 import numpy as np
 import gzip
 import argparse
+import sys
 
-parser = argparse.ArgumentParser()
-parser.add_argument('wd_lineage_aligned_file', type=str, help="Enter the wd lineage file")
-wd_lineage_file = args.wd_lineage_aligned_file
-wd_lineage_df = pd.read_csv(wd_lineage_file, usecols=['WdID','WdName','kingdom'], sep=",", dtype=str)
-wd_lineage_df["WdID"] = wd_lineage_df["WdID"].str.replace("http://www.wikidata.org/entity/", "", regex=False)
-wd_lineage_df["kingdom"] = wd_lineage_df["kingdom"].replace({np.nan: None, pd.NA: None, "": None})
-wd_name_to_id_set = set(wd_lineage_df["WdName"])
-wd_name_to_id = (
-    wd_lineage_df.set_index(["WdName", "kingdom"])["WdID"]
-    .to_dict()
-)
-
-
-def process_row(row):
-    if row['AccSpeciesName'] in wd_name_to_id_set:
-        tempVar = wd_name_to_id.get((row['AccSpeciesName'],'Plantae'))
-        if tempVar:
-            best_wd_id = tempVar
-            kingdomV = "Plantae"
-        else: 
-            best_wd_id = wd_name_to_id.get((row['AccSpeciesName'],np.nan))
-            kingdomV = "None"
-        status = "ID-MATCHED-BY-NAME-direct"
-    else:
-        best_wd_id = None
-        kingdomV = None
-        status = "NAME-NOT-MATCHED"
-    row["WdID"] = best_wd_id
-    row["Match_Status"] = status
-    row["kingdom"] = kingdomV
-    print(row)
-    return row
+sys.path.append('../src/functions')
+from taxon_matcher import TaxonNameMatcher
+
+
+# preference of the kingdoms of the candidate WdIDs of a name: Plantae first, then the taxa without kingdom.
+# The WdIDs of the other kingdoms are not candidates.
+kingdomRank = {"Plantae": 0, "None": 1}
+
+
+#read the wd lineage file, with the WdIDs without their prefix and "None" as the kingdom of the taxa without kingdom
+def readLineage(wd_lineage_file):
+    wd_lineage_df = pd.read_csv(wd_lineage_file, usecols=['WdID','WdName','kingdom'], sep=",", dtype=str)
+    wd_lineage_df["WdID"] = wd_lineage_df["WdID"].str.replace("http://www.wikidata.org/entity/", "", regex=False)
+    wd_lineage_df["kingdom"] = wd_lineage_df["kingdom"].replace("", np.nan).fillna("None")
+    return wd_lineage_df
+
+
+#keep the best WdID of every name of the lineage table, ranked by kingdomRank
+def bestCandidates(wd_lineage_df):
+    # for the same name and kingdom, the last row of the lineage file is kept
+    candidates = wd_lineage_df.assign(rank=wd_lineage_df["kingdom"].map(kingdomRank), position=np.arange(len(wd_lineage_df)))
+    candidates = candidates[candidates["rank"].notna()]
+    return (candidates.sort_values(["rank", "position"], ascending=[True, False], kind="stable")
+            .drop_duplicates("WdName")[["WdName", "WdID", "kingdom"]])
+
+
+#map the species names to their WdID, all names at once
+def resolveNames(names, wd_lineage_df, best):
+    """
+    Join the distinct names to the best candidates of the lineage table.
+
+    :param names: Series of the distinct TRY species names (AccSpeciesName).
+    :param wd_lineage_df: Lineage table returned by readLineage.
+    :param best: Candidates returned by bestCandidates.
+    :return: DataFrame with the AccSpeciesName, WdID, Match_Status and kingdom columns, one row per name.
+    """
+    result = pd.DataFrame({"AccSpeciesName": names.reset_index(drop=True)})
+    inLineage = result["AccSpeciesName"].isin(wd_lineage_df["WdName"])
+    result = result.merge(best.rename(columns={"WdName": "AccSpeciesName"}), on="AccSpeciesName", how="left")
+    result["Match_Status"] = np.where(result["WdID"].notna(), "ID-MATCHED-BY-NAME-direct",
+                                      np.where(inLineage, "NAME-MATCHED-OTHER-KINGDOM", "NAME-NOT-MATCHED"))
+    return result[["AccSpeciesName", "WdID", "Match_Status", "kingdom"]]
+
+
+#match the names without an exact match approximately (misspellings, author strings, infraspecific epithets)
+def matchUnmatchedNames(result, best, max_distance):
+    """
+    :param result: DataFrame returned by resolveNames.
+    :param best: Candidates returned by bestCandidates, the reference names of the matcher.
+    :param max_distance: Largest edit distance of a match, see TaxonNameMatcher.
+    :return: The result, with the WdID, Match_Status and kingdom of the matched names, and the matchedName and score
+        columns (empty for the exact matches).
+    """
+    unmatched = result["Match_Status"] == "NAME-NOT-MATCHED"
+    matcher = TaxonNameMatcher(best["WdName"], best["WdID"], max_distance)
+    matches = matcher.match_names(result.loc[unmatched, "AccSpeciesName"])
+    names = result.loc[unmatched, "AccSpeciesName"]
+    result["matchedName"] = names.map(matches["matchedName"])
+    result["score"] = names.map(matches["score"])
+    result.loc[unmatched, "WdID"] = names.map(matches["WdID"])
+    result.loc[unmatched, "Match_Status"] = names.map(matches["Match_Status"])
+    result.loc[unmatched, "kingdom"] = result.loc[unmatched, "WdID"].map(best.drop_duplicates("WdID").set_index("WdID")["kingdom"])
+    return result
 
 
 
@@ -46,18 +78,20 @@ if __name__ == "__main__":
     #add arguments
     parser.add_argument('inputFile', type=str, help="Enter the tryDb gzip file")
     parser.add_argument('outputFile', type=str, help="Enter the output file name")
+    parser.add_argument('wd_lineage_aligned_file', type=str, help="Enter the wd lineage file")
+    parser.add_argument('--max-distance', type=int, default=0, help="Match the names without an exact match approximately, within this edit distance (0, the default, to match exactly only)")
 
     #parse the arguments
     args = parser.parse_args()
     trydbFile = args.inputFile
     outputFile = args.outputFile
+    wd_lineage_df = readLineage(args.wd_lineage_aligned_file)
 
     trydb_df = pd.read_csv(trydbFile, usecols=['SpeciesName','AccSpeciesName'], sep="\t", dtype=str, encoding="iso-8859-1") #read source
-    d = { 'AccSpeciesName' : list(set(trydb_df['AccSpeciesName']))}
-    trydb_df = pd.DataFrame(d)
-    trydb_dfX = trydb_df.apply(process_row, axis=1).apply(pd.Series) #same df
+    names = trydb_df['AccSpeciesName'].dropna().drop_duplicates()
+    best = bestCandidates(wd_lineage_df)
+    trydb_dfX = resolveNames(names, wd_lineage_df, best)
+    if args.max_distance > 0:
+        trydb_dfX = matchUnmatchedNames(trydb_dfX, best, args.max_distance)
+    print(trydb_dfX["Match_Status"].value_counts().to_string())
     trydb_dfX.to_csv(outputFile, sep="\t", index=False)
-
-
-
-
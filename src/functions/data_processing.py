@@ -12,6 +12,11 @@ import rdflib
 from rdflib import URIRef, Literal, Namespace, RDF, RDFS, XSD, DCTERMS, Graph, BNode
 from urllib.parse import quote
 import re
+import io
+import os
+import json
+import itertools
+import hashlib
 
 rdflib.plugin.register('turtle_custom', rdflib.plugin.Serializer, 'turtle_custom.serializer', 'TurtleSerializerCustom')
 
@@ -21,40 +26,52 @@ def is_none_na_or_empty(value):
     return not (value is None or value == '' or value == "\\N" or value == "no:match" or pd.isna(value) or re.match(r"ĜLOBI:", value))
 
 
+# Function applying is_none_na_or_empty to a whole column of strings at once
+def is_none_na_or_empty_column(column):
+    return column.notna() & ~column.isin(["", "\\N", "no:match"]) & ~column.str.startswith("ĜLOBI:", na=False)
+
+
 # Define a function for real-time filtering
 def filter_file_runtime(file_path, filter_df, key_column):
+    from wd_index import WdIdIndex  # wd_index imports this module
     # Read the file in chunks for runtime processing
     cs = 10000  # Adjust chunk size as needed
-    matching_rows = pd.DataFrame()  # To store filtered rows
-    
+    matching_rows = []  # To store filtered rows, concatenated once at the end
+    wdIds = WdIdIndex(filter_df[key_column])
+
     for chunk in pd.read_csv(file_path, compression="gzip", sep="\t", dtype=str, encoding="utf-8", chunksize=cs):
         # Filter rows where 'key_column' matches values in filter_df
-        filtered_chunk = chunk[chunk['source_WD'].isin(filter_df[key_column]) | chunk['target_WD'].isin(filter_df[key_column])]
+        filtered_chunk = chunk[wdIds.contains(chunk['source_WD']) | wdIds.contains(chunk['target_WD'])]
         
-        # Append matching rows to the result DataFrame
-        matching_rows = pd.concat([matching_rows, filtered_chunk], ignore_index=True)
+        # Append matching rows to the result list
+        matching_rows.append(filtered_chunk)
     
-    return matching_rows
+    return pd.concat(matching_rows, ignore_index=True) if matching_rows else pd.DataFrame()
 
 # Define a function for real-time filtering by phylum name
 def filter_file_runtime_taxonomy(file_path):
     # Here, neither filter_df nor key_column are bieng used.
     # Read the file in chunks for runtime processing
     cs = 10000  # Adjust chunk size as needed
-    matching_rows = pd.DataFrame()  # To store filtered rows
+    matching_rows = []  # To store filtered rows, concatenated once at the end
     phylumName = ["Arthropoda", "Nematoda"]
     kingdomName = ["Archaeplastida"]
+    if file_path.endswith(".parquet"):
+        # Parquet staging file, the filter is pushed down to its row groups (see staging.py)
+        import staging
+        return staging.read_parquet(file_path, filter=staging.column_in('targetTaxonKingdomName', kingdomName) | staging.column_in('sourceTaxonKingdomName', kingdomName)
+                                    | staging.column_in('targetTaxonPhylumName', phylumName) | staging.column_in('sourceTaxonPhylumName', phylumName))
     for chunk in pd.read_csv(file_path, compression="gzip", sep="\t", dtype=str, encoding="utf-8", chunksize=cs):
         # Filter rows where 'key_column' matches values in filter_df
         filtered_chunk = chunk[chunk['targetTaxonKingdomName'].isin(kingdomName) | chunk['sourceTaxonKingdomName'].isin(kingdomName) | chunk['targetTaxonPhylumName'].isin(phylumName) | chunk['sourceTaxonPhylumName'].isin(phylumName)]
         
-        # Append matching rows to the result DataFrame
-        matching_rows = pd.concat([matching_rows, filtered_chunk], ignore_index=True)
+        # Append matching rows to the result list
+        matching_rows.append(filtered_chunk)
     
-    return matching_rows
+    return pd.concat(matching_rows, ignore_index=True) if matching_rows else pd.DataFrame()
 
-def add_inverse_relationships(graph):
-    INVERSE_RELATIONS = {
+# Mapping of predicates to their inverse predicates
+INVERSE_RELATIONS = {
     "http://purl.org/dc/terms/isPartOf": "http://purl.org/dc/terms/hasPart",
     "http://purl.org/dc/terms/hasFormat": "http://purl.org/dc/terms/isFormatOf",
     "http://purl.org/dc/terms/hasVersion": "http://purl.org/dc/terms/isVersionOf",
@@ -62,37 +79,43 @@ def add_inverse_relationships(graph):
     "http://purl.org/dc/terms/replaces": "http://purl.org/dc/terms/isReplacedBy",
     "http://purl.org/dc/terms/requires": "http://purl.org/dc/terms/isRequiredBy",
     "http://www.w3.org/ns/sosa/isActedOnBy": "http://www.w3.org/ns/sosa/actsOnProperty",
-	"http://www.w3.org/ns/sosa/isFeatureOfInterestOf": "http://www.w3.org/ns/sosa/hasFeatureOfInterest",
-	"http://www.w3.org/ns/sosa/isResultOf": "http://www.w3.org/ns/sosa/hasResult",
-	"http://www.w3.org/ns/sosa/isSampleOf": "http://www.w3.org/ns/sosa/hasSample",
-	"http://www.w3.org/ns/sosa/isHostedBy": "http://www.w3.org/ns/sosa/hosts",
-	"http://www.w3.org/ns/sosa/actsOnProperty": "http://www.w3.org/ns/sosa/isActedOnBy",
-	"http://www.w3.org/ns/sosa/hasFeatureOfInterest": "http://www.w3.org/ns/sosa/isFeatureOfInterestOf",
-	"http://www.w3.org/ns/sosa/hosts": "http://www.w3.org/ns/sosa/isHostedBy",
-	"http://www.w3.org/ns/sosa/observes": "http://www.w3.org/ns/sosa/isObservedBy",
-	"http://www.w3.org/ns/sosa/hasResult": "http://www.w3.org/ns/sosa/isResultOf",
-	"http://www.w3.org/ns/sosa/hasSample": "http://www.w3.org/ns/sosa/isSampleOf",
-	"http://www.w3.org/ns/sosa/madeByActuator": "http://www.w3.org/ns/sosa/madeActuation",
-	"http://www.w3.org/ns/sosa/madeActuation": "http://www.w3.org/ns/sosa/madeByActuator",
-	"http://www.w3.org/ns/sosa/madeSampling": "http://www.w3.org/ns/sosa/madeBySampler",
-	"http://www.w3.org/ns/sosa/madeObservation": "http://www.w3.org/ns/sosa/madeBySensor",
-	"http://www.w3.org/ns/sosa/madeBySensor": "http://www.w3.org/ns/sosa/madeObservation",
-	"http://www.w3.org/ns/sosa/madeBySampler": "http://www.w3.org/ns/sosa/madeSampling",
-	"http://www.w3.org/ns/sosa/isObservedBy": "http://www.w3.org/ns/sosa/observes",
-    }
+    "http://www.w3.org/ns/sosa/isFeatureOfInterestOf": "http://www.w3.org/ns/sosa/hasFeatureOfInterest",
+    "http://www.w3.org/ns/sosa/isResultOf": "http://www.w3.org/ns/sosa/hasResult",
+    "http://www.w3.org/ns/sosa/isSampleOf": "http://www.w3.org/ns/sosa/hasSample",
+    "http://www.w3.org/ns/sosa/isHostedBy": "http://www.w3.org/ns/sosa/hosts",
+    "http://www.w3.org/ns/sosa/actsOnProperty": "http://www.w3.org/ns/sosa/isActedOnBy",
+    "http://www.w3.org/ns/sosa/hasFeatureOfInterest": "http://www.w3.org/ns/sosa/isFeatureOfInterestOf",
+    "http://www.w3.org/ns/sosa/hosts": "http://www.w3.org/ns/sosa/isHostedBy",
+    "http://www.w3.org/ns/sosa/observes": "http://www.w3.org/ns/sosa/isObservedBy",
+    "http://www.w3.org/ns/sosa/hasResult": "http://www.w3.org/ns/sosa/isResultOf",
+    "http://www.w3.org/ns/sosa/hasSample": "http://www.w3.org/ns/sosa/isSampleOf",
+    "http://www.w3.org/ns/sosa/madeByActuator": "http://www.w3.org/ns/sosa/madeActuation",
+    "http://www.w3.org/ns/sosa/madeActuation": "http://www.w3.org/ns/sosa/madeByActuator",
+    "http://www.w3.org/ns/sosa/madeSampling": "http://www.w3.org/ns/sosa/madeBySampler",
+    "http://www.w3.org/ns/sosa/madeObservation": "http://www.w3.org/ns/sosa/madeBySensor",
+    "http://www.w3.org/ns/sosa/madeBySensor": "http://www.w3.org/ns/sosa/madeObservation",
+    "http://www.w3.org/ns/sosa/madeBySampler": "http://www.w3.org/ns/sosa/madeSampling",
+    "http://www.w3.org/ns/sosa/isObservedBy": "http://www.w3.org/ns/sosa/observes",
+}
+
+
+# the same mapping with rdflib terms, built once
+INVERSE_PREDICATES = {URIRef(pred): URIRef(inverse_pred) for pred, inverse_pred in INVERSE_RELATIONS.items()}
+
+
+def add_inverse_relationships(graph):
     """
     Adds inverse relationships to the RDF graph based on predefined mappings.
+    Only the triples of the mapped predicates are visited, through the predicate index of the graph.
 
     :param graph: An rdflib.Graph instance containing the RDF triples.
     """
     new_triples = []
-    for subj, pred, obj in graph:
-        pred_str = str(pred)
-        if pred_str in INVERSE_RELATIONS:
-            inverse_pred = URIRef(INVERSE_RELATIONS[pred_str])
+    for pred, inverse_pred in INVERSE_PREDICATES.items():
+        for subj, _, obj in graph.triples((None, pred, None)):
             if isinstance(obj, URIRef):  # Only create inverses for URI objects
                 new_triples.append((obj, inverse_pred, subj))
-    
+
     for triple in new_triples:
         graph.add(triple)
 
@@ -125,3 +148,71 @@ def create_dict_from_csv(csv_file1, key_column, value_column):
     return dict(zip(df1[key_column], df1[value_column]))
 
 
+
+
+def read_tsv_gz_chunks(file_path, chunksize, start_offset=0):
+    """
+    Read a gzipped TSV file in chunks of lines, like pd.read_csv(..., chunksize=chunksize, dtype=str), and also give the
+    uncompressed byte offset after every chunk, so that a later run can seek there instead of parsing the skipped chunks.
+    The file is split on line ends, so a quoted field should not contain a line break.
+
+    :param file_path: Path to the gzipped TSV file (with a header line).
+    :param chunksize: Number of rows per chunk.
+    :param start_offset: Uncompressed byte offset of the first row to read, 0 to start after the header.
+    :return: Iterator over (DataFrame, offset of the next row) tuples.
+    """
+    with gzip.open(file_path, "rb") as f:
+        header = f.readline()
+        if start_offset > 0:
+            f.seek(start_offset)  # decompresses up to the offset, but does not parse the skipped rows
+        while True:
+            lines = list(itertools.islice(f, chunksize))
+            if not lines:
+                break
+            chunk = pd.read_csv(io.BytesIO(header + b"".join(lines)), sep="\t", dtype=str, encoding="utf-8")
+            yield chunk, f.tell()
+
+
+def load_manifest(manifest_file):
+    """
+    Load a resume manifest written by save_manifest.
+
+    :param manifest_file: Path to the JSON manifest.
+    :return: The manifest as a dictionary, or None if there is no manifest.
+    """
+    if not os.path.exists(manifest_file):
+        return None
+    with open(manifest_file, "r") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest_file, manifest):
+    """
+    Write a resume manifest atomically, so that a crash never leaves a partially written manifest behind.
+
+    :param manifest_file: Path to the JSON manifest.
+    :param manifest: Dictionary to write.
+    """
+    tmp_file = manifest_file + ".tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, manifest_file)
+
+
+def files_digest(file_paths, extra=""):
+    """
+    Compute a sha256 digest of the content of some files, used to tell whether a table derived from them is still valid.
+
+    :param file_paths: Paths of the files.
+    :param extra: Additional text hashed along with the files (e.g. constants of the code deriving the table).
+    :return: The hex digest.
+    """
+    digest = hashlib.sha256()
+    for file_path in file_paths:
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    digest.update(extra.encode("utf-8"))
+    return digest.hexdigest()
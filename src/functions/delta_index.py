@@ -0,0 +1,181 @@
+import os
+import gzip
+import hashlib
+import numpy as np
+
+from run_metrics import metrics
+
+
+# 128-bit hashes, compared and sorted as raw bytes
+hash_dtype = np.dtype("V16")
+
+# record of <index_file>.seen: the content hash and the fingerprint of every input row, in input order
+seen_dtype = np.dtype([("content", hash_dtype), ("fingerprint", hash_dtype)])
+
+
+# Function for the stable content hash of every row of a batch
+def hash_rows(batch_data):
+    """
+    Hash the normalized rows of a batch: the values of the columns in the order of their names, stripped, with
+    missing values as empty strings. The hash does not depend on the order of the columns of the file, on the
+    position of the row or on the pandas version, so that the same interaction has the same hash in every release.
+
+    :return: Array of 128-bit blake2b hashes.
+    """
+    columns = sorted(batch_data.columns)
+    values = batch_data[columns].fillna("").astype(str)
+    rows = values[columns[0]].str.strip()
+    for column in columns[1:]:
+        rows = rows + "\x1f" + values[column].str.strip()
+    digests = b"".join(hashlib.blake2b(row.encode("utf-8"), digest_size=16).digest() for row in rows)
+    return np.frombuffer(digests, dtype=hash_dtype)
+
+
+# Function for the fingerprints of rows, from their content hash and their occurrence number among the identical rows
+def fingerprint_rows(contents, occurrences):
+    digests = b"".join(hashlib.blake2b(content.tobytes() + int(k).to_bytes(8, "big"), digest_size=16).digest()
+                       for content, k in zip(contents, occurrences))
+    return np.frombuffer(digests, dtype=hash_dtype)
+
+
+class OccurrenceCounter:
+    '''
+    Number of the rows with every content hash seen so far, to number the identical rows of an input. The counts are
+    kept in sorted runs of distinct hashes, and two runs are merged when the later one is as large as the earlier
+    one, so that the number of runs stays logarithmic in the number of rows.
+    '''
+    def __init__(self):
+        self.runs = []
+
+    def count(self, contents):
+        """
+        Count the rows of a batch.
+
+        :param contents: Content hashes of the rows, in input order.
+        :return: The occurrence number of every row: 0 for the first row with its hash in the input, 1 for the second, ...
+        """
+        occurrences = np.zeros(len(contents), dtype=np.int64)
+        for keys, counts in self.runs:
+            pos = np.minimum(np.searchsorted(keys, contents), len(keys) - 1)
+            occurrences += np.where(keys[pos] == contents, counts[pos], 0)
+        # rank of every row among the identical rows of the batch
+        order = np.argsort(contents, kind="stable")
+        ordered = contents[order]
+        starts = np.r_[True, ordered[1:] != ordered[:-1]] if len(ordered) else np.empty(0, dtype=bool)
+        ranks = np.arange(len(ordered)) - np.maximum.accumulate(np.where(starts, np.arange(len(ordered)), 0))
+        occurrences[order] += ranks
+
+        keys, counts = np.unique(contents, return_counts=True)
+        if len(keys):
+            self.runs.append((keys, counts))
+        while len(self.runs) > 1 and len(self.runs[-1][0]) >= len(self.runs[-2][0]):
+            (keys1, counts1), (keys2, counts2) = self.runs.pop(), self.runs.pop()
+            keys, inverse = np.unique(np.concatenate([keys2, keys1]), return_inverse=True)
+            self.runs.append((keys, np.bincount(inverse, weights=np.concatenate([counts2, counts1])).astype(np.int64)))
+        return occurrences
+
+
+class DeltaIndex:
+    '''
+    Index of the fingerprints of the input rows of the previous run, for the incremental mode: only the rows which were
+    not in the previous input (new or changed rows) are kept, and the rows of the previous input which are not in the
+    current one are retired. The fingerprint of a row is a 128-bit hash of its content and of its occurrence number
+    among the identical rows of the input, so that identical rows remain distinct records. The index is a sorted
+    array of fingerprints saved with numpy (16 bytes per row), with the context of the run which wrote it.
+
+    The context is a digest of everything besides the input rows which the triples depend on (mapping files,
+    options, ...). If it differs from the context of the index, the triples of the previous records may have changed:
+    all rows are kept, and all the records of the previous input are retired (see finish), so that the endpoint drops
+    their old triples before loading the new ones.
+
+    The content hashes and fingerprints of the current run are appended to <index_file>.seen once per batch, so that
+    an interrupted run can be resumed like its output file, and replace the index when the run completes (see finish).
+
+    :param index_file: Path to the index written by the previous run, which does not exist for the first run.
+    :param context: Digest of the inputs of the run other than the input rows, see dp.files_digest.
+    :param resume_size: Size of <index_file>.seen after the last complete batch of an interrupted run, None to start a new run.
+    '''
+    def __init__(self, index_file, context, resume_size=None):
+        self.index_file = index_file
+        self.context = context
+        self.seen_file = f"{index_file}.seen"
+        self.previous = np.empty(0, dtype=hash_dtype)
+        self.stale = False
+        if os.path.exists(index_file):
+            with np.load(index_file) as index:
+                self.previous = index["fingerprints"]
+                if str(index["context"]) != context:
+                    print(f"The mapping files or the options changed since {index_file} was written, all rows are generated and all the previous records are retired")
+                    self.stale = True
+        self.occurrences = OccurrenceCounter()
+        self.parts = []
+        if resume_size is not None and os.path.exists(self.seen_file):
+            with open(self.seen_file, "r+b") as f:
+                f.truncate(resume_size)
+            # occurrences of the rows of the complete batches
+            for start in range(0, resume_size // seen_dtype.itemsize, 1000000):
+                seen = np.fromfile(self.seen_file, dtype=seen_dtype, count=1000000, offset=start * seen_dtype.itemsize)
+                self.occurrences.count(seen["content"])
+        else:
+            open(self.seen_file, "wb").close()
+
+    def split(self, batch_data):
+        """
+        Remember the fingerprints of a batch, to be written with the next flush, and keep its new rows.
+
+        :return: The rows which were not in the previous input, with their fingerprint as 32 hex digits in the recordHash column.
+        """
+        contents = hash_rows(batch_data)
+        hashes = fingerprint_rows(contents, self.occurrences.count(contents))
+        seen = np.empty(len(hashes), dtype=seen_dtype)
+        seen["content"], seen["fingerprint"] = contents, hashes
+        self.parts.append(seen)
+        if len(self.previous) and not self.stale:
+            positions = np.minimum(np.searchsorted(self.previous, hashes), len(self.previous) - 1)
+            known = self.previous[positions] == hashes
+        else:
+            known = np.zeros(len(hashes), dtype=bool)
+        metrics.count("rows_unchanged", int(known.sum()))
+        return batch_data[~known].assign(recordHash=np.array([h.tobytes().hex() for h in hashes[~known]], dtype=object))
+
+    def take(self):
+        """
+        Return the fingerprints remembered since the last flush or take, and forget them (see write).
+        """
+        data = b"".join(seen.tobytes() for seen in self.parts)
+        self.parts = []
+        return data
+
+    def write(self, data):
+        """
+        Append fingerprints returned by take to <index_file>.seen.
+
+        :return: Size of the file, to be recorded for a resumed run.
+        """
+        with open(self.seen_file, "ab") as f:
+            f.write(data)
+            return f.tell()
+
+    def flush(self):
+        return self.write(self.take())
+
+    def finish(self, retired_file, record_prefix):
+        """
+        Write the IRIs of the records of the previous input which are not in the current one (all of them if the
+        context changed), and replace the index by the fingerprints of the current input.
+
+        :param retired_file: Path to the gzipped list of the retired record IRIs, one per line.
+        :param record_prefix: IRI of the records without their fingerprint, e.g. https://purl.org/emi/abox#inRec-
+        :return: Number of rows in the new index, and number of retired records.
+        """
+        self.flush()
+        current = np.unique(np.fromfile(self.seen_file, dtype=seen_dtype)["fingerprint"])
+        retired = self.previous if self.stale else np.setdiff1d(self.previous, current, assume_unique=True)
+        with gzip.open(retired_file, "wt", encoding="utf-8") as f:
+            for h in retired:
+                f.write(f"{record_prefix}{h.tobytes().hex()}\n")
+        with open(f"{self.index_file}.tmp", "wb") as f:
+            np.savez(f, fingerprints=current, context=np.array(self.context))
+        os.replace(f"{self.index_file}.tmp", self.index_file)  # the previous index is kept until the new one is complete
+        os.remove(self.seen_file)
+        return len(current), len(retired)
@@ -0,0 +1,61 @@
+import hashlib
+
+from run_metrics import metrics
+
+
+class EmitOnce:
+    '''
+    Registry of the entity-level statements already written to an output file (e.g. the citation of a dataset or the
+    taxon of an organism), so that the statements repeated by many rows are written once per file instead of once per
+    batch, and QLever does not have to parse and deduplicate them.
+
+    Statements are remembered by a 128-bit blake2b digest of their N-Triples form, wide enough that two statements do
+    not collide in practice (a collision would drop a statement silently), in two generations of at most capacity
+    statements: when the current generation is full it becomes the previous one, and the previous one is forgotten.
+    The memory stays bounded, and a statement which was not seen for more than capacity statements may be written
+    again, which only adds a duplicate.
+
+    :param capacity: Number of statements per generation, 0 to write every statement.
+    '''
+    def __init__(self, capacity=2000000):
+        self.capacity = capacity
+        self.current = set()
+        self.previous = set()
+        self.suppressed = 0
+
+    def first(self, triple):
+        """
+        Tell whether a statement is written for the first time, and remember it.
+        """
+        if self.capacity <= 0:
+            return True
+        key = hashlib.blake2b(" ".join(term.n3() for term in triple).encode("utf-8"), digest_size=16).digest()
+        if key in self.current:
+            return False
+        if key in self.previous:
+            self.current.add(key)  # still in use, keep it when the generations are rotated
+            return False
+        if len(self.current) >= self.capacity:
+            self.previous = self.current
+            self.current = set()
+        self.current.add(key)
+        return True
+
+    def keep(self, triple, kind):
+        """
+        Tell whether a statement is to be written, counting it as suppressed if it was already written.
+
+        :param kind: Kind of the statement, label of the duplicates_suppressed counter.
+        """
+        if self.first(triple):
+            return True
+        self.suppressed += 1
+        metrics.count("duplicates_suppressed", kind=kind)
+        return False
+
+    def add(self, graph, triple, kind):
+        """
+        Add a statement to the graph of the batch unless it was already written, see keep.
+        """
+        if self.keep(triple, kind):
+            graph.add(triple)
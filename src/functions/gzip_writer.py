@@ -0,0 +1,77 @@
+import os
+import gzip
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ParallelGzipWriter:
+    '''
+    Text file handle writing a gzip file as a series of independent members (blocks), compressed in a pool of threads
+    while the caller goes on generating, in the manner of pigz. zlib releases the GIL while it compresses, so the blocks
+    are compressed in parallel. The members are written in order, and the concatenation is a valid gzip file.
+
+    :param output_file: Path to the gzip file.
+    :param append: Append to an existing file instead of starting a new one.
+    :param level: Compression level, from 1 (fastest) to 9 (smallest).
+    :param threads: Number of compression threads, the number of CPUs by default.
+    :param block_size: Number of characters compressed as one member.
+    '''
+    def __init__(self, output_file, append=False, level=6, threads=None, block_size=4 * 1024 * 1024):
+        self.out_file = open(output_file, "ab" if append else "wb")
+        self.level = level
+        self.block_size = block_size
+        self.threads = threads or os.cpu_count() or 1
+        self.pool = ThreadPoolExecutor(self.threads)
+        self.pending = collections.deque()  # members being compressed (futures) or already compressed (bytes), in file order
+        self.parts = []
+        self.size = 0
+
+    def write(self, text):
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size >= self.block_size:
+            self.end_block()
+
+    def write_member(self, member):
+        """
+        Write a member which is already compressed (e.g. by a worker process), after the text written before it.
+        """
+        self.end_block()
+        self.pending.append(member)
+        self.drain(2 * self.threads)
+
+    def end_block(self):
+        if self.parts:
+            data = "".join(self.parts).encode("utf-8")
+            self.parts = []
+            self.size = 0
+            self.pending.append(self.pool.submit(gzip.compress, data, self.level, mtime=0))
+            self.drain(2 * self.threads)  # keep at most two blocks per thread in memory
+
+    def drain(self, keep):
+        while len(self.pending) > keep:
+            member = self.pending.popleft()
+            self.out_file.write(member if isinstance(member, bytes) else member.result())
+
+    def sync(self):
+        """
+        Compress and write everything written so far, so that the file ends with a complete member.
+
+        :return: Size of the file, e.g. to truncate it there when an interrupted run is resumed.
+        """
+        self.end_block()
+        self.drain(0)
+        self.out_file.flush()
+        return self.out_file.tell()
+
+    def close(self):
+        if not self.out_file.closed:
+            self.sync()
+            self.pool.shutdown()
+            self.out_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
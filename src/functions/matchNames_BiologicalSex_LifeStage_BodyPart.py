@@ -2,105 +2,99 @@ import pandas as pd
 import re
 import sys
 import os
+import functools
 from rdflib import URIRef, Literal, Namespace, RDF, RDFS, XSD, DCTERMS, Graph, BNode
 from config import eURIDict, eURISet, eNamesDict, eNamesSet
 import data_processing as dp
+from run_metrics import metrics
+from term_tokenizer import TermIndex, normalize_term, preprocess_term, pre_post_fix, delimiters_regex2, delimiters_regex4, pattern
 
 
 #sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))  # to add parent directory
 
 #from makeTriples_globi_rdf_v1 import eURIDict, eURISet, eNamesDict, eNamesSet  # Import global variables
 
+emiBox = Namespace("https://purl.org/emi/abox#")
+
+# index of the terms of the mapping files, built once
+termIndex = TermIndex(eURISet, eNamesSet)
+
 def add_entity(graph, subject, predicate, rdftype, entityX, entity_name, desigSet, fetchtype, termOr):
-    print(subject, termOr, entityX, fetchtype, sep="\t")
+    metrics.count("entity_links", fetchtype=fetchtype)
+    metrics.diagnostic(fetchtype, subject, termOr, entityX)
     graph.add((subject, predicate, entityX))
     if entityX not in desigSet:
         graph.add((entityX, RDF.type, rdftype))
         graph.add((entityX, RDFS.label, Literal(entity_name, datatype=XSD.string)))
         desigSet.add(entityX)
 
-def lookup_term(termOr, graph, subject, predicate, rdftype, ns, term, pre_post_fix, desigSet):
-    emiBox = Namespace("https://purl.org/emi/abox#")
-    term = preprocess_term(term)
-    if term in eURISet:
+def resolve_lookup_term(termOr, ns, term):
+    '''
+    Resolves one token of a term to an entity of the mapping files, without adding anything to a graph.
+
+    :return: List with the (entity URI, label, fetchtype) of the token, empty if nothing is available.
+    '''
+    term, fetchtype = termIndex.find(term)
+    if fetchtype == "URI-FETCHED-1":
         modEntityURI = URIRef(eURIDict[term])
         modEntityName = eNamesDict[term]
-#        print(term, ns, modEntityURI, "URI-FETCHED-1", sep="\t")
-        add_entity(graph, subject, predicate, rdftype, modEntityURI, modEntityName, desigSet, "URI-FETCHED-1", termOr)
-    elif term in eNamesSet:
+        return [(modEntityURI, modEntityName, fetchtype)]
+    elif fetchtype == "URI-FETCHED-1a":
         modEntityName = eNamesDict[term]
         ent = emiBox[f"{ns}-{dp.format_uri(modEntityName)}"]
-#        print(term, ns, modEntityName, "URI-FETCHED-1a", sep="\t")
-        add_entity(graph, subject, predicate, rdftype, ent, modEntityName, desigSet, "URI-FETCHED-1a", termOr)
+        return [(ent, modEntityName, fetchtype)]
     else:
-        term = preprocess_term(pre_post_fix.sub('', term))
-        if term in eURISet:
-            modEntityURI = URIRef(eURIDict[term])
-            modEntityName = eNamesDict[term]
-#            print(term, ns, modEntityURI, "URI-FETCHED-1", sep="\t")
-            add_entity(graph, subject, predicate, rdftype, modEntityURI, modEntityName, desigSet, "URI-FETCHED-1", termOr)
-        elif term in eNamesSet:
-            modEntityName = eNamesDict[term]
-            ent = emiBox[f"{ns}-{dp.format_uri(modEntityName)}"]
-#            print(term, ns, modEntityName, "URI-FETCHED-1a", sep="\t")
-            add_entity(graph, subject, predicate, rdftype, ent, modEntityName, desigSet, "URI-FETCHED-1a", termOr)
-        else:
-            print(termOr, ns, term, "NOTHING-AVAILABLE", sep="\t")
+        metrics.diagnostic("NOTHING-AVAILABLE", termOr, ns, term)
+        return []
 
 
-def listTerms(term, graph, subject, predicate, rdftype, ns, desigSet):
+def lookup_term(termOr, graph, subject, predicate, rdftype, ns, term, pre_post_fix, desigSet):
+    # pre_post_fix is kept for the callers, the shared one of term_tokenizer is used
+    for entityX, entity_name, fetchtype in resolve_lookup_term(termOr, ns, term):
+        add_entity(graph, subject, predicate, rdftype, entityX, entity_name, desigSet, fetchtype, termOr)
+
+
+def resolve_terms(term, ns):
+    '''
+    Splits a free-text life stage or body part name into its tokens and resolves each of them, see resolve_lookup_term.
+
+    :param term: The name as written in the input file.
+    :param ns: Namespace of the entities minted for names without URI (ANATOMICAL_ENTITY or DEVELOPMENTAL_STAGE).
+    :return: List of the (entity URI, label, fetchtype) of all tokens, in order.
+    '''
     termOr = term
-    conjunction_patterns1 = re.compile(r'\b(and|y)\b', re.IGNORECASE)
-    conjunction_patterns2 = re.compile(r'\b(or)\b', re.IGNORECASE)
-    pre_post_fix = re.compile(r"(adult[as]?|tortere|juvenil[e]?|maybe|\(?torete[s]?\)?)", re.IGNORECASE)
-    delimiters_regex = re.compile(r"[,;/|&]+", re.IGNORECASE)
-    delimiters_regex1 = re.compile(r"[\[\]\(\)\?\#:`]+", re.IGNORECASE)
-    delimiters_regex2 = re.compile(r"[+.,]+", re.IGNORECASE)
-    delimiters_regex3 = re.compile(r"\s\s", re.IGNORECASE)
-    pattern = r"(\d+)\s*([\w-]+)|([\w-]+)\s*(\d+)"
-    term = term.lower().strip()
-    term = conjunction_patterns1.sub(',', term)
-    term = conjunction_patterns2.sub('', term)
-    term = delimiters_regex.sub(',', term)
-    term = delimiters_regex1.sub(' ', term)
-    term = delimiters_regex3.sub(' ', term)
+    entities = []
+    term = normalize_term(term)  # lower-case, replace the conjunctions and normalize the delimiters
     terms = delimiters_regex2.split(term)
     for term in terms:
-        cleaned_row = re.sub(r"[+.,]", " ", term)
+        cleaned_row = delimiters_regex4.sub(" ", term)
         matches = re.findall(pattern, cleaned_row)
         if matches:
             for match in matches:
                 number1, term1, term2, number2 = match
                 term = term1 if term1 else term2
-                lookup_term(termOr, graph, subject, predicate, rdftype, ns, term.strip(), pre_post_fix, desigSet)
+                entities.extend(resolve_lookup_term(termOr, ns, term.strip()))
         else:
             for term in delimiters_regex2.split(term):
-                lookup_term(termOr, graph, subject, predicate, rdftype, ns, term.strip(), pre_post_fix, desigSet)
+                entities.extend(resolve_lookup_term(termOr, ns, term.strip()))
+    return entities
+
+
+def listTerms(term, graph, subject, predicate, rdftype, ns, desigSet):
+    for entityX, entity_name, fetchtype in resolve_terms(term, ns):
+        add_entity(graph, subject, predicate, rdftype, entityX, entity_name, desigSet, fetchtype, term)
 
 
 def countTerms(term,mapping_dict,mapping_set):
     records = []
-    conjunction_patterns1 = re.compile(r'\b(and|y)\b', re.IGNORECASE)
-    conjunction_patterns2 = re.compile(r'\b(or)\b', re.IGNORECASE)
-    pre_post_fix = re.compile(r"(adult[as]?|tortere|juvenil[e]?|maybe|\(?torete[s]?\)?)", re.IGNORECASE)
-    delimiters_regex = re.compile(r"[,;/|&]+", re.IGNORECASE)                          # Removed '-'
-    delimiters_regex1 = re.compile(r"[\[\]\(\)\?\#:`]+", re.IGNORECASE)                # Removed '-'
-    delimiters_regex2 = re.compile(r"[+.,]+", re.IGNORECASE)
-    delimiters_regex3 = re.compile(r"\s\s", re.IGNORECASE)
-    pattern = r"(\d+)\s*([\w-]+)|([\w-]+)\s*(\d+)"
     counts_template = {value: 0 for value in mapping_dict.values()}
     mapping_count = counts_template.copy()
-    term = term.lower().strip()  # Convert to lowercase and remove extra spaces
-    term=conjunction_patterns1.sub(',', term)  # Replace "and/or/y" with a comma
-    term=conjunction_patterns2.sub('', term)  # Replace "and/or/y" with a comma
-    term=delimiters_regex.sub(',', term)  # Replace "and/or/y" with a comma
-    term=delimiters_regex1.sub(' ', term)  # Replace "and/or/y" with a comma
-    term=delimiters_regex3.sub(' ', term)  # Replace "and/or/y" with a comma
+    term = normalize_term(term)  # lower-case, replace the conjunctions and normalize the delimiters
     if term not in mapping_dict:
         #cleaned_row = re.sub(r"[+.,]", " ", term)
         terms = delimiters_regex2.split(term)
         for term in terms:
-            cleaned_row = re.sub(r"[+.,]", " ", term)
+            cleaned_row = delimiters_regex4.sub(" ", term)
             matches = re.findall(pattern, cleaned_row)
             if matches:
                 for match in matches:
@@ -140,33 +134,16 @@ def countTerms(term,mapping_dict,mapping_set):
 # Functions for mapping biological gender - Match the biological gender values
 def map_terms_to_valuesX(term,mapping_dict):
     print(term)
-    # conjunction patterns 
-    conjunction_patterns1 = re.compile(r'\b(and|y)\b', re.IGNORECASE)
-    conjunction_patterns2 = re.compile(r'\b(or)\b', re.IGNORECASE)
-    # pre_post fixes 
-    pre_post_fix = re.compile(r"(adult[as]?|tortere|juvenil[e]?|maybe|\(?torete[s]?\)?)", re.IGNORECASE)
-    # delimiters to be considered
-    delimiters_regex = re.compile(r"[,;/|&]+", re.IGNORECASE)                          # Removed '-'
-    delimiters_regex1 = re.compile(r"[\[\]\(\)\?\#:`]+", re.IGNORECASE)                # Removed '-'
-    delimiters_regex2 = re.compile(r"[+.,]+", re.IGNORECASE)
-    delimiters_regex3 = re.compile(r"\s\s", re.IGNORECASE)
-    # patterns for matching strings like "12 male, 3 female"
-    pattern = r"(\d+)\s*([\w-]+)|([\w-]+)\s*(\d+)"
     # create a template dictionary from the values of mapping_dict
     counts_template = {value: 0 for value in mapping_dict.values()}
     mapping_count = counts_template.copy()
-    term = term.lower().strip()  # Convert to lowercase and remove extra spaces
-    term=conjunction_patterns1.sub(',', term)  # Replace "and/or/y" with a comma
-    term=conjunction_patterns2.sub('', term)  # Replace "and/or/y" with a comma
-    term=delimiters_regex.sub(',', term)  # Replace "and/or/y" with a comma
-    term=delimiters_regex1.sub(' ', term)  # Replace "and/or/y" with a comma
-    term=delimiters_regex3.sub(' ', term)  # Replace "and/or/y" with a comma
+    term = normalize_term(term)  # lower-case, replace the conjunctions and normalize the delimiters
     # Replace delimiters (+, ., ,) with spaces for consistent splitting
     if term not in mapping_dict:
         #cleaned_row = re.sub(r"[+.,]", " ", term)
         terms = delimiters_regex2.split(term)
         for term in terms:
-            cleaned_row = re.sub(r"[+.,]", " ", term)
+            cleaned_row = delimiters_regex4.sub(" ", term)
             matches = re.findall(pattern, cleaned_row)
             if matches:
                 for match in matches:
@@ -231,110 +208,127 @@ def map_terms_to_valuesX(term,mapping_dict):
     print(filtered_dict)
 
 
-# Preprocessing functions - Lowercase, autocorrect, and remove extra characters (plural)
-def preprocess_term(term):
-    term = term.lower().strip()  # Convert to lowercase and remove extra spaces
-    if "mono" not in term and "auto" not in term:
-        if term.endswith('s'):
-            term = term[:-1]  # Remove trailing 's' to handle plurals
-    return term
+# Class for mapping biological gender - Match the biological gender values
+class SexParser:
+    '''
+    Parses biological sex strings like "2 males, 1 female" into {quantity kind URI: count} dictionaries. The mapping file is
+    loaded once, the patterns are shared with the other parsers (see term_tokenizer), and the result of every distinct string is memoized with a bounded LRU cache.
 
+    :param dataFile: TSV file mapping the (lower-case) input terms to their biological sex URI.
+    :param cache_size: Number of distinct strings kept in the cache.
+    '''
+    def __init__(self, dataFile="../ontology/data/globi/correctedBiologicalSexNames.tsv", cache_size=100000):
+        # Load data
+        self.dataFile = dataFile
+        mapDf = pd.read_csv(dataFile, sep="\t", quoting=3, dtype=str)
 
-# Functions for mapping biological gender - Match the biological gender values
-def map_terms_to_values(term):
-    # File paths
-    dataFile = "../ontology/data/globi/correctedBiologicalSexNames.tsv"
-    # Load data
-    mapDf = pd.read_csv(dataFile, sep="\t", quoting=3, dtype=str)
+        # declare and fill dictionary
+        self.mapping_dict = dict(zip(mapDf['input'].str.lower(), mapDf['output']))
 
-    # declare and fill dictionary
-    mapping_dict = dict(zip(mapDf['input'].str.lower(), mapDf['output']))
+        # create a template dictionary from the values of mapping_dict
+        self.counts_template = {value: 0 for value in self.mapping_dict.values()}
 
-    # conjunction patterns 
-    conjunction_patterns1 = re.compile(r'\b(and|y)\b', re.IGNORECASE)
-    conjunction_patterns2 = re.compile(r'\b(or)\b', re.IGNORECASE)
+        self.parse = functools.lru_cache(maxsize=cache_size)(self.parse_term)
 
-    # pre_post fixes 
-    pre_post_fix = re.compile(r"(adult[as]?|tortere|juvenil[e]?|maybe|\(?torete[s]?\)?)", re.IGNORECASE)
+    def parse_column(self, terms):
+        """
+        Parse a whole column, every distinct string only once.
 
-    # delimiters to be considered
-    delimiters_regex = re.compile(r"[,;/|&]+", re.IGNORECASE)                          # Removed '-'
-    delimiters_regex1 = re.compile(r"[\[\]\(\)\?\#:`]+", re.IGNORECASE)                # Removed '-'
-    delimiters_regex2 = re.compile(r"[+.,]+", re.IGNORECASE)
-    delimiters_regex3 = re.compile(r"\s\s", re.IGNORECASE)
+        :param terms: Iterable (e.g. a pandas Series) of biological sex strings.
+        :return: List with the parsed dictionary of every string, None for the values which are not strings.
+        """
+        parsed = {}
+        for term in terms:
+            if isinstance(term, str) and term not in parsed:
+                parsed[term] = self.parse(term)
+        return [parsed.get(term) if isinstance(term, str) else None for term in terms]
 
-    # patterns for matching strings like "12 male, 3 female"
-    pattern = r"(\d+)\s*([\w-]+)|([\w-]+)\s*(\d+)"
+    def parse_term(self, term):
+        """
+        Parse one biological sex string, without the cache (see parse). The returned dictionary is shared by the cache
+        and must not be modified.
+        """
+        mapping_dict = self.mapping_dict
 
-    # create a template dictionary from the values of mapping_dict
-    counts_template = {value: 0 for value in mapping_dict.values()}
+        counts_template = self.counts_template
 
-    mapping_count = counts_template.copy()
-    term = term.lower().strip()  # Convert to lowercase and remove extra spaces
-    term=conjunction_patterns1.sub(',', term)  # Replace "and/or/y" with a comma
-    term=conjunction_patterns2.sub('', term)  # Replace "and/or/y" with a comma
-    term=delimiters_regex.sub(',', term)  # Replace "and/or/y" with a comma
-    term=delimiters_regex1.sub(' ', term)  # Replace "and/or/y" with a comma
-    term=delimiters_regex3.sub(' ', term)  # Replace "and/or/y" with a comma
+        mapping_count = counts_template.copy()
+        term = normalize_term(term)  # lower-case, replace the conjunctions and normalize the delimiters
 
-    # Replace delimiters (+, ., ,) with spaces for consistent splitting
-    if term not in mapping_dict:
-        #cleaned_row = re.sub(r"[+.,]", " ", term)
-        terms = delimiters_regex2.split(term)
-        for term in terms:
-            cleaned_row = re.sub(r"[+.,]", " ", term)
-            matches = re.findall(pattern, cleaned_row)
-            if matches:
-                for match in matches:
-                    # Match groups: (number, term) or (term, number)
-                    number1, term1, term2, number2 = match
-                    term = term1 if term1 else term2  # Choose the non-empty term
-                    count = number1 if number1 else number2  # Choose the non-empty number
-                    term = preprocess_term(term.strip())  # Normalize to lowercase
-                    count = int(count)  # Convert count to integer
-                    #Find the corresponding key in reference_dict
-                    if term in mapping_dict:
-                        mapping_count[mapping_dict[term]]= mapping_count[mapping_dict[term]] + int(count)
-                        termX = mapping_dict[term]
-                        countX = mapping_count[mapping_dict[term]]
-                    else:
-                        term = preprocess_term(pre_post_fix.sub('', term))  # Replace "and/or/y" with a comma
+        # Replace delimiters (+, ., ,) with spaces for consistent splitting
+        if term not in mapping_dict:
+            #cleaned_row = re.sub(r"[+.,]", " ", term)
+            terms = delimiters_regex2.split(term)
+            for term in terms:
+                cleaned_row = delimiters_regex4.sub(" ", term)
+                matches = re.findall(pattern, cleaned_row)
+                if matches:
+                    for match in matches:
+                        # Match groups: (number, term) or (term, number)
+                        number1, term1, term2, number2 = match
+                        term = term1 if term1 else term2  # Choose the non-empty term
+                        count = number1 if number1 else number2  # Choose the non-empty number
+                        term = preprocess_term(term.strip())  # Normalize to lowercase
+                        count = int(count)  # Convert count to integer
+                        #Find the corresponding key in reference_dict
                         if term in mapping_dict:
+                            mapping_count[mapping_dict[term]]= mapping_count[mapping_dict[term]] + int(count)
                             termX = mapping_dict[term]
-                            countX = 1
-                            mapping_count[mapping_dict[term]] = countX
-                        else:                                               # Unmapped 
-                            termX = "unknown"
-                            countX = 1
-                            mapping_count[mapping_dict["unknown"]] = mapping_count[mapping_dict["unknown"]] + countX
-            else:
-                terms = delimiters_regex2.split(term)
-                for term in terms:
-                    term = preprocess_term(term.strip())  # Normalize to lowercase
-                    if term in mapping_dict:
-                        count = mapping_count[mapping_dict[term]]
-                        mapping_count[mapping_dict[term]] = count + 1
-                        termX = mapping_dict[term]
-                        countX = mapping_count[mapping_dict[term]]
-                    else:
-                        term = preprocess_term(pre_post_fix.sub('', term))  # Replace "and/or/y" with a comma
+                            countX = mapping_count[mapping_dict[term]]
+                        else:
+                            term = preprocess_term(pre_post_fix.sub('', term))  # Replace "and/or/y" with a comma
+                            if term in mapping_dict:
+                                termX = mapping_dict[term]
+                                countX = 1
+                                mapping_count[mapping_dict[term]] = countX
+                            else:                                               # Unmapped 
+                                termX = "unknown"
+                                countX = 1
+                                mapping_count[mapping_dict["unknown"]] = mapping_count[mapping_dict["unknown"]] + countX
+                else:
+                    terms = delimiters_regex2.split(term)
+                    for term in terms:
+                        term = preprocess_term(term.strip())  # Normalize to lowercase
                         if term in mapping_dict:
                             count = mapping_count[mapping_dict[term]]
                             mapping_count[mapping_dict[term]] = count + 1
                             termX = mapping_dict[term]
                             countX = mapping_count[mapping_dict[term]]
-                        else:                                               # Unmapped
-                            termX = "unknown"
-                            countX = 1
-                            mapping_count[mapping_dict["unknown"]] = mapping_count[mapping_dict["unknown"]] + countX
+                        else:
+                            term = preprocess_term(pre_post_fix.sub('', term))  # Replace "and/or/y" with a comma
+                            if term in mapping_dict:
+                                count = mapping_count[mapping_dict[term]]
+                                mapping_count[mapping_dict[term]] = count + 1
+                                termX = mapping_dict[term]
+                                countX = mapping_count[mapping_dict[term]]
+                            else:                                               # Unmapped
+                                termX = "unknown"
+                                countX = 1
+                                mapping_count[mapping_dict["unknown"]] = mapping_count[mapping_dict["unknown"]] + countX
+                #print(termX, "\t", countX)
+        else:
+            mapping_count[mapping_dict[term]] = 1
+            termX = mapping_dict[term]
+            countX = 1
+            mapping_count[mapping_dict[term]] = countX
             #print(termX, "\t", countX)
-    else:
-        mapping_count[mapping_dict[term]] = 1
-        termX = mapping_dict[term]
-        countX = 1
-        mapping_count[mapping_dict[term]] = countX
-        #print(termX, "\t", countX)
-    # Use dictionary comprehension to filter out pairs with value 0
-    filtered_dict = {k: v for k, v in mapping_count.items() if v != 0}
-    #print(filtered_dict)
-    return filtered_dict
+        # Use dictionary comprehension to filter out pairs with value 0
+        filtered_dict = {k: v for k, v in mapping_count.items() if v != 0}
+        #print(filtered_dict)
+        return filtered_dict
+
+
+sexParser = None
+
+def get_sex_parser():
+    '''
+    Returns the SexParser shared by the generators, which is created on the first call.
+    '''
+    global sexParser
+    if sexParser is None:
+        sexParser = SexParser()
+    return sexParser
+
+
+def map_terms_to_values(term):
+    return get_sex_parser().parse(term)
@@ -0,0 +1,65 @@
+import os
+import gzip
+import io
+
+
+class RejectWriter:
+    '''
+    Side channel of the records dropped by a generator: a gzipped TSV file with a reason code and a detail in front of
+    the columns of every rejected record, which can be queried instead of reading the diagnostic output.
+    Rejected records are kept in memory and written once per batch as a separate gzip member, so the file can be cut
+    back to the end of the last complete batch when a run is resumed, like the output file.
+
+    :param reject_file: Path to the gzipped TSV file.
+    :param resume_size: Size of the file after the last complete batch of an interrupted run, None to start a new file.
+    '''
+    def __init__(self, reject_file, resume_size=None):
+        self.reject_file = reject_file
+        self.parts = []
+        if resume_size is not None and os.path.exists(reject_file):
+            with open(reject_file, "r+b") as f:
+                f.truncate(resume_size)
+            self.header = resume_size > 0
+        else:
+            open(reject_file, "wb").close()
+            self.header = False  # written with the columns of the first rejected records
+
+    def reject(self, reason, records, details=""):
+        """
+        Add rejected records, to be written with the next flush.
+
+        :param reason: Reason code of all the records, e.g. "no_wd_mapping".
+        :param records: DataFrame with the rejected records.
+        :param details: Detail of every record (a sequence), or the same detail for all of them.
+        """
+        if len(records) == 0:
+            return
+        frame = records.copy()
+        frame.insert(0, "detail", details)
+        frame.insert(0, "reason", reason)
+        buffer = io.StringIO()
+        frame.to_csv(buffer, sep="\t", index=False, header=not self.header, lineterminator="\n")
+        self.header = True
+        self.parts.append(buffer.getvalue())
+
+    def take(self):
+        """
+        Return the rejected records added since the last flush or take as TSV text, and forget them (see write).
+        """
+        text = "".join(self.parts)
+        self.parts = []
+        return text
+
+    def write(self, text):
+        """
+        Append TSV text returned by take to the file, as one gzip member.
+
+        :return: Size of the file, to be recorded for a resumed run.
+        """
+        with open(self.reject_file, "ab") as f:
+            if text:
+                f.write(gzip.compress(text.encode("utf-8"), mtime=0))
+            return f.tell()
+
+    def flush(self):
+        return self.write(self.take())
@@ -0,0 +1,152 @@
+import sys
+import time
+import json
+import contextlib
+
+
+# Levels of the diagnostic output, from the least to the most verbose
+log_levels = {"quiet": 0, "info": 1, "debug": 2}
+
+
+class RunMetrics:
+    '''
+    Counters, stage timings and sampled diagnostic output of a generator run, replacing the print() of every row.
+
+    Counters are identified by a name and optional labels, e.g. count("rows_dropped", reason="same_source_target").
+    Diagnostics are printed according to the level: nothing with "quiet", the first sample_first lines of every
+    category and then one line out of sample_every with "info", and every line with "debug".
+
+    :param level: "quiet", "info" or "debug".
+    :param sample_every: With "info", print one diagnostic line out of sample_every for every category.
+    :param sample_first: With "info", number of diagnostic lines always printed for every category.
+    :param out: Text stream receiving the diagnostic output.
+    '''
+    def __init__(self, level="info", sample_every=1000, sample_first=10, out=None):
+        self.counters = {}
+        self.timers = {}
+        self.diagnostics = {}
+        self.reported = {}
+        self.configure(level, sample_every, sample_first, out)
+
+    def configure(self, level="info", sample_every=1000, sample_first=10, out=None):
+        if level not in log_levels:
+            raise ValueError(f"Unknown log level {level}, expected one of {', '.join(log_levels)}")
+        self.level = log_levels[level]
+        self.sample_every = max(1, sample_every)
+        self.sample_first = sample_first
+        self.out = out
+
+    def reset(self):
+        """
+        Reset the counters and the timers, e.g. in a worker process before every task whose snapshot is merged by the
+        parent. The numbers of diagnostics of every category are kept, so that a category is sampled over the whole
+        run (the first sample_first lines are printed once per process, not once per task); the snapshot only counts
+        the diagnostics since the reset.
+        """
+        self.counters = {}
+        self.timers = {}
+        self.reported = dict(self.diagnostics)
+
+    def count(self, name, n=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + n
+
+    def add_time(self, name, seconds):
+        timer = self.timers.get(name)
+        if timer is None:
+            self.timers[name] = [1, seconds, seconds]
+        else:
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        """
+        Time a stage, e.g. with metrics.timer("batch"): ...
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def sample(self, category):
+        """
+        Count a diagnostic of a category (e.g. SAME-SOURCE-TARGET), and tell whether it should be printed according to
+        the level. Used with write when the line is expensive to build.
+        """
+        seen = self.diagnostics.get(category, 0) + 1
+        self.diagnostics[category] = seen
+        if self.level == 0:
+            return False
+        return self.level == 2 or seen <= self.sample_first or seen % self.sample_every == 0
+
+    def write(self, category, *fields):
+        print(*fields, category, sep="\t", file=self.out or sys.stdout)
+
+    def diagnostic(self, category, *fields):
+        """
+        Print a tab separated diagnostic line ending with its category, if it is sampled (see sample).
+        """
+        if self.sample(category):
+            self.write(category, *fields)
+
+    def snapshot(self):
+        """
+        Return the counters, timers and diagnostics since the last reset in a picklable form, to be merged by another
+        process (see merge).
+        """
+        diagnostics = {category: n - self.reported.get(category, 0) for category, n in self.diagnostics.items()}
+        return {"counters": dict(self.counters), "timers": {name: list(timer) for name, timer in self.timers.items()},
+                "diagnostics": {category: n for category, n in diagnostics.items() if n}}
+
+    def merge(self, snapshot):
+        for key, n in snapshot["counters"].items():
+            self.counters[key] = self.counters.get(key, 0) + n
+        for name, (calls, total, longest) in snapshot["timers"].items():
+            timer = self.timers.setdefault(name, [0, 0.0, 0.0])
+            timer[0] += calls
+            timer[1] += total
+            timer[2] = max(timer[2], longest)
+        for category, n in snapshot["diagnostics"].items():
+            self.diagnostics[category] = self.diagnostics.get(category, 0) + n
+
+    def to_json(self):
+        return {
+            "counters": [{"name": name, "labels": dict(labels), "value": n} for (name, labels), n in sorted(self.counters.items())],
+            "timers": [{"name": name, "count": calls, "total_seconds": total, "max_seconds": longest}
+                       for name, (calls, total, longest) in sorted(self.timers.items())],
+            "diagnostics": [{"category": category, "value": n} for category, n in sorted(self.diagnostics.items())],
+        }
+
+    def to_prometheus(self, prefix="emi_"):
+        lines = []
+        for (name, labels), n in sorted(self.counters.items()):
+            labelStr = ",".join(f'{label}="{prometheus_escape(value)}"' for label, value in labels)
+            lines.append(f"{prefix}{name}_total{{{labelStr}}} {n}" if labelStr else f"{prefix}{name}_total {n}")
+        for name, (calls, total, longest) in sorted(self.timers.items()):
+            lines.append(f'{prefix}stage_seconds_count{{stage="{name}"}} {calls}')
+            lines.append(f'{prefix}stage_seconds_sum{{stage="{name}"}} {total:.6f}')
+            lines.append(f'{prefix}stage_seconds_max{{stage="{name}"}} {longest:.6f}')
+        for category, n in sorted(self.diagnostics.items()):
+            lines.append(f'{prefix}diagnostics_total{{category="{prometheus_escape(category)}"}} {n}')
+        return "\n".join(lines) + "\n"
+
+    def dump(self, metrics_file):
+        """
+        Write the metrics to a file, as Prometheus text if its name ends with .prom, and as JSON otherwise.
+        """
+        with open(metrics_file, "w") as f:
+            if metrics_file.endswith(".prom"):
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.to_json(), f, indent=2)
+
+
+def prometheus_escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# metrics of the current run, shared by the generators and their helper modules
+metrics = RunMetrics()
@@ -0,0 +1,143 @@
+import sys
+import argparse
+import numpy as np
+import pandas as pd
+
+import data_processing as dp
+
+# pyarrow is only needed for the Parquet staging files, the gzipped TSV files are read without it
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+
+# Function to tell whether an input file is a Parquet staging file instead of a gzipped TSV file
+def is_parquet(file_path):
+    return str(file_path).endswith(".parquet")
+
+
+def require_pyarrow():
+    if pa is None:
+        raise ImportError("Parquet staging files need pyarrow (pip install -r requirements.txt)")
+
+
+class ParquetStagingWriter:
+    '''
+    Writer of a Parquet staging file, appending DataFrames read from the gzipped TSV files chunk by chunk. All columns
+    are stored as strings, like the TSV files read with dtype=str, and dictionary-encoded, so that the low-cardinality
+    columns (kingdom, phylum, interaction type, namespace, ...) take a few bits per row. Every chunk is a row group,
+    whose statistics let the readers skip the row groups which do not match a filter.
+
+    :param output_file: Path to the Parquet file.
+    :param compression: Parquet compression codec.
+    '''
+    def __init__(self, output_file, compression="zstd"):
+        require_pyarrow()
+        self.output_file = output_file
+        self.compression = compression
+        self.writer = None
+
+    def write(self, frame):
+        if self.writer is None:
+            self.schema = pa.schema([(column, pa.string()) for column in frame.columns])
+            self.writer = pq.ParquetWriter(self.output_file, self.schema, compression=self.compression, use_dictionary=True)
+        frame = frame.astype(object).where(frame.notna(), None)
+        self.writer.write_table(pa.Table.from_pandas(frame, schema=self.schema, preserve_index=False))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Function to convert a table read from a staging file to a DataFrame like the ones read from the TSV files
+def to_frame(table):
+    frame = table.to_pandas()
+    return frame.astype(object).where(frame.notna(), np.nan)  # missing values are NaN, as with pd.read_csv(dtype=str)
+
+
+# Function for a filter keeping the rows whose column is one of the values, see read_parquet
+def column_in(column, values):
+    require_pyarrow()
+    return ds.field(column).isin(list(values))
+
+
+def read_parquet(file_path, columns=None, filter=None):
+    """
+    Read a Parquet staging file, or the columns and the rows of it which are needed.
+
+    :param columns: Columns to read (projection), all of them by default.
+    :param filter: pyarrow.dataset expression (e.g. column_in("sourceTaxonKingdomName", ["Archaeplastida"])), pushed
+        down to the row groups.
+    """
+    require_pyarrow()
+    return to_frame(ds.dataset(file_path, format="parquet").to_table(columns=columns, filter=filter))
+
+
+def read_parquet_chunks(file_path, chunksize, start_offset=0, columns=None, filter=None):
+    """
+    Read a Parquet staging file in chunks of rows, like read_tsv_gz_chunks.
+
+    :param chunksize: Number of rows per chunk.
+    :param start_offset: Number of (filtered) rows to skip, as given after an earlier chunk.
+    :param columns, filter: See read_parquet.
+    :return: Iterator over (DataFrame, offset of the next row) tuples.
+    """
+    require_pyarrow()
+    scanner = ds.dataset(file_path, format="parquet").scanner(columns=columns, filter=filter, batch_size=chunksize)
+    offset = 0
+    pending = None
+    for batch in scanner.to_batches():
+        if offset + batch.num_rows <= start_offset:  # skipped without converting it
+            offset += batch.num_rows
+            continue
+        if offset < start_offset:
+            batch = batch.slice(start_offset - offset)
+            offset = start_offset
+        table = pa.Table.from_batches([batch])
+        pending = table if pending is None else pa.concat_tables([pending, table])
+        # the scanner gives the row groups in batches of at most chunksize rows, regroup them in chunks of chunksize rows
+        while pending.num_rows >= chunksize:
+            offset += chunksize
+            yield to_frame(pending.slice(0, chunksize)), offset
+            pending = pending.slice(chunksize)
+    if pending is not None and pending.num_rows > 0:
+        yield to_frame(pending), offset + pending.num_rows
+
+
+def read_input_chunks(file_path, chunksize, start_offset=0, columns=None):
+    """
+    Read a gzipped TSV input file (see data_processing.read_tsv_gz_chunks) or a Parquet staging file (see read_parquet_chunks) in chunks.
+    The offsets are uncompressed byte offsets for a TSV file and row numbers for a staging file.
+    """
+    if is_parquet(file_path):
+        return read_parquet_chunks(file_path, chunksize, start_offset, columns)
+    chunks = dp.read_tsv_gz_chunks(file_path, chunksize, start_offset)
+    return ((chunk[columns], offset) for chunk, offset in chunks) if columns else chunks
+
+
+# Function to write a Parquet staging file from a gzipped TSV file, e.g. the TRY export or the taxonomy file
+def tsv_to_parquet(input_file, output_file, encoding="utf-8", chunksize=1000000):
+    with ParquetStagingWriter(output_file) as writer:
+        for chunk in pd.read_csv(input_file, compression="gzip", sep="\t", dtype=str, encoding=encoding, chunksize=chunksize):
+            writer.write(chunk)
+
+
+# Main execution
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a gzipped TSV input file to a Parquet staging file")
+    parser.add_argument('inputFile', type=str, help="Enter the gzipped TSV file")
+    parser.add_argument('outputFile', type=str, help="Enter the Parquet file name (.parquet)")
+    parser.add_argument('--encoding', type=str, default="utf-8", help="Encoding of the TSV file (iso-8859-1 for the TRY export)")
+    args = parser.parse_args()
+    if not is_parquet(args.outputFile):
+        sys.exit("The output file name should end with .parquet")
+    tsv_to_parquet(args.inputFile, args.outputFile, args.encoding)
@@ -0,0 +1,201 @@
+import numpy as np
+import pandas as pd
+
+from run_metrics import metrics
+
+
+# markers of the infraspecific ranks, dropped from the normalized names ("Quercus robur subsp. robur" -> "quercus robur robur")
+rankMarkers = {"subsp.", "ssp.", "subsp", "ssp", "var.", "var", "subvar.", "f.", "forma", "subf.", "cv."}
+
+
+# Function to normalize a taxon name before matching it
+def normalize_name(name):
+    """
+    Reduce a taxon name to its genus and epithets, in lower case: the author string, the year and anything in
+    parentheses are dropped, from the first word after the genus which is not a lower-case epithet.
+
+    :return: The normalized name, "" for a missing name.
+    """
+    if not isinstance(name, str):
+        return ""
+    tokens = name.split()
+    if not tokens:
+        return ""
+    kept = [tokens[0].strip("\"'").lower()]
+    for token in tokens[1:]:
+        if token.lower() in rankMarkers:
+            continue
+        if not (token.islower() and token.replace("-", "").isalnum()):
+            break  # author, year, "(...)", "&", ...
+        kept.append(token)
+    return " ".join(kept)
+
+
+# Function for the codes of the character trigrams of strings joined by line breaks, with the string of every trigram
+def trigram_codes(text):
+    # one code point per uint32, three code points of at most 21 bits per code
+    chars = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    codes = (chars[:-2] << np.uint64(42)) | (chars[1:-1] << np.uint64(21)) | chars[2:]
+    breaks = chars == 10
+    valid = ~(breaks[:-2] | breaks[1:-1] | breaks[2:])  # trigrams across two strings
+    strings = np.cumsum(breaks)[:-2]
+    return codes[valid], strings[valid]
+
+
+# Function for the edit distance of two strings, if it is at most max_distance
+def bounded_levenshtein(a, b, max_distance):
+    """
+    Levenshtein distance of a and b, computed on the diagonal band of width 2 * max_distance + 1 only, and stopped as
+    soon as every cell of a row exceeds max_distance.
+
+    :return: The distance, or max_distance + 1 if it is larger than max_distance.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    if len(a) > len(b):
+        a, b = b, a
+    over = max_distance + 1
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        lo, hi = max(1, i - max_distance), min(len(b), i + max_distance)
+        current = [over] * (len(b) + 1)
+        current[0] = i if i <= max_distance else over
+        charA = a[i - 1]
+        for j in range(lo, hi + 1):
+            cost = previous[j - 1] + (charA != b[j - 1])
+            if previous[j] + 1 < cost:
+                cost = previous[j] + 1
+            if current[j - 1] + 1 < cost:
+                cost = current[j - 1] + 1
+            current[j] = cost if cost < over else over
+        if min(current[lo - 1:hi + 1]) > max_distance:
+            return over
+        previous = current
+    return min(previous[len(b)], over)
+
+
+class TaxonNameMatcher:
+    '''
+    Approximate matcher of taxon names, for the names which have no exact match: misspellings, author strings,
+    infraspecific epithets. The reference names are normalized (see normalize_name) and indexed by their character
+    trigrams, as a sorted array of the distinct trigram codes with the offsets of their lists of names (CSR), so that
+    millions of names take a few arrays instead of Python objects.
+
+    A name within max_distance edits of a query shares at least (trigrams of the query - 3 * max_distance) trigrams
+    with it, so only the names in the rarest 3 * max_distance + 1 lists of trigrams of the query can match. These
+    candidates are filtered on their length and on the number of trigrams they share with the query, and verified
+    with bounded_levenshtein. Queries too short for this bound are not matched.
+
+    :param names: Reference taxon names (e.g. the WdName column of the lineage file).
+    :param ids: WdIDs of the reference names.
+    :param max_distance: Largest edit distance between the normalized query and reference names.
+    :param max_candidates: Largest number of candidates verified per query, those sharing the most trigrams first.
+    '''
+    def __init__(self, names, ids, max_distance=2, max_candidates=1000):
+        self.max_distance = max_distance
+        self.max_candidates = max_candidates
+        reference = pd.DataFrame({"name": [normalize_name(name) for name in names], "id": list(ids)})
+        reference = reference[(reference["name"] != "") & reference["id"].notna()].drop_duplicates()
+        self.names = reference["name"].to_numpy(dtype=object)
+        self.ids = reference["id"].to_numpy(dtype=object)
+        self.lengths = reference["name"].str.len().to_numpy()
+        self.cache = {}
+
+        # (trigram, name) pairs, sorted by trigram and deduplicated. The names of a trigram are stored as
+        # (length << 32 | name number) keys sorted by length, so that the names of a length range are a slice of the list
+        codes, strings = trigram_codes("\n".join(f" {name} " for name in self.names))
+        keys = (self.lengths[strings].astype(np.int64) << 32) | strings
+        order = np.lexsort((keys, codes))
+        codes, keys = codes[order], keys[order]
+        distinct = np.ones(len(codes), dtype=bool)
+        distinct[1:] = (codes[1:] != codes[:-1]) | (keys[1:] != keys[:-1])
+        codes, self.postings = codes[distinct], keys[distinct]
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]) if len(codes) else np.empty(0, dtype=np.int64)
+        self.grams = codes[starts]
+        self.offsets = np.r_[starts, len(codes)]
+
+    def candidates(self, query):
+        grams = np.unique(trigram_codes(f" {query} ")[0])
+        need = len(grams) - 3 * self.max_distance
+        if need < 1:
+            return np.empty(0, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.grams, grams), max(len(self.grams) - 1, 0))
+        found = (self.grams[pos] == grams) if len(self.grams) else np.zeros(len(grams), dtype=bool)
+        rarest = np.count_nonzero(found) - need + 1
+        if rarest < 1:
+            return np.empty(0, dtype=np.int64)
+        # the names of every trigram whose length is within max_distance of the query
+        lowKey = max(len(query) - self.max_distance, 0) << 32
+        highKey = (len(query) + self.max_distance + 1) << 32
+        lists = []
+        for p in pos[found]:
+            names = self.postings[self.offsets[p]:self.offsets[p + 1]]
+            lists.append(names[np.searchsorted(names, lowKey):np.searchsorted(names, highKey)])
+        lists.sort(key=len)
+        candidates, shared = np.unique(np.concatenate(lists[:rarest]), return_counts=True)
+        # count the other trigrams of the candidates by a binary search in their (sorted) lists, dropping the
+        # candidates which cannot share enough trigrams anymore
+        for k in range(rarest, len(lists)):
+            if not len(candidates):
+                break
+            names = lists[k]
+            if len(names):
+                shared += names[np.minimum(np.searchsorted(names, candidates), len(names) - 1)] == candidates
+            enough = shared + (len(lists) - k - 1) >= need
+            candidates, shared = candidates[enough], shared[enough]
+        if len(candidates) > self.max_candidates:
+            candidates = candidates[np.argsort(-shared, kind="stable")[:self.max_candidates]]
+        return candidates & 0xFFFFFFFF
+
+    def match(self, name):
+        """
+        Match one name. A name whose normalized form has infraspecific epithets and no match is matched again on its
+        genus and species epithet.
+
+        :return: Tuple (WdID, matched normalized name, distance, status), with WdID None if no single WdID matches.
+            The status is ID-MATCHED-BY-NAME-normalized (distance 0), ID-MATCHED-BY-NAME-fuzzy, NAME-MATCHED-AMBIGUOUS
+            (several WdIDs at the smallest distance) or NAME-NOT-MATCHED.
+        """
+        query = normalize_name(name)
+        while query:
+            best, hits = self.max_distance + 1, []
+            for k in self.candidates(query):
+                distance = bounded_levenshtein(query, self.names[k], best)
+                if distance < best:
+                    best, hits = distance, [k]
+                elif distance == best and distance <= self.max_distance:
+                    hits.append(k)
+            if hits:
+                if len(set(self.ids[hits])) > 1:
+                    return None, self.names[hits[0]], best, "NAME-MATCHED-AMBIGUOUS"
+                status = "ID-MATCHED-BY-NAME-normalized" if best == 0 else "ID-MATCHED-BY-NAME-fuzzy"
+                return self.ids[hits[0]], self.names[hits[0]], best, status
+            words = query.split()
+            query = " ".join(words[:2]) if len(words) > 2 else ""
+        return None, None, None, "NAME-NOT-MATCHED"
+
+    def match_names(self, names):
+        """
+        Match the distinct names of a Series, see match.
+
+        :return: DataFrame indexed by name with the columns WdID, matchedName, distance, score (1 - distance / length
+            of the longer name) and Match_Status.
+        """
+        rows = {name: self.match(name) for name in pd.unique(names)}
+        result = pd.DataFrame.from_dict(rows, orient="index", columns=["WdID", "matchedName", "distance", "Match_Status"])
+        length = np.maximum(result["matchedName"].str.len(), [len(normalize_name(name)) for name in result.index])
+        result.insert(3, "score", 1 - result["distance"] / length)
+        return result
+
+    def lookup(self, names):
+        """
+        WdIDs of names (None if not matched), with the results remembered between calls. Used on the names left
+        unmapped by a generator, which repeat from batch to batch.
+        """
+        ids = []
+        for name in names:
+            if name not in self.cache:
+                self.cache[name] = self.match(name)[0]
+                metrics.count("taxon_names_fuzzy", status="matched" if self.cache[name] is not None else "unmatched")
+            ids.append(self.cache[name])
+        return np.array(ids, dtype=object)
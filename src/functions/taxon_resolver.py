@@ -0,0 +1,165 @@
+import os
+import sqlite3
+import argparse
+import pandas as pd
+
+
+# Number of keys per query of a batch lookup, below the limit of the SQLite variables
+lookupChunk = 900
+
+# Seconds a connection waits for the lock of another process (e.g. a rebuild of the tables) before failing
+busyTimeout = 600
+
+# tables of every source of the resolver, rebuilt together when their source file changes
+sourceTables = {
+    "globi": ["globi_taxon_id", "globi_taxon_name"],
+    "trydb": ["trydb_species"],
+}
+
+
+class TaxonResolver:
+    '''
+    Persistent index of the mappings of the taxa to Wikidata IDs, shared by the generators: the GloBI TaxonIds and
+    TaxonNames of the GloBI mapping file, and the TRY AccSpeciesNames of the TRY mapping file. The mappings are stored
+    in a SQLite file, built once from the mapping files (see update) and rebuilt when a mapping file changes, so that a
+    run opens the file instead of parsing the mapping files, and looks up the distinct keys of every batch.
+
+    The file is opened read-only, lazily and once per process, so that it can be used by forked workers and by any
+    number of processes at the same time. A process which opens it while another one rebuilds its tables waits for the
+    end of the rebuild (see busyTimeout).
+
+    :param db_file: Path to the SQLite file.
+    '''
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.connection = None
+        self.pid = None
+
+    def connect(self):
+        if self.connection is None or self.pid != os.getpid():  # a connection is not shared with a forked process
+            self.connection = sqlite3.connect(f"file:{self.db_file}?mode=ro", uri=True, check_same_thread=False, timeout=busyTimeout)
+            self.pid = os.getpid()
+        return self.connection
+
+    def update(self, wd_map_file=None, trydb_wd_file=None, trydb_name_column="TRY_AccSpeciesName"):
+        """
+        Build the tables of the given mapping files which are missing or older than their file. A table is rebuilt when
+        the path, the size or the modification time of its file (or the name column of the TRY mapping file) changes,
+        within one transaction, so that the readers see either the old or the new mapping.
+
+        :param wd_map_file: Path to the GloBI mapping file (CSV with the TaxonId, TaxonName, Mapped_ID_WD and Mapped_Value columns).
+        :param trydb_wd_file: Path to the TRY mapping file (gzipped TSV with the WdID column and the name column).
+        :param trydb_name_column: Column of the TRY species names in the TRY mapping file.
+        :return: The resolver.
+        """
+        connection = sqlite3.connect(self.db_file, isolation_level=None, timeout=busyTimeout)  # the transactions are explicit
+        try:
+            connection.execute("CREATE TABLE IF NOT EXISTS sources (source TEXT PRIMARY KEY, stamp TEXT)")
+            for source, file_path, column, load in [("globi", wd_map_file, "", load_globi_mapping),
+                                                     ("trydb", trydb_wd_file, trydb_name_column, lambda c, f: load_trydb_mapping(c, f, trydb_name_column))]:
+                if file_path is None:
+                    continue
+                stat = os.stat(file_path)
+                stamp = f"{os.path.abspath(file_path)}:{column}:{stat.st_size}:{stat.st_mtime_ns}"
+                row = connection.execute("SELECT stamp FROM sources WHERE source = ?", (source,)).fetchone()
+                if row is not None and row[0] == stamp:
+                    continue
+                connection.execute("BEGIN IMMEDIATE")
+                try:
+                    # another process may have built the tables while this one was waiting for the lock
+                    row = connection.execute("SELECT stamp FROM sources WHERE source = ?", (source,)).fetchone()
+                    if row is not None and row[0] == stamp:
+                        connection.execute("COMMIT")
+                        continue
+                    print(f"Building the {source} tables of {self.db_file} from {file_path}")
+                    for table in sourceTables[source]:
+                        connection.execute(f"DROP TABLE IF EXISTS {table}")
+                    load(connection, file_path)
+                    connection.execute("INSERT OR REPLACE INTO sources VALUES (?, ?)", (source, stamp))
+                    connection.execute("COMMIT")
+                except Exception:
+                    connection.execute("ROLLBACK")
+                    raise
+        finally:
+            connection.close()
+        self.connection = None  # reopened with the new tables
+        return self
+
+    def lookup(self, sql, keys):
+        # rows of the query for the distinct non-missing keys, queried in chunks
+        keys = pd.unique(pd.Series(keys).dropna())
+        rows = []
+        connection = self.connect()
+        for start in range(0, len(keys), lookupChunk):
+            chunk = [str(key) for key in keys[start:start + lookupChunk]]
+            rows.extend(connection.execute(sql.format(",".join("?" * len(chunk))), chunk).fetchall())
+        return rows
+
+    def globi_taxon_ids(self, taxon_ids):
+        """
+        Mapping of the GloBI TaxonIds of a batch.
+
+        :return: DataFrame indexed by the mapped TaxonIds, with the Mapped_ID_WD and Mapped_Value columns.
+        """
+        rows = self.lookup("SELECT taxon_id, wd_id, mapped_value FROM globi_taxon_id WHERE taxon_id IN ({})", taxon_ids)
+        return pd.DataFrame(rows, columns=["TaxonId", "Mapped_ID_WD", "Mapped_Value"], dtype=object).set_index("TaxonId")
+
+    def globi_taxon_names(self, taxon_names):
+        """
+        Mapping of the GloBI TaxonNames of a batch, see globi_taxon_ids.
+        """
+        rows = self.lookup("SELECT taxon_name, wd_id, mapped_value FROM globi_taxon_name WHERE taxon_name IN ({})", taxon_names)
+        return pd.DataFrame(rows, columns=["TaxonName", "Mapped_ID_WD", "Mapped_Value"], dtype=object).set_index("TaxonName")
+
+    def globi_mapped_names(self):
+        """
+        All the GloBI TaxonNames mapped to a WdID, e.g. as the reference names of a TaxonNameMatcher.
+
+        :return: DataFrame with the TaxonName and Mapped_ID_WD columns.
+        """
+        rows = self.connect().execute("SELECT taxon_name, wd_id FROM globi_taxon_name WHERE wd_id IS NOT NULL").fetchall()
+        return pd.DataFrame(rows, columns=["TaxonName", "Mapped_ID_WD"], dtype=object)
+
+    def trydb_species(self, names):
+        """
+        WdIDs of the TRY species names of a batch, in the order of the TRY mapping file.
+
+        :return: Dictionary of the list of WdIDs of every mapped name.
+        """
+        wdIds = {}
+        for name, wdId in self.lookup("SELECT name, wd_id FROM trydb_species WHERE name IN ({}) ORDER BY rowid", names):
+            wdIds.setdefault(name, []).append(wdId)
+        return wdIds
+
+
+# Function to load the GloBI mapping file in the tables of a resolver
+def load_globi_mapping(connection, wd_map_file):
+    wd_map_df = pd.read_csv(wd_map_file, sep=",", dtype=str, usecols=['TaxonId', 'TaxonName', 'Mapped_ID_WD', 'Mapped_Value'])
+    wd_map_df.replace({"Wikidata:" : '', '"': ''}, regex=True, inplace=True)
+    wd_map_df = wd_map_df.astype(object).where(wd_map_df.notna(), None)
+    for table, column, key in [("globi_taxon_id", "TaxonId", "taxon_id"), ("globi_taxon_name", "TaxonName", "taxon_name")]:
+        connection.execute(f"CREATE TABLE {table} ({key} TEXT PRIMARY KEY, wd_id TEXT, mapped_value TEXT) WITHOUT ROWID")
+        rows = wd_map_df[wd_map_df[column].notna() & (wd_map_df[column] != "")]
+        # the last row of a key is kept
+        connection.executemany(f"INSERT OR REPLACE INTO {table} VALUES (?, ?, ?)",
+                               rows[[column, "Mapped_ID_WD", "Mapped_Value"]].itertuples(index=False, name=None))
+
+
+# Function to load the TRY mapping file in the tables of a resolver
+def load_trydb_mapping(connection, trydb_wd_file, name_column):
+    data = pd.read_csv(trydb_wd_file, compression="gzip", sep="\t", dtype=str, usecols=[name_column, "WdID"])
+    data = data[data[name_column].notna() & data["WdID"].notna()]
+    connection.execute("CREATE TABLE trydb_species (name TEXT, wd_id TEXT)")
+    connection.executemany("INSERT INTO trydb_species VALUES (?, ?)", data[[name_column, "WdID"]].itertuples(index=False, name=None))
+    connection.execute("CREATE INDEX trydb_species_name ON trydb_species (name)")
+
+
+# Main execution
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or update the taxon resolver file from the mapping files")
+    parser.add_argument('dbFile', type=str, help="Enter the resolver file name (SQLite)")
+    parser.add_argument('--wd-map-file', type=str, default=None, help="GloBI mapping file of the TaxonIds and TaxonNames to WD")
+    parser.add_argument('--trydb-wd-file', type=str, default=None, help="TRY mapping file of the species names to WD (gzip)")
+    parser.add_argument('--trydb-name-column', type=str, default="TRY_AccSpeciesName", help="Column of the species names in the TRY mapping file")
+    args = parser.parse_args()
+    TaxonResolver(args.dbFile).update(args.wd_map_file, args.trydb_wd_file, args.trydb_name_column)
@@ -0,0 +1,105 @@
+import re
+import functools
+
+
+# Patterns shared by the parsers of free-text names (life stage, body part and biological sex), compiled once
+
+# conjunction patterns
+conjunction_patterns1 = re.compile(r'\b(and|y)\b', re.IGNORECASE)
+conjunction_patterns2 = re.compile(r'\b(or)\b', re.IGNORECASE)
+
+# pre_post fixes
+pre_post_fix = re.compile(r"(adult[as]?|tortere|juvenil[e]?|maybe|\(?torete[s]?\)?)", re.IGNORECASE)
+
+# delimiters to be considered
+delimiters_regex = re.compile(r"[,;/|&]+", re.IGNORECASE)                          # Removed '-'
+delimiters_regex1 = re.compile(r"[\[\]\(\)\?\#:`]+", re.IGNORECASE)                # Removed '-'
+delimiters_regex2 = re.compile(r"[+.,]+", re.IGNORECASE)
+delimiters_regex3 = re.compile(r"\s\s", re.IGNORECASE)
+delimiters_regex4 = re.compile(r"[+.,]")
+
+# patterns for matching strings like "12 male, 3 female"
+pattern = re.compile(r"(\d+)\s*([\w-]+)|([\w-]+)\s*(\d+)")
+
+# runs of word characters, the only places where the conjunction patterns can match
+word_run = re.compile(r"\w+")
+
+
+@functools.lru_cache(maxsize=4096)
+def normalize_separator(separator):
+    '''
+    Applies the delimiter substitutions to a run of non-word characters.
+    '''
+    separator = delimiters_regex.sub(',', separator)
+    separator = delimiters_regex1.sub(' ', separator)
+    return delimiters_regex3.sub(' ', separator)
+
+
+@functools.lru_cache(maxsize=100000)
+def normalize_term(term):
+    '''
+    Lower-cases a name, replaces the conjunctions and normalizes the delimiters in one pass over its word runs.
+    Gives the same result as lower().strip() followed by the substitutions of conjunction_patterns1,
+    conjunction_patterns2, delimiters_regex, delimiters_regex1 and delimiters_regex3, one after the other:
+    the conjunctions are whole words, and the delimiters never contain word characters, so every substitution
+    stays within the separator between two kept words.
+
+    :param term: The name as written in the input file.
+    :return: The normalized name, to be split with delimiters_regex2.
+    '''
+    term = term.lower().strip()
+    parts = []
+    separator = []
+    pos = 0
+    for m in word_run.finditer(term):
+        separator.append(term[pos:m.start()])
+        word = m.group()
+        if word == "and" or word == "y":
+            separator.append(',')
+        elif word != "or":
+            parts.append(normalize_separator("".join(separator)))
+            parts.append(word)
+            separator = []
+        pos = m.end()
+    separator.append(term[pos:])
+    parts.append(normalize_separator("".join(separator)))
+    return "".join(parts)
+
+
+# Preprocessing functions - Lowercase, autocorrect, and remove extra characters (plural)
+@functools.lru_cache(maxsize=100000)
+def preprocess_term(term):
+    term = term.lower().strip()  # Convert to lowercase and remove extra spaces
+    if "mono" not in term and "auto" not in term:
+        if term.endswith('s'):
+            term = term[:-1]  # Remove trailing 's' to handle plurals
+    return term
+
+
+class TermIndex:
+    '''
+    Hash index over the terms of the mapping files, telling with one dictionary probe whether a term has a URI
+    (URI-FETCHED-1) or only a name (URI-FETCHED-1a). Tokens are looked up as lookup_term always did: first after
+    preprocess_term, then again without their pre/post-fixes.
+
+    :param uriSet: Terms which have a URI.
+    :param namesSet: Terms which have a name.
+    :param cache_size: Number of distinct tokens kept in the cache of find.
+    '''
+    def __init__(self, uriSet, namesSet, cache_size=100000):
+        self.fetchtypes = {term: "URI-FETCHED-1a" for term in namesSet}
+        self.fetchtypes.update({term: "URI-FETCHED-1" for term in uriSet})  # a URI takes precedence over a name
+        self.find = functools.lru_cache(maxsize=cache_size)(self.find_term)
+
+    def find_term(self, term):
+        """
+        Look up a token, without the cache (see find).
+
+        :return: The (term, fetchtype) under which the token was found, fetchtype is None if it was not found.
+        """
+        term = preprocess_term(term)
+        fetchtype = self.fetchtypes.get(term)
+        if fetchtype is None:
+            term = preprocess_term(pre_post_fix.sub('', term))
+            fetchtype = self.fetchtypes.get(term)
+        return term, fetchtype
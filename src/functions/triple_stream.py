@@ -0,0 +1,107 @@
+import re
+from urllib.parse import quote
+from rdflib import URIRef, Literal, BNode
+from data_processing import INVERSE_RELATIONS
+
+
+# characters which are not allowed inside an IRIREF of N-Triples/Turtle
+iri_unsafe = re.compile(r'[\x00-\x20<>"{}|^`\\]')
+# characters which have to be escaped inside a quoted literal
+literal_unsafe = re.compile(r'[\\"\n\r]')
+literal_escapes = {"\\": "\\\\", '"': '\\"', "\n": "\\n", "\r": "\\r"}
+
+
+def escape_iri(iri):
+    '''
+    Percent-encodes the characters that cannot appear in an IRI reference.
+
+    :param iri: The IRI as a string.
+    :return: The IRI that can be written between angle brackets.
+    '''
+    if iri_unsafe.search(iri):
+        return iri_unsafe.sub(lambda m: quote(m.group(0), safe=""), iri)
+    return iri
+
+
+def escape_literal(value):
+    '''
+    Escapes backslashes, quotes and line breaks of a literal value.
+
+    :param value: The lexical form of the literal.
+    :return: The lexical form that can be written between double quotes.
+    '''
+    if literal_unsafe.search(value):
+        return literal_unsafe.sub(lambda m: literal_escapes[m.group(0)], value)
+    return value
+
+
+def term_to_nt(node):
+    '''
+    Returns the N-Triples form of an rdflib term (URIRef, BNode or Literal).
+    f-strings are used on purpose, concatenating to a URIRef would create (and validate) a new URIRef.
+    '''
+    if isinstance(node, Literal):
+        lexical = f'"{escape_literal(str(node))}"'
+        if node.language:
+            return f"{lexical}@{node.language}"
+        if node.datatype:
+            return f"{lexical}^^<{escape_iri(node.datatype)}>"
+        return lexical
+    if isinstance(node, BNode):
+        return f"_:{node}"
+    return f"<{escape_iri(node)}>"
+
+
+class TripleStream:
+    '''
+    Drop-in replacement of rdflib.Graph for the triple generators which writes every added triple
+    straight to an open text file as N-Triples (valid Turtle after the prefix header), instead of
+    keeping them in memory for a later sort and serialization. Inverse relationships are written
+    together with the triple they belong to.
+
+    :param out_file: Text file handle the triples are written to.
+    :param inverse: Add the inverse triples of dp.INVERSE_RELATIONS while writing.
+    :param buffer_size: Number of lines kept in memory before they are written to out_file.
+    '''
+    def __init__(self, out_file, inverse=True, buffer_size=10000):
+        self.out_file = out_file
+        self.inverse = inverse
+        self.buffer_size = buffer_size
+        self.lines = []
+        self.count = 0
+        # precompiled " <predicate> " templates, and inverse templates for the predicates which have one
+        self.predicates = {}
+        self.inversePredicates = {}
+
+    def bind(self, prefix, namespace):
+        # prefixes are written once per file by the generators, nothing to do for N-Triples
+        pass
+
+    def predicate_template(self, pred):
+        template = self.predicates.get(pred)
+        if template is None:
+            template = self.predicates[pred] = f" <{escape_iri(pred)}> "
+            inverse_pred = INVERSE_RELATIONS.get(str(pred))
+            if inverse_pred is not None:
+                self.inversePredicates[pred] = f" <{escape_iri(inverse_pred)}> "
+        return template
+
+    def add(self, triple):
+        subj, pred, obj = triple
+        subjNt = term_to_nt(subj)
+        objNt = term_to_nt(obj)
+        self.lines.append(subjNt + self.predicate_template(pred) + objNt + " .\n")
+        self.count += 1
+        if self.inverse and pred in self.inversePredicates and isinstance(obj, URIRef):  # Only create inverses for URI objects
+            self.lines.append(objNt + self.inversePredicates[pred] + subjNt + " .\n")
+            self.count += 1
+        if len(self.lines) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.lines:
+            self.out_file.write("".join(self.lines))
+            self.lines = []
+
+    def __len__(self):
+        return self.count
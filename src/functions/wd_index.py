@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+
+import data_processing as dp
+
+
+# Forms of the Wikidata IDs held as numbers, the other values are compared as strings
+wd_id_forms = ["", "wd:", "http://www.wikidata.org/entity/"]
+wd_id_pattern = r"^(" + "|".join(form.replace(".", r"\.") for form in wd_id_forms) + r")Q([1-9][0-9]{0,17})$"
+
+# Version of the cache files, whose content changes with the keys of parse_wd_ids
+cache_version = 2
+
+
+# Function to parse Wikidata IDs (Q123, wd:Q123 or http://www.wikidata.org/entity/Q123) to keys, -1 if it is not an ID
+def parse_wd_ids(column):
+    """
+    Key every value of a column by the number of its Q-ID and its form, so that two values have the same key only if
+    they are the same string. Values which are not an ID in one of the forms of wd_id_forms (other prefixes, leading
+    zeros, spaces, ...) get -1.
+
+    :return: Array of int64 keys.
+    """
+    parts = column.astype(object).str.extract(wd_id_pattern)
+    numbers = pd.to_numeric(parts[1], errors="coerce")
+    keys = numbers * len(wd_id_forms) + parts[0].map({form: k for k, form in enumerate(wd_id_forms)})
+    return keys.fillna(-1).to_numpy(dtype=np.int64)
+
+
+class WdIdIndex:
+    '''
+    Set of Wikidata taxa (e.g. the taxa of ENPKG) held as the sorted array of the keys of their Q-IDs (see
+    parse_wd_ids), which takes 8 bytes per taxon and checks the membership of a whole column at once with a binary
+    search. The few values which are not Q-IDs are kept as strings, so that the membership is exactly the one of
+    column.isin(ids).
+
+    :param ids: Column or sequence of Q-IDs.
+    '''
+    def __init__(self, ids):
+        ids = pd.Series(ids, dtype=object)
+        keys = parse_wd_ids(ids)
+        self.ids = np.unique(keys[keys >= 0])
+        self.others = pd.unique(ids[keys < 0])
+
+    @classmethod
+    def load(cls, csv_file, column, cache_file=None):
+        """
+        Load the Q-IDs of a column of a gzipped TSV file, from the cache of the index if the file did not change since
+        the cache was written.
+
+        :param csv_file: Path to the gzipped TSV file, e.g. enpkg_wd_pfId.csv.gz.
+        :param column: Column of the Q-IDs.
+        :param cache_file: Path to the cache, <csv_file>.<column>.npz by default.
+        """
+        cache_file = cache_file or f"{csv_file}.{column}.npz"
+        digest = dp.files_digest([csv_file], extra=f"{column}:{cache_version}")
+        index = cls([])
+        try:
+            with np.load(cache_file, allow_pickle=True) as cache:
+                if str(cache["digest"]) == digest:
+                    index.ids, index.others = cache["ids"], cache["others"]
+                    return index
+        except (OSError, KeyError, ValueError):
+            pass  # no cache yet, or an unreadable one
+        index = cls(pd.read_csv(csv_file, compression="gzip", sep="\t", dtype=str, usecols=[column])[column])
+        try:
+            with open(cache_file, "wb") as f:
+                np.savez(f, ids=index.ids, others=index.others, digest=np.array(digest))
+        except OSError:
+            pass  # e.g. a read-only data directory, the index is parsed again by the next run
+        return index
+
+    def __len__(self):
+        return len(self.ids) + len(self.others)
+
+    def contains(self, column):
+        """
+        Tell which values of a column of Q-IDs are in the set, like column.isin(ids).
+
+        :return: Boolean Series with the index of the column.
+        """
+        keys = parse_wd_ids(column)
+        positions = np.minimum(np.searchsorted(self.ids, keys), max(len(self.ids) - 1, 0))
+        found = (self.ids[positions] == keys) if len(self.ids) else np.zeros(len(keys), dtype=bool)
+        if len(self.others):
+            others = keys < 0
+            found[others] = column[others].isin(self.others).to_numpy()
+        return pd.Series(found, index=column.index)
@@ -16,11 +16,23 @@ import configparser
 import sys
 import re
 import os
+import io
+import time
+import collections
+import multiprocessing
 
 sys.path.append('./functions')  # Add the 'src' directory to the sys.path
 import data_processing as dp
+from triple_stream import TripleStream, term_to_nt
+from run_metrics import metrics
+from reject_writer import RejectWriter
+from gzip_writer import ParallelGzipWriter
+from delta_index import DeltaIndex
+from taxon_matcher import TaxonNameMatcher
+from taxon_resolver import TaxonResolver
+import staging
 import matchNames_BiologicalSex_LifeStage_BodyPart as mbg
-from config import eURIDict, eURISet, eNamesDict, eNamesSet, fungiTerms
+from config import eURIDict, eURISet, eNamesDict, eNamesSet, fungiTerms, bpFileName, lsFileName
 
 rdflib.plugin.register('turtle_custom', rdflib.plugin.Serializer, 'turtle_custom.serializer', 'TurtleSerializerCustom')
 
@@ -77,40 +89,546 @@ prefix_to_namespace = {
 
 
 
-# Function for adding ambiguous entities to the graph
-def add_entity_to_graph(entity, entityID, subject, predicate, rdftype, ns, graph, desigSet):
+# Function for resolving an ambiguous entity (name, id) to the entities of the mapping files
+def resolve_entity(entity, entityID, ns):
+    """
+    Resolve a body part or life stage, given by its name and/or id, without adding anything to a graph.
+
+    :param entity: The name, or None.
+    :param entityID: The id, or None.
+    :param ns: Namespace of the entities minted for names without URI (ANATOMICAL_ENTITY or DEVELOPMENTAL_STAGE).
+    :return: List of the (entity URI, label, fetchtype) of the name, empty if nothing is available.
+    """
     if dp.is_none_na_or_empty(entityID): #check if entity id is not na
+        label = entity if entity is not None else "nan"  # an id without name is labelled as the NA value read by pandas
         if any(entityID.startswith(prefix) for prefix in prefix_to_namespace): #check if the ids is already present
             for prefix, namespace in prefix_to_namespace.items():
                 if entityID.startswith(prefix):
                     entity_Id = entityID[len(prefix):]
                     entityURI = namespace[entity_Id]
-                    mbg.add_entity(graph, subject, predicate, rdftype, entityURI, entity, desigSet, "EXISTING-1", entity)
-                    break
+                    return [(entityURI, label, "EXISTING-1")]
         elif entityID.startswith("http"): # check if the entity starts with http
             ent = URIRef(entityID)
-            mbg.add_entity(graph, subject, predicate, rdftype, ent, entity, desigSet, "EXISTING-2", entity)
+            return [(ent, label, "EXISTING-2")]
+        return []
+    elif entity is None: # an id which is not usable, and no name
+        return []
     elif any(sub in entity for sub in fungiTerms.keys()):
         for small_term in fungiTerms.keys():
             if small_term in entity:
                 modEntityName = fungiTerms[small_term]
                 ent = emiBox[f"{ns}-{dp.format_uri(modEntityName)}"]
-                mbg.add_entity(graph, subject, predicate, rdftype, ent, modEntityName, desigSet, "FUNGI-TERMS", entity)
-                break
+                return [(ent, modEntityName, "FUNGI-TERMS")]
     elif entity in eURISet: # check if the id is assigned in the dictionary file
         modEntityURI = URIRef(eURIDict[entity])
         modEntityName = eNamesDict[entity]
-        mbg.add_entity(graph, subject, predicate, rdftype, modEntityURI, modEntityName, desigSet, "URI-FETCHED-1", entity)
+        return [(modEntityURI, modEntityName, "URI-FETCHED-1")]
     elif entity in eNamesSet: # check if the name is assigned in the dictionary file
         modEntityName = eNamesDict[entity]
         ent = emiBox[f"{ns}-{dp.format_uri(modEntityName)}"]
-        mbg.add_entity(graph, subject, predicate, rdftype, ent, modEntityName, desigSet, "URI-FETCHED-1a", entity)
+        return [(ent, modEntityName, "URI-FETCHED-1a")]
     else: # none available
-        mbg.listTerms(entity, graph, subject, predicate, rdftype, ns, desigSet)
+        return mbg.resolve_terms(entity, ns)
+
+
+# Function for the key of an ambiguous entity in the EntityTable, NA values become None
+def entity_key(entity, entityID, ns):
+    return (entity if isinstance(entity, str) else None, entityID if isinstance(entityID, str) else None, ns)
+
+
+# Columns holding the ambiguous entities of GloBI, and the namespace of the entities minted for them
+entity_columns = [
+    ("sourceBodyPartName", "sourceBodyPartId", "ANATOMICAL_ENTITY"),
+    ("targetBodyPartName", "targetBodyPartId", "ANATOMICAL_ENTITY"),
+    ("sourceLifeStageName", "sourceLifeStageId", "DEVELOPMENTAL_STAGE"),
+    ("targetLifeStageName", "targetLifeStageId", "DEVELOPMENTAL_STAGE"),
+]
+
+
+class EntityTable:
+    '''
+    Resolution table of the ambiguous entities: every distinct (name, id, namespace) is resolved once with resolve_entity,
+    and the result is kept in a gzipped TSV file, so that later runs only read it. The file starts with a digest of the
+    mapping files, and is rebuilt from scratch when they change.
+
+    :param table_file: Path to the gzipped TSV file.
+    :param digest: Digest of the mapping files, see dp.files_digest.
+    '''
+    def __init__(self, table_file, digest):
+        self.table_file = table_file
+        self.entities = {}
+        if os.path.exists(table_file):
+            with gzip.open(table_file, "rt", encoding="utf-8", newline="\n") as f:
+                if f.readline().rstrip("\n") == f"#digest\t{digest}":
+                    for line in f:
+                        name, entityID, ns, uri, label, fetchtype = line.rstrip("\n").split("\t")
+                        resolved = self.entities.setdefault((name or None, entityID or None, ns), [])
+                        if uri:
+                            resolved.append((URIRef(uri), label, fetchtype))
+                    print(f"Loaded {len(self.entities)} resolved entities from {table_file}")
+                    return
+        with gzip.open(table_file, "wt", encoding="utf-8") as f:
+            f.write(f"#digest\t{digest}\n")
+
+    def resolve_batch(self, batch_data):
+        """
+        Resolve the entities of a batch which are not in the table yet, and append them to the table file.
+
+        :param batch_data: DataFrame with the GloBI interaction rows of one batch.
+        :return: Dictionary of the resolved entities of the batch, keyed by entity_key.
+        """
+        batchEntities = {}
+        lines = []
+        for nameCol, idCol, ns in entity_columns:
+            for entity, entityID in batch_data[[nameCol, idCol]].drop_duplicates().itertuples(index=False):
+                key = entity_key(entity, entityID, ns)
+                if key not in self.entities:
+                    resolved = self.entities[key] = resolve_entity(*key)
+                    name, entityID, _ = key
+                    for uri, label, fetchtype in resolved or [("", "", "")]:
+                        lines.append(f"{name or ''}\t{entityID or ''}\t{ns}\t{uri}\t{label}\t{fetchtype}\n")
+                batchEntities[key] = self.entities[key]
+        if lines:
+            with gzip.open(self.table_file, "at", encoding="utf-8") as f:  # Append mode
+                f.write("".join(lines))
+        return batchEntities
+
+
+# Function for adding ambiguous entities to the graph
+def add_entity_to_graph(entity, entityID, subject, predicate, rdftype, ns, graph, desigSet, batchEntities):
+    resolved = batchEntities[entity_key(entity, entityID, ns)]
+    if not resolved:
+        metrics.count("entity_links", fetchtype="NOTHING-AVAILABLE")
+    for entityURI, label, fetchtype in resolved:
+        mbg.add_entity(graph, subject, predicate, rdftype, entityURI, label, desigSet, fetchtype, entity)
+
+
+# Function for mapping source and target taxa of a batch to WD IDs
+def resolve_taxon_ids(batch_data, resolver, rejects=None, name_matcher=None):
+    """
+    Map the source and target taxa of a batch to Wikidata IDs column-wise, first on TaxonId, then on TaxonName, and
+    then on the approximate match of TaxonName if a name matcher is given.
+
+    :param batch_data: DataFrame with the GloBI interaction rows of one batch.
+    :param resolver: TaxonResolver with the GloBI mapping, looked up for the distinct TaxonIds and TaxonNames of the batch.
+    :param rejects: RejectWriter receiving the dropped rows, with the reason no_wd_mapping, no_mapped_id or same_source_target.
+    :param name_matcher: TaxonNameMatcher over the mapped names, for the taxa whose id and name are not mapped, or None.
+    :return: The rows mapped on both sides to different WD IDs, with the columns source/targetTaxonIdMapped and source/targetTaxonNameMapped added.
+    """
+    batch_data = batch_data.copy()
+    noMapping = {}
+    noMappedId = {}
+    for side in ["source", "target"]:
+        taxonName = batch_data[f"{side}TaxonName"].to_numpy()
+        wd_map_dict_id = resolver.globi_taxon_ids(batch_data[f"{side}TaxonId"])
+        wd_map_dict_name = resolver.globi_taxon_names(batch_data[f"{side}TaxonName"])
+        idPos = wd_map_dict_id.index.get_indexer(batch_data[f"{side}TaxonId"])
+        namePos = wd_map_dict_name.index.get_indexer(batch_data[f"{side}TaxonName"])
+        byId = idPos >= 0                    # TaxonId is mapped, takes precedence over the name
+        byName = ~byId & (namePos >= 0)      # otherwise fall back to TaxonName
+        idMapped = np.where(byId, wd_map_dict_id["Mapped_ID_WD"].to_numpy()[idPos],
+                            np.where(byName, wd_map_dict_name["Mapped_ID_WD"].to_numpy()[namePos], None))
+        if name_matcher is not None:
+            # last, the approximate match of the names (misspellings, author strings, infraspecific epithets)
+            unmapped = ~(byId | byName) & pd.notna(taxonName)
+            idMapped[unmapped] = name_matcher.lookup(taxonName[unmapped])
+            byName = byName | (unmapped & pd.notna(idMapped))
+        nameMapped = np.where(pd.notna(taxonName), taxonName,
+                              np.where(byId, wd_map_dict_id["Mapped_Value"].to_numpy()[idPos], None))
+        batch_data[f"{side}TaxonIdMapped"] = idMapped
+        batch_data[f"{side}TaxonNameMapped"] = nameMapped
+        noMapping[side] = ~(byId | byName)                      # neither the id nor the name is mapped
+        noMappedId[side] = (byId | byName) & pd.isna(idMapped)  # the mapped id is empty
+
+    keep = np.ones(len(batch_data), dtype=bool)
+    for reason, sides in [("no_wd_mapping", noMapping), ("no_mapped_id", noMappedId)]:
+        dropped = keep & (sides["source"] | sides["target"])
+        if rejects is not None and dropped.any():
+            details = np.where(sides["source"] & sides["target"], "source,target", np.where(sides["source"], "source", "target"))
+            rejects.reject(reason, batch_data[dropped].drop(columns=record_columns, errors="ignore"), details[dropped])
+        metrics.count("rows_dropped", int(dropped.sum()), reason=reason)
+        keep &= ~dropped
+
+    sameSourceTarget = keep & (batch_data["sourceTaxonIdMapped"] == batch_data["targetTaxonIdMapped"]).to_numpy()
+    if rejects is not None and sameSourceTarget.any():
+        rejects.reject("same_source_target", batch_data[sameSourceTarget].drop(columns=record_columns, errors="ignore"), batch_data["sourceTaxonIdMapped"][sameSourceTarget])
+    metrics.count("rows_read", len(batch_data))
+    metrics.count("rows_dropped", int(sameSourceTarget.sum()), reason="same_source_target")
+    return batch_data[keep & ~sameSourceTarget]
+
+
+# Columns of the record names added to a batch (see name_records), which are not written to the rejects file, so
+# that all its rows have the columns of its header
+record_columns = ["recordHash", "recordName"]
+
+
+# Function to name the interaction records of a batch
+def name_records(batch_data, i):
+    """
+    Add the recordName column, the local name of the interaction record of every row: inRec<n> with the global
+    number n of the record, or inRec-<fingerprint> in the incremental mode (see DeltaIndex.split), where the records
+    of the rows which did not change keep their IRI from one release to the next.
+
+    :param batch_data: Batch returned by resolve_taxon_ids.
+    :param i: Global number of the first record of the batch.
+    """
+    if "recordHash" in batch_data:
+        return batch_data.assign(recordName="inRec-" + batch_data["recordHash"])
+    return batch_data.assign(recordName=[f"inRec{n}" for n in range(i, i + len(batch_data))])
+
+
+# Function for the rows of a batch whose body part or life stage does not resolve to any entity
+def reject_unresolved_entities(batch_data, batchEntities, rejects):
+    """
+    Write the rows with a body part or life stage name (or id) for which nothing is available to the rejects, with the
+    interaction record and the column as detail. The triples of these rows are generated without the entity.
+
+    :param batch_data: Batch returned by name_records.
+    :param batchEntities: Resolved body parts and life stages of the batch, see EntityTable.resolve_batch.
+    :param rejects: RejectWriter receiving the rows, with the reason nothing_available.
+    """
+    records = batch_data["recordName"].to_numpy(dtype=object)
+    for nameCol, idCol, ns in entity_columns:
+        # entities of the column given in the input but not resolved, checked once per distinct entity
+        emptyKeys = {key for key, resolved in batchEntities.items() if key[2] == ns and not resolved
+                     and (dp.is_none_na_or_empty(key[0]) or dp.is_none_na_or_empty(key[1]))}
+        if emptyKeys:
+            unresolved = np.array([entity_key(name, entityID, ns) in emptyKeys
+                                   for name, entityID in zip(batch_data[nameCol].to_numpy(), batch_data[idCol].to_numpy())], dtype=bool)
+            rejects.reject("nothing_available", batch_data[unresolved].drop(columns=record_columns, errors="ignore"), records[unresolved] + f":{nameCol}")
+
+
+# Prefixes written once at the top of the output file
+turtle_prefixes = (
+    "@prefix emi: <https://purl.org/emi#> .\n"
+    "@prefix : <https://purl.org/emi/abox#> .\n"
+    "@prefix sosa: <http://www.w3.org/ns/sosa/> .\n"
+    "@prefix dcterms: <http://purl.org/dc/terms/> .\n"
+    "@prefix wd: <http://www.wikidata.org/entity/> .\n"
+    "@prefix rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#> .\n"
+    "@prefix rdfs: <http://www.w3.org/2000/01/rdf-schema#> .\n"
+    "@prefix xsd: <http://www.w3.org/2001/XMLSchema#> .\n"
+    "@prefix prov: <http://www.w3.org/ns/prov#> .\n"
+    "@prefix wgs84: <http://www.w3.org/2003/01/geo/wgs84_pos#> .\n"
+    "@prefix qudt: <http://qudt.org/schema/qudt/> .\n\n"
+)
+
+
+# Function to initialize the graph of a batch, or a stream writing the triples of the batch directly to out_file
+def new_batch_graph(engine, out_file, inverse, streaming):
+    if engine == "stream":
+        graph = TripleStream(out_file, inverse=inverse)
+    else:
+        # the simple store gives the triples by subject in insertion order, as the streaming serializer needs
+        graph = Graph(store="SimpleMemory") if streaming else Graph()
+    graph.bind("", emiBox)  # ":" will now map to "https://purl.org/emi/abox#"
+    graph.bind("emi", emi)
+    graph.bind("sosa", sosa)
+    graph.bind("dcterms", dcterms)
+    graph.bind("wd", wd)
+    graph.bind("prov", prov)
+    graph.bind("wgs84", wgs84)
+    graph.bind("qudt", qudt)
+    return graph
+
+
+# Function to write the triples of a batch still held by its graph
+def finish_batch_graph(graph, engine, out_file, inverse, streaming):
+    with metrics.timer("write"):
+        if engine == "stream":
+            graph.flush()   # inverse relationships were already written along with the triples
+        else:
+            if inverse:
+                dp.add_inverse_relationships(graph)
+            #serialize the graph for the batch and write to the file
+            out_file.write(graph.serialize(format="turtle_custom", streaming=streaming, prefixes=turtle_prefixes))
+    metrics.count("triples_emitted", len(graph))
+
+
+# Function to add the triples of the interaction records of a batch
+def add_batch_to_graph(graph, batch_data, batchEntities, i, intxnTypeSet, biologicalSexSet, lifeStageSet, bodyPartSet):
+    """
+    Add the triples of every interaction record of a batch to the graph.
+
+    :param graph: rdflib.Graph or TripleStream receiving the triples.
+    :param batch_data: Batch returned by name_records.
+    :param batchEntities: Resolved body parts and life stages of the batch, see EntityTable.resolve_batch.
+    :param i: Global number of the first record of the batch.
+    :param intxnTypeSet, biologicalSexSet, lifeStageSet, bodyPartSet: Sets of the types which are already declared.
+    :return: Global number of the first record of the next batch.
+    """
+    # parse the biological sex columns of the whole batch, every distinct string only once
+    sexParser = mbg.get_sex_parser()
+    sourceSexes = sexParser.parse_column(batch_data['sourceSexName'])
+    targetSexes = sexParser.parse_column(batch_data['targetSexName'])
+    for row, sourceSex, targetSex in zip(batch_data.to_dict("records"), sourceSexes, targetSexes):
+        # define URIs (ensure spaces are replaced with underscores by is_none_na... function)
+        source_taxon_uri = emiBox[f"SAMPLE-{dp.format_uri(row['sourceTaxonIdMapped'])}-{row['recordName']}"] if dp.is_none_na_or_empty(row['sourceTaxonIdMapped']) else None
+        target_taxon_uri = emiBox[f"SAMPLE-{dp.format_uri(row['targetTaxonIdMapped'])}-{row['recordName']}"] if dp.is_none_na_or_empty(row['targetTaxonIdMapped']) else None
+        intxn_type_uri = emiBox[f"{row['interactionTypeName']}"] if dp.is_none_na_or_empty(row['interactionTypeName']) else None
+        intxn_type_Id_uri = URIRef(f"{row['interactionTypeId']}") if dp.is_none_na_or_empty(row['interactionTypeId']) else None #maybe add RO as namespace
+        intxnRec_uri = emiBox[row['recordName']]
+
+            #declare intxn record as emi:Interaction, this will never be NA/Non/empty
+        graph.add((intxnRec_uri, RDF.type, emi.Interaction))
+        #add triples to the graph for interaction Record
+        if dp.is_none_na_or_empty(source_taxon_uri):
+            graph.add((intxnRec_uri, emi.hasSource, source_taxon_uri))
+        if dp.is_none_na_or_empty(target_taxon_uri):
+            graph.add((intxnRec_uri, emi.hasTarget, target_taxon_uri))
+
+        if dp.is_none_na_or_empty(intxn_type_uri) and dp.is_none_na_or_empty(intxn_type_Id_uri):
+            graph.add((intxnRec_uri, emi.isClassifiedWith, intxn_type_Id_uri))
+            if intxn_type_Id_uri not in intxnTypeSet:
+                graph.add((intxn_type_Id_uri, RDF.type, emi.InteractionType))
+                graph.add((intxn_type_Id_uri, RDFS.label, Literal(row['interactionTypeName'], datatype=XSD.string)))
+                intxnTypeSet.add(intxn_type_Id_uri)
+        if not dp.is_none_na_or_empty(intxn_type_Id_uri):
+            graph.add((intxnRec_uri, emi.isClassifiedWith, intxn_type_uri))
+            if intxn_type_uri not in intxnTypeSet:
+                graph.add((intxn_type_uri, RDF.type, emi.InteractionType))
+                intxnTypeSet.add(intxn_type_uri)
+                    #if dp.is_none_na_or_empty(intxn_type_uri):
+                    #     graph.add((intxn_type_uri, dcterms.identifier,intxn_type_Id_uri))
+
+        if dp.is_none_na_or_empty(row['localityName']):
+            graph.add((intxnRec_uri, prov.atLocation, Literal(row['localityName'], datatype=XSD.string)))
+        if dp.is_none_na_or_empty(row['referenceDoi']):
+            graph.add((intxnRec_uri, dcterms.bibliographicCitation, Literal(row['referenceDoi'], datatype=XSD.string)))
+        if dp.is_none_na_or_empty(row['sourceDOI']):
+            graph.add((intxnRec_uri, dcterms.bibliographicCitation, Literal(row['sourceDOI'], datatype=XSD.string)))
+        if dp.is_none_na_or_empty(row['decimalLatitude']):
+            graph.add((intxnRec_uri, wgs84.lat, Literal(row['decimalLatitude'], datatype=XSD.string)))
+        if dp.is_none_na_or_empty(row['decimalLongitude']):
+            graph.add((intxnRec_uri, wgs84.long, Literal(row['decimalLongitude'], datatype=XSD.string)))
+                #graph.add((intxnRec_uri, URIRef("http://www.w3.org/2003/01/geo/wgs84_pos#long"), Literal(row['decimalLongitude'], datatype=XSD.string)))
+
+                #add triples for source and targets
+        if dp.is_none_na_or_empty(row['sourceTaxonNameMapped']) and dp.is_none_na_or_empty(source_taxon_uri):
+            sourceSample_uri = emiBox[f"ORGANISM-{dp.format_uri(row['sourceTaxonNameMapped'])}"]
+            graph.add((source_taxon_uri, RDF.type, sosa.Sample))
+            graph.add((source_taxon_uri, RDFS.label, Literal(row['sourceTaxonNameMapped'], datatype=XSD.string)))
+            graph.add((source_taxon_uri, sosa.isSampleOf, sourceSample_uri))
+        if dp.is_none_na_or_empty(row['sourceTaxonIdMapped']) and dp.is_none_na_or_empty(source_taxon_uri):
+            graph.add((source_taxon_uri, emi.inTaxon, wd[f"{row['sourceTaxonIdMapped']}"]))
+
+        if dp.is_none_na_or_empty(row['targetTaxonNameMapped']) and dp.is_none_na_or_empty(target_taxon_uri):
+            targetSample_uri = emiBox[f"ORGANISM-{dp.format_uri(row['targetTaxonNameMapped'])}"]
+            graph.add((target_taxon_uri, RDF.type, sosa.Sample))
+            graph.add((target_taxon_uri, RDFS.label, Literal(row['targetTaxonNameMapped'], datatype=XSD.string)))
+            graph.add((target_taxon_uri, sosa.isSampleOf, targetSample_uri))
+        if dp.is_none_na_or_empty(row['targetTaxonIdMapped']) and dp.is_none_na_or_empty(target_taxon_uri):
+            graph.add((target_taxon_uri, emi.inTaxon, wd[f"{row['targetTaxonIdMapped']}"]))
+
+                # write body part, physiological state, and other taxon attributes (if available)
+                # first read the file in which the mappings are stored, followed by triples generation
+                # for body part names
+        if (dp.is_none_na_or_empty(row['sourceBodyPartName']) or dp.is_none_na_or_empty(row['sourceBodyPartId'])) and dp.is_none_na_or_empty(source_taxon_uri):
+            metrics.diagnostic("NAMES", row["sourceTaxonId"], row["sourceTaxonName"], row["targetTaxonId"], row["targetTaxonName"])
+            add_entity_to_graph(row['sourceBodyPartName'],row['sourceBodyPartId'],source_taxon_uri,emi.hasAnatomicalEntity,emi.AnatomicalEntity, "ANATOMICAL_ENTITY", graph, bodyPartSet, batchEntities)
+        if (dp.is_none_na_or_empty(row['targetBodyPartName']) or dp.is_none_na_or_empty(row['targetBodyPartId'])) and dp.is_none_na_or_empty(target_taxon_uri):
+            metrics.diagnostic("NAMES", row["sourceTaxonId"], row["sourceTaxonName"], row["targetTaxonId"], row["targetTaxonName"])
+            add_entity_to_graph(row['targetBodyPartName'],row['targetBodyPartId'],target_taxon_uri,emi.hasAnatomicalEntity,emi.AnatomicalEntity, "ANATOMICAL_ENTITY", graph, bodyPartSet, batchEntities)
+
+                # for life stage names
+        if (dp.is_none_na_or_empty(row['sourceLifeStageName']) or dp.is_none_na_or_empty(row['sourceLifeStageId'])) and dp.is_none_na_or_empty(source_taxon_uri):
+            metrics.diagnostic("NAMES", row["sourceTaxonId"], row["sourceTaxonName"], row["targetTaxonId"], row["targetTaxonName"])
+            add_entity_to_graph(row['sourceLifeStageName'],row['sourceLifeStageId'],source_taxon_uri,emi.hasDevelopmentalStage, emi.DevelopmentalStage, "DEVELOPMENTAL_STAGE", graph, lifeStageSet, batchEntities)
+        if (dp.is_none_na_or_empty(row['targetLifeStageName']) or dp.is_none_na_or_empty(row['targetLifeStageId'])) and dp.is_none_na_or_empty(target_taxon_uri):
+            metrics.diagnostic("NAMES", row["sourceTaxonId"], row["sourceTaxonName"], row["targetTaxonId"], row["targetTaxonName"])
+            add_entity_to_graph(row['targetLifeStageName'],row['targetLifeStageId'],target_taxon_uri,emi.hasDevelopmentalStage, emi.DevelopmentalStage, "DEVELOPMENTAL_STAGE", graph, lifeStageSet, batchEntities)
+
+                #for biological sex
+        if dp.is_none_na_or_empty(row['sourceSexName']) and dp.is_none_na_or_empty(source_taxon_uri):
+            genderDict = sourceSex
+            for k, (uri, qty) in enumerate(genderDict.items()):
+                gData = BNode(f"{row['recordName']}-sourceSex{k}")
+                graph.add((source_taxon_uri, emi.hasSex, gData))
+                graph.add((gData, qudt.quantityKind, URIRef(uri)))
+                graph.add((gData, qudt.numericValue, Literal(qty, datatype=XSD.integer)))
+                ent = URIRef(uri)
+                if ent not in biologicalSexSet:
+                    graph.add((ent, RDF.type, emi.BiologicalSex))
+                    biologicalSexSet.add(ent)
+
+        if dp.is_none_na_or_empty(row['targetSexName']) and dp.is_none_na_or_empty(target_taxon_uri):
+            genderDict = targetSex
+            for k, (uri, qty) in enumerate(genderDict.items()):
+                gData = BNode(f"{row['recordName']}-targetSex{k}")
+                graph.add((source_taxon_uri, emi.hasSex, gData))
+                graph.add((gData, qudt.quantityKind, URIRef(uri)))
+                graph.add((gData, qudt.numericValue, Literal(qty, datatype=XSD.integer)))
+                ent = URIRef(uri)
+                if ent not in biologicalSexSet:
+                    graph.add((ent, RDF.type, emi.BiologicalSex))  
+                    biologicalSexSet.add(ent)
+
+        i = i + 1 #check if i is increasing as expected. appears to do so
+    return i
+
+
+# Types which are declared only once per output file, see intxnTypeSet, biologicalSexSet, lifeStageSet and bodyPartSet
+declared_types = {emi.InteractionType, emi.BiologicalSex, emi.DevelopmentalStage, emi.AnatomicalEntity}
+
+
+class ShardGraph:
+    '''
+    Wrapper of the graph (or TripleStream) of a shard which keeps the type declarations aside instead of adding them,
+    so that the parent process can write them only for the first shard in which a type appears, as a sequential run does.
+
+    :param graph: rdflib.Graph or TripleStream receiving all the other triples.
+    '''
+    def __init__(self, graph):
+        self.graph = graph
+        self.declarations = {}  # (rdftype, entity) -> N-Triples lines, in the order the types appear in the shard
+        self.last = None
+
+    def bind(self, prefix, namespace):
+        self.graph.bind(prefix, namespace)
+
+    def add(self, triple):
+        subj, pred, obj = triple
+        if pred == RDF.type and obj in declared_types:
+            self.last = (obj, subj)
+            self.declarations.setdefault(self.last, []).append(f"{term_to_nt(subj)} {term_to_nt(pred)} {term_to_nt(obj)} .\n")
+        elif pred == RDFS.label and self.last is not None and self.last[1] == subj:  # label of the type declared just before
+            self.declarations[self.last].append(f"{term_to_nt(subj)} {term_to_nt(pred)} {term_to_nt(obj)} .\n")
+        else:
+            self.graph.add(triple)
+
+
+# Function to generate the triples of one shard (a resolved batch and the global number of its first record) in a worker process
+def generate_shard(shard):
+    batch_data, batchEntities, i, engine, level, inverse, streaming = shard
+    metrics.reset()  # the metrics of the shard are returned to the parent, which merges them
+    out_file = io.StringIO()
+    graph = new_batch_graph(engine, out_file, inverse, streaming)
+    shard_graph = ShardGraph(graph)
+    with metrics.timer("generate"):
+        add_batch_to_graph(shard_graph, batch_data, batchEntities, i, set(), set(), set(), set())
+    finish_batch_graph(graph, engine, out_file, inverse, streaming)
+    with metrics.timer("compress"):
+        shard_bytes = gzip.compress(out_file.getvalue().encode("utf-8"), level, mtime=0)
+    return shard_bytes, list(shard_graph.declarations.items()), metrics.snapshot()
+
+
+# Function to start the output file, or to resume the output file of an interrupted run from its manifest
+def start_or_resume(input_csv_gz, output_file, manifest_file, reject_file, delta_index_file=None, delta_context=""):
+    """
+    Resume from the manifest written after the last complete batch of an interrupted run, or start a new output file.
+    Every batch is a separate gzip member, so the output is truncated to the size recorded in the manifest, which drops
+    a partially written batch.
+
+    :param input_csv_gz: Path to the gzipped input file.
+    :param output_file: Path to the output Turtle file.
+    :param manifest_file: Path to the resume manifest.
+    :param reject_file: Path to the rejected rows, cut back like the output file (see RejectWriter).
+    :param delta_index_file: Path to the index of the incremental mode (see DeltaIndex), None to process all rows.
+    :param delta_context: Digest of the mapping files and options of the run, see DeltaIndex.
+    :return: Uncompressed offset of the next input row, number of the next interaction record, the sets of the
+        types already declared, keyed by their rdf:type, the RejectWriter, and the DeltaIndex (None if not incremental).
+    """
+    typeSets = {rdftype: set() for rdftype in declared_types}
+    manifest = dp.load_manifest(manifest_file)
+    if manifest is not None and manifest["input_file"] == input_csv_gz and os.path.exists(output_file):
+        with open(output_file, "r+b") as f:
+            f.truncate(manifest["output_size"])
+        for rdftype, entities in manifest["type_sets"].items():
+            typeSets[URIRef(rdftype)].update(URIRef(entity) for entity in entities)
+        print(f"Resuming {output_file} at input offset {manifest['input_offset']} and record inRec{manifest['records']}")
+        delta = DeltaIndex(delta_index_file, delta_context, manifest.get("delta_size", 0)) if delta_index_file else None
+        return manifest["input_offset"], manifest["records"], typeSets, RejectWriter(reject_file, manifest.get("reject_size", 0)), delta
+
+    # Write prefixes directly to a new output file
+    with open(output_file, "wb") as out_file:
+        out_file.write(gzip.compress(turtle_prefixes.encode("utf-8"), mtime=0))
+    return 0, 0, typeSets, RejectWriter(reject_file), DeltaIndex(delta_index_file, delta_context) if delta_index_file else None
+
+
+# Function to record the state after a complete batch, see start_or_resume
+def save_resume_state(manifest_file, input_csv_gz, input_offset, i, typeSets, output_size, reject_size, delta_size=0):
+    dp.save_manifest(manifest_file, {
+        "input_file": input_csv_gz,
+        "input_offset": input_offset,
+        "records": i,
+        "output_size": output_size,
+        "reject_size": reject_size,
+        "delta_size": delta_size,
+        "type_sets": {str(rdftype): sorted(str(entity) for entity in entities) for rdftype, entities in typeSets.items()},
+    })
+
+
+# Function to generate the triples of all batches with a pool of worker processes
+def generate_rdf_in_shards(chunks, resolver, name_matcher, entityTable, input_csv_gz, out_file, engine, workers, i, typeSets, manifest_file, rejects, delta, inverse, streaming):
+    """
+    Generate the triples of every batch (shard) in a pool of worker processes and write them as one gzip member per shard.
+    The gzip input can not be split without decompressing it, so the batches are read and resolved here, which also gives
+    the global number of the first record of every shard. The members are written in input order, so the output file is
+    byte-for-byte the same whatever the (positive) number of workers. Types are declared once, with the label of their
+    first appearance, as in a sequential run (see ShardGraph), but the declarations of a shard are written before its
+    triples: the file holds the same triples as the one of a sequential run, in another order.
+
+    :param chunks: Iterator over the (batch, offset of the next row) tuples of the input file.
+    :param resolver: TaxonResolver with the GloBI mapping, see resolve_taxon_ids.
+    :param name_matcher: TaxonNameMatcher of the unmapped names or None, see resolve_taxon_ids.
+    :param entityTable: EntityTable resolving the body parts and life stages.
+    :param input_csv_gz: Path to the gzipped input file, recorded in the manifest.
+    :param out_file: ParallelGzipWriter of the output file, started or resumed by start_or_resume. The shards are
+        compressed by the workers at its level.
+    :param engine: "rdflib" or "stream", see generate_rdf_in_batches.
+    :param workers: Number of worker processes.
+    :param i: Number of the first interaction record.
+    :param typeSets: Sets of the types already declared, keyed by their rdf:type.
+    :param manifest_file: Path to the resume manifest, updated after every shard.
+    :param rejects: RejectWriter receiving the dropped rows, written along with their shard.
+    :param delta: DeltaIndex of the incremental mode, whose fingerprints are written along with their shard, or None.
+    :param inverse, streaming: See generate_rdf_in_batches.
+    """
+    # the workers are forked, so they share the mappings loaded by the parent instead of receiving them with every shard
+    with multiprocessing.get_context("fork").Pool(workers) as pool:
+        pending = collections.deque()
+
+        # write the triples of a shard, preceded by the declarations of the types which did not appear in an earlier shard
+        def write_shard(result, rejected, seen, input_offset, next_i):
+            shard_bytes, declarations, shard_metrics = result
+            metrics.merge(shard_metrics)
+            lines = []
+            for (rdftype, entity), decl_lines in declarations:
+                if entity not in typeSets[rdftype]:
+                    lines.extend(decl_lines)
+                    typeSets[rdftype].add(entity)
+            if lines:
+                out_file.write("".join(lines))
+                metrics.count("triples_emitted", len(lines))
+            out_file.write_member(shard_bytes)
+            output_size = out_file.sync()
+            reject_size = rejects.write(rejected)
+            delta_size = delta.write(seen) if delta is not None else 0
+            save_resume_state(manifest_file, input_csv_gz, input_offset, next_i, typeSets, output_size, reject_size, delta_size)
+
+        for batch_data, input_offset in chunks:
+            with metrics.timer("resolve_taxa"):
+                if delta is not None:
+                    batch_data = delta.split(batch_data)
+                batch_data = resolve_taxon_ids(batch_data, resolver, rejects, name_matcher)
+                batch_data = name_records(batch_data, i)
+            with metrics.timer("resolve_entities"):
+                batchEntities = entityTable.resolve_batch(batch_data)  # the table of the workers is not updated after the fork
+                reject_unresolved_entities(batch_data, batchEntities, rejects)
+            result = pool.apply_async(generate_shard, ((batch_data, batchEntities, i, engine, out_file.level, inverse, streaming),))
+            i = i + len(batch_data)
+            seen = delta.take() if delta is not None else b""
+            pending.append((result, rejects.take(), seen, input_offset, i))  # rejected rows and fingerprints are written with their shard
+            if len(pending) >= 2 * workers:  # keep at most two shards per worker in memory
+                result, rejected, seen, input_offset, next_i = pending.popleft()
+                write_shard(result.get(), rejected, seen, input_offset, next_i)
+        while pending:
+            result, rejected, seen, input_offset, next_i = pending.popleft()
+            write_shard(result.get(), rejected, seen, input_offset, next_i)
 
 
 # Function to generate full set of triples
-def generate_rdf_in_batches(input_csv_gz, join_csv, wd_map_file, output_file, join_column, batch_size=1000, ch=2): ###DT
+def generate_rdf_in_batches(input_csv_gz, join_csv, wd_map_file, output_file, join_column, batch_size=1000, ch=2, engine="rdflib", workers=0, entity_table_file="globi_entity_table.tsv.gz", reject_file=None, compress_level=6, compress_threads=None, inverse=True, streaming=False, delta_index_file=None, fuzzy_distance=0, resolver_file="taxon_resolver.sqlite"): ###DT
     """
     Generate RDF triples in compact Turtle format using batches of rows and rdflib for serialization.
 
@@ -119,47 +637,29 @@ def generate_rdf_in_batches(input_csv_gz, join_csv, wd_map_file, output_file, jo
     :param output_file: Path to the output Turtle file.
     :param join_column: Column name for joining the two CSVs.
     :param batch_size: The number of rows to process per batch.
+    :param engine: "rdflib" to build and serialize a graph per batch, or "stream" to write the triples as N-Triples while they are generated.
+    :param workers: 0 to process the batches one after the other in this process, otherwise the number of worker processes (see generate_rdf_in_shards).
+    :param entity_table_file: Path to the table of the resolved body parts and life stages, reused by later runs (see EntityTable).
+    :param reject_file: Path to the gzipped TSV file of the dropped rows and of the unresolved body parts and life stages, with their reason (see RejectWriter). Defaults to <output_file>.rejects.tsv.gz.
+    :param compress_level: gzip compression level of the output file.
+    :param compress_threads: Number of threads compressing the output file (see ParallelGzipWriter), the number of CPUs by default.
+    :param inverse: Add the inverse relationships of dp.INVERSE_RELATIONS.
+    :param streaming: Serialize the graph of every batch in insertion order instead of sorting it (see TurtleSerializerCustom.serialize_streaming).
+    :param delta_index_file: Path to the index of the fingerprints of the previous input, to generate the triples of the new rows only (see DeltaIndex).
+        The records are then named by their fingerprint, and the records of the previous input which are gone are listed in <output_file>.retired.txt.gz.
+        If the mapping files or the options changed since the previous run, all rows are generated and all the previous records are retired.
+    :param fuzzy_distance: Largest edit distance of the approximate match of the taxon names which are not in the mapping file, 0 to match them exactly only (see TaxonNameMatcher).
+    :param resolver_file: Path to the taxon resolver file, built from wd_map_file by the first run and shared with the other generators (see TaxonResolver).
+
+    An interrupted run resumes after its last complete batch, with the same record numbers, from <output_file>.resume.json (see start_or_resume).
     """
-    ##########################################################################################
-    #checkpoint process
-    checkpoint_file = "checkpoint.txt"
-    #load the last processed index
-    start_index = 0
-    if os.path.exists(checkpoint_file):
-        with open(checkpoint_file, "r") as f:
-            start_index = int(f.read().strip())
-    current_index = start_index  #track current batch index
-    #########################################################################################
-
     print("Sent the arguments. Process started")
 
-    # load maaping of GloBI ID to WD
-    wd_map_df = pd.read_csv(wd_map_file, sep=",", dtype=str, usecols = ['TaxonId', 'TaxonName', 'Mapped_ID_WD', 'Mapped_Value']) 
-    wd_map_df.replace({"Wikidata:" : '', '"': ''}, regex=True, inplace=True)
-    wd_map_dict_id = (
-    wd_map_df.dropna(subset=["TaxonId"])
-        .query("TaxonId != ''")  # Remove empty strings
-        .set_index("TaxonId")[["Mapped_ID_WD", "Mapped_Value"]]
-        .apply(tuple, axis=1)
-        .to_dict()
-    )
-
-    wd_map_dict_name = (
-        wd_map_df.dropna(subset=["TaxonName"])
-        .query("TaxonName != ''")  # Remove empty strings
-        .set_index("TaxonName")[["Mapped_ID_WD", "Mapped_Value"]]
-        .apply(tuple, axis=1)
-        .to_dict()
-    )
-    
-    wd_map_set_id = set(wd_map_df["TaxonId"].dropna().replace("", None).dropna())
-    wd_map_set_name = set(wd_map_df["TaxonName"].dropna().replace("", None).dropna())
-
-    # declare sets to check later if some generic types like interaction, biological sex, developmental stage, etc already got serialized in one of the previous batches
-    intxnTypeSet = set()
-    biologicalSexSet = set()
-    lifeStageSet = set()
-    bodyPartSet = set()
+    # mapping of the GloBI TaxonIds and TaxonNames to WD, looked up for every batch in the resolver file, which is
+    # (re)built from the mapping file only when it changed
+    resolver = TaxonResolver(resolver_file).update(wd_map_file=wd_map_file)
+    mapped_names = resolver.globi_mapped_names() if fuzzy_distance > 0 else None
+    name_matcher = TaxonNameMatcher(mapped_names["TaxonName"], mapped_names["Mapped_ID_WD"], fuzzy_distance) if fuzzy_distance > 0 else None
 
     '''if(ch == 1): 
         data2 = pd.read_csv(join_csv, compression="gzip", sep="\t", dtype=str) # for now, no filtering based on the ENPKG data
@@ -178,223 +678,100 @@ def generate_rdf_in_batches(input_csv_gz, join_csv, wd_map_file, output_file, jo
     #print(merged_data)
     #merged_data.to_csv('intxns_subset_20241212_with_enpkg_wdIds.tsv.gz', sep='\t', compression='gzip', index=False)
     
-    # Open the output file for writing
-    with gzip.open(output_file, "wt", encoding="utf-8") as out_file:
-        # Write prefixes directly to the file
-        out_file.write("@prefix emi: <https://purl.org/emi#> .\n")
-        out_file.write("@prefix : <https://purl.org/emi/abox#> .\n")
-        out_file.write("@prefix sosa: <http://www.w3.org/ns/sosa/> .\n")
-        out_file.write("@prefix dcterms: <http://purl.org/dc/terms/> .\n")
-        out_file.write("@prefix wd: <http://www.wikidata.org/entity/> .\n")
-        out_file.write("@prefix rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#> .\n")
-        out_file.write("@prefix rdfs: <http://www.w3.org/2000/01/rdf-schema#> .\n")
-        out_file.write("@prefix xsd: <http://www.w3.org/2001/XMLSchema#> .\n")
-        out_file.write("@prefix prov: <http://www.w3.org/ns/prov#> .\n")
-        out_file.write("@prefix wgs84: <http://www.w3.org/2003/01/geo/wgs84_pos#> .\n")
-        out_file.write("@prefix qudt: <http://qudt.org/schema/qudt/> .\n\n")
-
-    # process in batches
-    i = 0 # keep for sanity checks later
-    # read gzipped TSV file in chunks
-    chunks = pd.read_csv(input_csv_gz, sep="\t", compression="gzip", chunksize=batch_size, dtype=str, encoding="utf-8")
-    for batch_data in chunks:
-        # initialize a new graph for this batch
-        graph = Graph()
-        graph.bind("", emiBox)  # ":" will now map to "https://purl.org/emi/abox#"
-        graph.bind("emi", emi)  
-        graph.bind("sosa", sosa)
-        graph.bind("dcterms", dcterms)  
-        graph.bind("wd", wd)  
-        graph.bind("prov", prov)  
-        graph.bind("wgs84", wgs84)  
-        graph.bind("qudt", qudt)  
-
-        ##########################################################################
-        #checkpoint process
-        if current_index < start_index:
-            current_index += batch_size
-            continue  #skip already processed batches
-        #########################################################################
-
-        try:
-            # process each row in the batch
-            for _, row in batch_data.iterrows():
-                    #extract the WD taxon ID for user given source and target Taxon ID as well as the name. #change everything related to ids here because it all starts form here.
-                    #mapping initial IDs (absolutely necessary) for source
-                    if row["sourceTaxonId"] in wd_map_set_id:
-                        row["sourceTaxonIdMapped"] = wd_map_dict_id.get(row["sourceTaxonId"], (None,None))[0]
-                        row["sourceTaxonNameMapped"] = row["sourceTaxonName"] if pd.notna(row["sourceTaxonName"]) else wd_map_dict_id.get(row["sourceTaxonId"], (None, None))[1]
-                    elif row["sourceTaxonName"] in wd_map_set_name:
-                        row["sourceTaxonIdMapped"] = wd_map_dict_name.get(row["sourceTaxonName"], (None, None))[0]
-                        row["sourceTaxonNameMapped"] = row["sourceTaxonName"] if pd.notna(row["sourceTaxonName"]) else wd_map_dict_id.get(row["sourceTaxonName"], (None, None))[1]
-                    else:
-                        continue #continue to next iteration if neither of these situations are true
-                
-                    #mapping initial IDs (absolutely necessary) for target
-                    if row["targetTaxonId"] in wd_map_set_id:
-                        row["targetTaxonIdMapped"] = wd_map_dict_id.get(row["targetTaxonId"], (None,None))[0]
-                        row["targetTaxonNameMapped"] = row["targetTaxonName"] if pd.notna(row["targetTaxonName"]) else wd_map_dict_id.get(row["targetTaxonId"], (None, None))[1]
-                    elif row["targetTaxonName"] in wd_map_set_name:
-                        row["targetTaxonIdMapped"] = wd_map_dict_name.get(row["targetTaxonName"], (None, None))[0]
-                        row["targetTaxonNameMapped"] = row["targetTaxonName"] if pd.notna(row["targetTaxonName"]) else wd_map_dict_id.get(row["targetTaxonName"], (None, None))[1]
-                    else:
-                        continue #continue to next iteration if neither of these situations are true
-	            
-                    #the following statements are to skip the current iteration, in case the source/targetTaxonIdMapped are empty.
-                    if not pd.notna(row["sourceTaxonIdMapped"]):
-                        continue
-                    if not pd.notna(row["targetTaxonIdMapped"]):
-                        continue
-                    if(row["sourceTaxonIdMapped"] == row["targetTaxonIdMapped"]):
-                        print("\t".join(row.astype(str)))  # Convert all values to strings and join
-                        print(row, "SAME-SOURCE-TARGET", sep="\t")
-                        continue
-
-                    #print(type(row["sourceTaxonIdMapped"]))
-                    #print(row["targetTaxonIdMapped"])
-                    #print(type(row["targetTaxonIdMapped"]))
-
-                    #if not isinstance(row["sourceTaxonIdMapped"], str):
-                    #print(row["sourceTaxonIdMapped"])
-                    #print("LIST!!!!!")
-                    #row["sourceTaxonIdMapped"] = row["sourceTaxonIdMapped"][[0]]
-                    #if not isinstance(row["targetTaxonIdMapped"], str):
-                    #print(row["targetTaxonIdMapped"])
-                    #print("LIST!!!!!")
-                    #row["targetTaxonIdMapped"] = row["targetTaxonIdMapped"][[0]]
-                
-                    # define URIs (ensure spaces are replaced with underscores by is_none_na... function)
-                    source_taxon_uri = emiBox[f"SAMPLE-{dp.format_uri(row['sourceTaxonIdMapped'])}-inRec{i}"] if dp.is_none_na_or_empty(row['sourceTaxonIdMapped']) else None
-                    target_taxon_uri = emiBox[f"SAMPLE-{dp.format_uri(row['targetTaxonIdMapped'])}-inRec{i}"] if dp.is_none_na_or_empty(row['targetTaxonIdMapped']) else None
-                    intxn_type_uri = emiBox[f"{row['interactionTypeName']}"] if dp.is_none_na_or_empty(row['interactionTypeName']) else None
-                    intxn_type_Id_uri = URIRef(f"{row['interactionTypeId']}") if dp.is_none_na_or_empty(row['interactionTypeId']) else None #maybe add RO as namespace
-                    intxnRec_uri = emiBox[f"inRec{i}"]
-
-	                #declare intxn record as emi:Interaction, this will never be NA/Non/empty
-                    graph.add((intxnRec_uri, RDF.type, emi.Interaction))
-                    #add triples to the graph for interaction Record
-                    if dp.is_none_na_or_empty(source_taxon_uri):
-                        graph.add((intxnRec_uri, emi.hasSource, source_taxon_uri))
-                    if dp.is_none_na_or_empty(target_taxon_uri):
-                        graph.add((intxnRec_uri, emi.hasTarget, target_taxon_uri))
-		
-                    if dp.is_none_na_or_empty(intxn_type_uri) and dp.is_none_na_or_empty(intxn_type_Id_uri):
-                        graph.add((intxnRec_uri, emi.isClassifiedWith, intxn_type_Id_uri))
-                        if intxn_type_Id_uri not in intxnTypeSet:
-                            graph.add((intxn_type_Id_uri, RDF.type, emi.InteractionType))
-                            graph.add((intxn_type_Id_uri, RDFS.label, Literal(row['interactionTypeName'], datatype=XSD.string)))
-                            intxnTypeSet.add(intxn_type_Id_uri)
-                    if not dp.is_none_na_or_empty(intxn_type_Id_uri):
-                        graph.add((intxnRec_uri, emi.isClassifiedWith, intxn_type_uri))
-                        if intxn_type_uri not in intxnTypeSet:
-                            graph.add((intxn_type_uri, RDF.type, emi.InteractionType))
-                            intxnTypeSet.add(intxn_type_uri)
-		                #if dp.is_none_na_or_empty(intxn_type_uri):
-		                #     graph.add((intxn_type_uri, dcterms.identifier,intxn_type_Id_uri))
-		
-                    if dp.is_none_na_or_empty(row['localityName']):
-                        graph.add((intxnRec_uri, prov.atLocation, Literal(row['localityName'], datatype=XSD.string)))
-                    if dp.is_none_na_or_empty(row['referenceDoi']):
-                        graph.add((intxnRec_uri, dcterms.bibliographicCitation, Literal(row['referenceDoi'], datatype=XSD.string)))
-                    if dp.is_none_na_or_empty(row['sourceDOI']):
-                        graph.add((intxnRec_uri, dcterms.bibliographicCitation, Literal(row['sourceDOI'], datatype=XSD.string)))
-                    if dp.is_none_na_or_empty(row['decimalLatitude']):
-                        graph.add((intxnRec_uri, wgs84.lat, Literal(row['decimalLatitude'], datatype=XSD.string)))
-                    if dp.is_none_na_or_empty(row['decimalLongitude']):
-                        graph.add((intxnRec_uri, wgs84.long, Literal(row['decimalLongitude'], datatype=XSD.string)))
-	                    #graph.add((intxnRec_uri, URIRef("http://www.w3.org/2003/01/geo/wgs84_pos#long"), Literal(row['decimalLongitude'], datatype=XSD.string)))
-		
-		            #add triples for source and targets
-                    if dp.is_none_na_or_empty(row['sourceTaxonNameMapped']) and dp.is_none_na_or_empty(source_taxon_uri):
-                        sourceSample_uri = emiBox[f"ORGANISM-{dp.format_uri(row['sourceTaxonNameMapped'])}"]
-                        graph.add((source_taxon_uri, RDF.type, sosa.Sample))
-                        graph.add((source_taxon_uri, RDFS.label, Literal(row['sourceTaxonNameMapped'], datatype=XSD.string)))
-                        graph.add((source_taxon_uri, sosa.isSampleOf, sourceSample_uri))
-                    if dp.is_none_na_or_empty(row['sourceTaxonIdMapped']) and dp.is_none_na_or_empty(source_taxon_uri):
-                        graph.add((source_taxon_uri, emi.inTaxon, wd[f"{row['sourceTaxonIdMapped']}"]))
-		
-                    if dp.is_none_na_or_empty(row['targetTaxonNameMapped']) and dp.is_none_na_or_empty(target_taxon_uri):
-                        targetSample_uri = emiBox[f"ORGANISM-{dp.format_uri(row['targetTaxonNameMapped'])}"]
-                        graph.add((target_taxon_uri, RDF.type, sosa.Sample))
-                        graph.add((target_taxon_uri, RDFS.label, Literal(row['targetTaxonNameMapped'], datatype=XSD.string)))
-                        graph.add((target_taxon_uri, sosa.isSampleOf, targetSample_uri))
-                    if dp.is_none_na_or_empty(row['targetTaxonIdMapped']) and dp.is_none_na_or_empty(target_taxon_uri):
-                        graph.add((target_taxon_uri, emi.inTaxon, wd[f"{row['targetTaxonIdMapped']}"]))
-		        
-		            # write body part, physiological state, and other taxon attributes (if available)
-		            # first read the file in which the mappings are stored, followed by triples generation
-		            # for body part names
-                    if (dp.is_none_na_or_empty(row['sourceBodyPartName']) or dp.is_none_na_or_empty(row['sourceBodyPartId'])) and dp.is_none_na_or_empty(source_taxon_uri):
-                        print("NAMES",row["sourceTaxonId"], row["sourceTaxonName"], row["targetTaxonId"], row["targetTaxonName"], sep="\t")
-                        add_entity_to_graph(row['sourceBodyPartName'],row['sourceBodyPartId'],source_taxon_uri,emi.hasAnatomicalEntity,emi.AnatomicalEntity, "ANATOMICAL_ENTITY", graph, bodyPartSet)
-                    if (dp.is_none_na_or_empty(row['targetBodyPartName']) or dp.is_none_na_or_empty(row['targetBodyPartId'])) and dp.is_none_na_or_empty(target_taxon_uri):
-                        print("NAMES",row["sourceTaxonId"], row["sourceTaxonName"], row["targetTaxonId"], row["targetTaxonName"], sep="\t")
-                        add_entity_to_graph(row['targetBodyPartName'],row['targetBodyPartId'],target_taxon_uri,emi.hasAnatomicalEntity,emi.AnatomicalEntity, "ANATOMICAL_ENTITY", graph, bodyPartSet)
-		            
-		            # for life stage names
-                    if (dp.is_none_na_or_empty(row['sourceLifeStageName']) or dp.is_none_na_or_empty(row['sourceLifeStageId'])) and dp.is_none_na_or_empty(source_taxon_uri):
-                        print("NAMES",row["sourceTaxonId"], row["sourceTaxonName"], row["targetTaxonId"], row["targetTaxonName"], sep="\t")
-                        add_entity_to_graph(row['sourceLifeStageName'],row['sourceLifeStageId'],source_taxon_uri,emi.hasDevelopmentalStage, emi.DevelopmentalStage, "DEVELOPMENTAL_STAGE", graph, lifeStageSet)
-                    if (dp.is_none_na_or_empty(row['targetLifeStageName']) or dp.is_none_na_or_empty(row['targetLifeStageId'])) and dp.is_none_na_or_empty(target_taxon_uri):
-                        print("NAMES",row["sourceTaxonId"], row["sourceTaxonName"], row["targetTaxonId"], row["targetTaxonName"], sep="\t")
-                        add_entity_to_graph(row['targetLifeStageName'],row['targetLifeStageId'],target_taxon_uri,emi.hasDevelopmentalStage, emi.DevelopmentalStage, "DEVELOPMENTAL_STAGE", graph, lifeStageSet)
-		
-		            #for biological sex
-                    if dp.is_none_na_or_empty(row['sourceSexName']) and dp.is_none_na_or_empty(source_taxon_uri):
-                        genderDict = mbg.map_terms_to_values(row['sourceSexName'])
-                        for uri, qty in genderDict.items():
-                            gData = BNode()
-                            graph.add((source_taxon_uri, emi.hasSex, gData))
-                            graph.add((gData, qudt.quantityKind, URIRef(uri)))
-                            graph.add((gData, qudt.numericValue, Literal(qty, datatype=XSD.integer)))
-                            ent = URIRef(uri)
-                            if ent not in biologicalSexSet:
-                                graph.add((ent, RDF.type, emi.BiologicalSex))
-                                biologicalSexSet.add(ent)
-
-                    if dp.is_none_na_or_empty(row['targetSexName']) and dp.is_none_na_or_empty(target_taxon_uri):
-                        genderDict = mbg.map_terms_to_values(row['targetSexName'])
-                        for uri, qty in genderDict.items():
-                            gData = BNode()
-                            graph.add((source_taxon_uri, emi.hasSex, gData))
-                            graph.add((gData, qudt.quantityKind, URIRef(uri)))
-                            graph.add((gData, qudt.numericValue, Literal(qty, datatype=XSD.integer)))
-                            ent = URIRef(uri)
-                            if ent not in biologicalSexSet:
-                                graph.add((ent, RDF.type, emi.BiologicalSex))  
-                                biologicalSexSet.add(ent)
-		            
-                    i = i + 1 #check if i is increasing as expected. appears to do so
-            dp.add_inverse_relationships(graph)
-
-            #checkpoint process - update checkpoint
-            current_index += batch_size
-            with open(checkpoint_file, "w") as f:
-                f.write(str(current_index))
-
-
-	        #serialize the graph for the batch and write to the file
-            with gzip.open(output_file, "at", encoding="utf-8") as out_file:  # Append mode
-                    print("written triples for",)
-                    out_file.write(graph.serialize(format="turtle_custom"))
-	        # Clear the graph to free memory
-            del graph
-        except Exception as e:
-            print(f"Error occurred at batch {current_index}: {e}")
-            break  # stop execution, allowing resumption later
+    # body parts and life stages already resolved with the same mapping files
+    digest = dp.files_digest([bpFileName, lsFileName], extra=repr(fungiTerms) + repr(list(prefix_to_namespace)))
+    entityTable = EntityTable(entity_table_file, digest)
+
+    # everything besides the input rows which the triples depend on, the rows of the previous input are generated again when it changes
+    delta_context = dp.files_digest([wd_map_file, bpFileName, lsFileName, mbg.get_sex_parser().dataFile],
+                                    extra=digest + repr((inverse, fuzzy_distance))) if delta_index_file else ""
+
+    # start a new output file, or resume after the last complete batch of an interrupted run
+    manifest_file = f"{output_file}.resume.json"
+    input_offset, i, typeSets, rejects, delta = start_or_resume(input_csv_gz, output_file, manifest_file, reject_file or f"{output_file}.rejects.tsv.gz", delta_index_file, delta_context)
+
+    # declare sets to check later if some generic types like interaction, biological sex, developmental stage, etc already got serialized in one of the previous batches
+    intxnTypeSet = typeSets[emi.InteractionType]
+    biologicalSexSet = typeSets[emi.BiologicalSex]
+    lifeStageSet = typeSets[emi.DevelopmentalStage]
+    bodyPartSet = typeSets[emi.AnatomicalEntity]
+
+    # read gzipped TSV file in chunks, starting after the last complete batch
+    chunks = staging.read_input_chunks(input_csv_gz, batch_size, start_offset=input_offset)
+    with ParallelGzipWriter(output_file, append=True, level=compress_level, threads=compress_threads) as out_file:
+        if workers > 0:
+            generate_rdf_in_shards(chunks, resolver, name_matcher, entityTable, input_csv_gz, out_file, engine, workers, i, typeSets, manifest_file, rejects, delta, inverse, streaming)
+        else:
+            # process in batches
+            for batch_data, input_offset in chunks:
+                try:
+                    batchStart = time.perf_counter()
+                    # map source and target taxa of the whole batch to WD, and drop unresolved and same-source-target rows
+                    with metrics.timer("resolve_taxa"):
+                        if delta is not None:
+                            batch_data = delta.split(batch_data)  # only the rows which are not in the previous input
+                        batch_data = resolve_taxon_ids(batch_data, resolver, rejects, name_matcher)
+                        batch_data = name_records(batch_data, i)
+                    # resolve the distinct body parts and life stages of the batch which are not in the table yet
+                    with metrics.timer("resolve_entities"):
+                        batchEntities = entityTable.resolve_batch(batch_data)
+                        reject_unresolved_entities(batch_data, batchEntities, rejects)
+
+                    # initialize a new graph for this batch, or a stream writing the triples directly to the output file
+                    graph = new_batch_graph(engine, out_file, inverse, streaming)
+                    with metrics.timer("generate"):
+                        i = add_batch_to_graph(graph, batch_data, batchEntities, i, intxnTypeSet, biologicalSexSet, lifeStageSet, bodyPartSet)
+                    finish_batch_graph(graph, engine, out_file, inverse, streaming)
+                    # the batch ends with a complete gzip member, so that a resumed run can cut the output there
+                    with metrics.timer("compress"):
+                        output_size = out_file.sync()
+                    metrics.add_time("batch", time.perf_counter() - batchStart)
+                    print(f"written triples for records up to inRec{i}")
+
+                    # record where to resume, now that the batch is complete
+                    reject_size = rejects.flush()
+                    delta_size = delta.flush() if delta is not None else 0
+                    save_resume_state(manifest_file, input_csv_gz, input_offset, i, typeSets, output_size, reject_size, delta_size)
+
+                    # Clear the graph to free memory
+                    del graph
+                except Exception as e:
+                    print(f"Error occurred in the batch ending at input offset {input_offset}: {e}")
+                    return  # stop execution, allowing resumption later
+
+    # the run is complete, the index of the incremental mode now describes this input
+    if delta is not None:
+        indexed, retired = delta.finish(f"{output_file}.retired.txt.gz", f"{emiBox}inRec-")
+        print(f"{indexed} rows indexed in {delta_index_file}, {retired} retired records listed in {output_file}.retired.txt.gz")
+    # a new run starts from scratch
+    if os.path.exists(manifest_file):
+        os.remove(manifest_file)
     print(f"RDF triples saved to {output_file}")
 
 # Main execution
-#if __name__ == "__main__":
-configFile = "config.txt"
-if os.path.exists(configFile):       #if config file is available
+if __name__ == "__main__":
+    configFile = "config.txt"
+    if os.path.exists(configFile):       #if config file is available
         config = configparser.ConfigParser()
         config.read(configFile)
         csv_file1 = config.get('input tsv files', 'globi_tsv')
         csv_file2 = config.get('accessory files', 'wd_map_file')
         csv_file3 = config.get('accessory files', 'enpkg_wd')
+        resolver_file = config.get('accessory files', 'taxon_resolver', fallback="taxon_resolver.sqlite")
         output_file = config.get('output files', 'globi_ttl')
-else:                               #else use command line arguments
+        engine = config.get('run options', 'globi_engine', fallback="rdflib")
+        workers = config.getint('run options', 'globi_workers', fallback=0)
+        entity_table_file = config.get('run options', 'globi_entity_table', fallback="globi_entity_table.tsv.gz")
+        reject_file = config.get('output files', 'globi_rejects', fallback="")
+        compress_level = config.getint('run options', 'compress_level', fallback=6)
+        compress_threads = config.getint('run options', 'compress_threads', fallback=0)
+        inverse = config.getboolean('run options', 'inverse_relations', fallback=True)
+        streaming = config.getboolean('run options', 'turtle_streaming', fallback=False)
+        delta_index_file = config.get('run options', 'globi_incremental_index', fallback="")
+        fuzzy_distance = config.getint('run options', 'globi_fuzzy_distance', fallback=0)
+        metrics.configure(config.get('run options', 'log_level', fallback="info"), config.getint('run options', 'log_sample', fallback=1000))
+        metrics_file = config.get('run options', 'metrics_file', fallback="")
+    else:                               #else use command line arguments
         # Create the argument parser
         parser = argparse.ArgumentParser()
 
@@ -403,6 +780,19 @@ else:                               #else use command line arguments
         parser.add_argument('wdMapFile', type=str, help="Enter the file name containing mapping of GloBI names to wikidata")
         parser.add_argument('joinFile', type=str, help="Enter the file name which will be used for filtering or joining the input_file")
         parser.add_argument('outputFile', type=str, help="Enter the output file name")
+        parser.add_argument('--engine', type=str, choices=["rdflib", "stream"], default="rdflib", help="Build a graph per batch with rdflib, or stream the triples directly to the output file")
+        parser.add_argument('--entity-table', type=str, default="globi_entity_table.tsv.gz", help="Table of the resolved body part and life stage names, reused by later runs")
+        parser.add_argument('--log-level', type=str, choices=["quiet", "info", "debug"], default="info", help="Diagnostic output: none, sampled, or one line per row")
+        parser.add_argument('--metrics-file', type=str, default="", help="Write the counters and timings of the run to this file (.json, or .prom for Prometheus text)")
+        parser.add_argument('--workers', type=int, default=0, help="Number of worker processes generating the batches in parallel (0 to process them one after the other)")
+        parser.add_argument('--rejects-file', type=str, default="", help="Gzipped TSV file of the dropped rows with their reason (default <outputFile>.rejects.tsv.gz)")
+        parser.add_argument('--compress-level', type=int, default=6, help="gzip compression level of the output file, from 1 (fastest) to 9 (smallest)")
+        parser.add_argument('--compress-threads', type=int, default=0, help="Number of threads compressing the output file (0 for the number of CPUs)")
+        parser.add_argument('--no-inverse', action="store_true", help="Do not add the inverse relationships (e.g. sosa:hasSample of sosa:isSampleOf), for endpoints which infer them at query time")
+        parser.add_argument('--turtle-streaming', action="store_true", help="Write the Turtle of every batch in insertion order, without sorting it")
+        parser.add_argument('--resolver-file', type=str, default="taxon_resolver.sqlite", help="Taxon resolver file, built from the mapping file and shared with the other generators")
+        parser.add_argument('--fuzzy-distance', type=int, default=0, help="Match the taxon names which are not in the mapping file within this edit distance (0 to match them exactly only)")
+        parser.add_argument('--incremental-index', type=str, default="", help="Index of the rows of the previous input: generate the triples of the new rows only, and list the retired records")
 
         # Parse the arguments
         args = parser.parse_args()
@@ -410,6 +800,20 @@ else:                               #else use command line arguments
         csv_file2 = args.wdMapFile
         csv_file3 = args.joinFile
         output_file = args.outputFile
-
-
-generate_rdf_in_batches(csv_file1, csv_file3, csv_file2, output_file, join_column="wd_taxon_id", batch_size=100000)
+        engine = args.engine
+        workers = args.workers
+        entity_table_file = args.entity_table
+        reject_file = args.rejects_file
+        compress_level = args.compress_level
+        compress_threads = args.compress_threads
+        inverse = not args.no_inverse
+        streaming = args.turtle_streaming
+        delta_index_file = args.incremental_index
+        fuzzy_distance = args.fuzzy_distance
+        resolver_file = args.resolver_file
+        metrics.configure(args.log_level)
+        metrics_file = args.metrics_file
+
+    generate_rdf_in_batches(csv_file1, csv_file3, csv_file2, output_file, join_column="wd_taxon_id", batch_size=100000, engine=engine, workers=workers, entity_table_file=entity_table_file, reject_file=reject_file, compress_level=compress_level, compress_threads=compress_threads, inverse=inverse, streaming=streaming, delta_index_file=delta_index_file or None, fuzzy_distance=fuzzy_distance, resolver_file=resolver_file)
+    if metrics_file:
+        metrics.dump(metrics_file)
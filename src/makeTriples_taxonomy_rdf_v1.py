@@ -11,11 +11,18 @@ from rdflib import URIRef, Literal, Namespace, RDF, RDFS, XSD, DCTERMS, Graph, B
 import gzip
 import rdflib
 import argparse
+import configparser
+import os
 import sys
+import time
 
 
 sys.path.append('./functions')  # Add the 'src' directory to the sys.path
 import data_processing as dp
+from run_metrics import metrics
+from gzip_writer import ParallelGzipWriter
+from wd_index import WdIdIndex
+import staging
 
 
 rdflib.plugin.register('turtle_custom', rdflib.plugin.Serializer, 'turtle_custom.serializer', 'TurtleSerializerCustom')
@@ -31,8 +38,104 @@ otol = Namespace("https://tree.opentreeoflife.org/taxonomy/browse")
 skos = Namespace("http://www.w3.org/2004/02/skos/core#")
 
 
+# Cross-references of the taxa, written for every row with a value in the column:
+# (column, IRI prefix of the identifiers, scheme of the identifiers, datatype of the identifier literal)
+xref_table = [
+    ("ncbi.wd", "http://purl.uniprot.org/taxonomy/", "http://purl.obolibrary.org/obo/ncbitaxon.owl", XSD.string),
+    ("gbif.ott", "https://www.gbif.org/species/", "https://www.gbif.org/species", XSD.int),
+    ("eol", "https://www.eol.org/pages/", "https://www.eol.org", XSD.int),
+    ("itis", "https://itis.gov/servlet/SingleRpt/SingleRpt?search_topic=TSN&search_value=", "https://itis.gov", XSD.string),
+    ("irmng.wd", "https://www.irmng.org/aphia.php?p=taxdetails&id=", "https://www.irmng.org", XSD.string),
+    ("worms.wd", "https://www.marinespecies.org/aphia.php?p=taxdetails&id=", "https://www.marinespecies.org", XSD.string),
+    ("col", "https://www.catalogueoflife.org/data/taxon/", "https://www.catalogueoflife.org", XSD.string),
+    ("nbn", "https://species.nbnatlas.org/species/", "https://species.nbnatlas.org", XSD.string),
+    ("msw3", "https://departments.bucknell.edu/biology/resources/msw3/browse.asp?id=", "https://departments.bucknell.edu/biology/resources/msw3", XSD.string),
+]
+
+# Columns of the taxonomy file which are used, read from a Parquet staging file
+taxonomy_columns = ["ott", "WdID"] + [column for column, _, _, _ in xref_table]
+
+# Labels of the taxonomy schemes, written once per file
+scheme_labels = {
+    "http://purl.obolibrary.org/obo/ncbitaxon.owl": "NCBI organismal classification",
+    "https://www.gbif.org/species": "The GBIF taxonomy",
+    "https://www.eol.org": "Encyclopedia of Life",
+    "https://itis.gov": "Integrated Taxonomic Information System",
+    "https://www.irmng.org": "Interim Register of Marine and Nonmarine Genera",
+    "https://www.marinespecies.org": "World Register of Marine Species",
+    "https://www.catalogueoflife.org": "Catalogue of Life",
+    "https://species.nbnatlas.org": "National Biodiversity Network",
+    "https://departments.bucknell.edu/biology/resources/msw3": "Mammal Species of the World",
+    "http://www.wikidata.org/entity": "Wikidata entities",
+}
+
+
+# Prefixes written once at the top of the output file
+turtle_prefixes = (
+    "@prefix emi: <https://purl.org/emi#> .\n"
+    "@prefix skos: <http://www.w3.org/2004/02/skos/core#> .\n"
+    "@prefix : <https://purl.org/emi/abox#> .\n"
+    "@prefix sosa: <http://www.w3.org/ns/sosa/> .\n"
+    "@prefix dcterms: <http://purl.org/dc/terms/> .\n"
+    "@prefix wd: <http://www.wikidata.org/entity/> .\n"
+    "@prefix rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#> .\n"
+    "@prefix rdfs: <http://www.w3.org/2000/01/rdf-schema#> .\n"
+    "@prefix xsd: <http://www.w3.org/2001/XMLSchema#> .\n"
+    "@prefix otol: <https://tree.opentreeoflife.org/taxonomy/browse> .\n\n"
+)
+
+
+# Function to initialize the graph of a batch
+def new_batch_graph(streaming):
+    graph = Graph(store="SimpleMemory") if streaming else Graph()  # the simple store keeps the insertion order
+    graph.bind("", emiBox)  # ":" will now map to "https://purl.org/emi/abox#"
+    graph.bind("emi", emi)  # Bind the 'emi' prefix explicitly
+    graph.bind("sosa", sosa)  # Bind the 'emi' prefix explicitly
+    graph.bind("dcterms", dcterms)  # Bind the 'emi' prefix explicitly
+    graph.bind("wd", wd)  # Bind the 'emi' prefix explicitly
+    graph.bind("otol", otol)  # Bind the 'emi' prefix explicitly
+    graph.bind("skos", skos)  # Bind the 'emi' prefix explicitly
+    #graph.namespace_manager.bind("_", nTemp)
+    return graph
+
+
+# Function to add the triples of the taxa of a batch
+def add_taxa_to_graph(graph, batch_data):
+    """
+    Add the cross-references of xref_table and the Wikidata entity of every taxon of a batch to the graph. The batch is
+    melted to one row per (taxon, cross-reference) and the triples of every column are built from whole columns.
 
-def generate_rdf_in_batches(input_csv_gz, join_csv, output_file, join_column, batch_size=1000):
+    :param graph: rdflib.Graph receiving the triples.
+    :param batch_data: DataFrame with the rows of the taxonomy file.
+    """
+    # Define URIs (NaN where the ott or WdID is missing)
+    taxa = pd.DataFrame({
+        "taxonomy_uri": (f"{otol}?id=" + batch_data["ott"]).where(dp.is_none_na_or_empty_column(batch_data["ott"])),
+        "wikidata_uri": (str(wd) + batch_data["WdID"]).where(dp.is_none_na_or_empty_column(batch_data["WdID"])),
+    })
+    xrefs = taxa.join(batch_data[[column for column, _, _, _ in xref_table]]).melt(id_vars=["taxonomy_uri", "wikidata_uri"], var_name="column", value_name="value")
+    xrefs = xrefs[dp.is_none_na_or_empty_column(xrefs["value"])]
+    xrefs = xrefs.assign(xref_uri=xrefs["column"].map({column: prefix for column, prefix, _, _ in xref_table}) + xrefs["value"])
+
+    for column, _, scheme, datatype in xref_table:
+        group = xrefs[xrefs["column"] == column]
+        xref_uris = [URIRef(uri) for uri in group["xref_uri"]]
+        graph.addN((URIRef(uri), skos.exactMatch, xref_uri, graph) for uri, xref_uri in zip(group["wikidata_uri"], xref_uris) if pd.notna(uri))
+        graph.addN((URIRef(uri), skos.exactMatch, xref_uri, graph) for uri, xref_uri in zip(group["taxonomy_uri"], xref_uris) if pd.notna(uri))
+        graph.addN((xref_uri, dcterms.identifier, Literal(value, datatype=datatype), graph) for xref_uri, value in zip(xref_uris, group["value"]))
+        graph.addN((xref_uri, skos.inScheme, URIRef(scheme), graph) for xref_uri in xref_uris)
+
+    # Wikidata entities of the taxa
+    taxa = taxa.assign(WdID=batch_data["WdID"])[taxa["wikidata_uri"].notna()]
+    wikidata_uris = [URIRef(uri) for uri in taxa["wikidata_uri"]]
+    graph.addN((URIRef(uri), skos.exactMatch, wikidata_uri, graph) for uri, wikidata_uri in zip(taxa["taxonomy_uri"], wikidata_uris) if pd.notna(uri))
+    graph.addN((wikidata_uri, dcterms.identifier, Literal(wdId, datatype=XSD.string), graph) for wikidata_uri, wdId in zip(wikidata_uris, taxa["WdID"]))
+    graph.addN((wikidata_uri, RDF.type, emi.Taxon, graph) for wikidata_uri in wikidata_uris)
+    graph.addN((wikidata_uri, skos.inScheme, URIRef("http://www.wikidata.org/entity"), graph) for wikidata_uri in wikidata_uris)
+
+
+
+def generate_rdf_in_batches(input_csv_gz, join_csv, output_file, join_column, batch_size=1000, compress_level=6, compress_threads=None, inverse=True, streaming=False):
     """
     Generate RDF triples in compact Turtle format using batches of rows and rdflib for serialization.
 
@@ -41,148 +144,63 @@ def generate_rdf_in_batches(input_csv_gz, join_csv, output_file, join_column, ba
     :param output_file: Path to the output Turtle file.
     :param join_column: Column name for joining the two CSVs.
     :param batch_size: The number of rows to process per batch.
+    :param compress_level: gzip compression level of the output file.
+    :param compress_threads: Number of threads compressing the output file (see ParallelGzipWriter), the number of CPUs by default.
+    :param inverse: Add the inverse relationships of dp.INVERSE_RELATIONS.
+    :param streaming: Serialize the graph of every batch in insertion order instead of sorting it (see TurtleSerializerCustom.serialize_streaming).
     """
     # Load input data
-    data1 = pd.read_csv(input_csv_gz, compression="gzip", sep="\t", dtype=str)
-    data2 = pd.read_csv(join_csv, compression="gzip",  sep="\t", dtype=str)
+    if staging.is_parquet(input_csv_gz):
+        data1 = staging.read_parquet(input_csv_gz, columns=taxonomy_columns)
+    else:
+        data1 = pd.read_csv(input_csv_gz, compression="gzip", sep="\t", dtype=str)
+    enpkgIds = WdIdIndex.load(join_csv, join_column)
 
     # Filter the taxonomy data to include only rows with WdID found in enpkg['wd_taxon_id']
-    merged_data = data1[data1['WdID'].isin(data2[join_column])]
+    merged_data = data1[enpkgIds.contains(data1['WdID'])]
+    metrics.count("rows_read", len(data1))
+    metrics.count("rows_dropped", len(data1) - len(merged_data), reason="not_in_enpkg")
     print(merged_data.shape)
 
     
-    # Open the output file for writing
-    with gzip.open(output_file, "wt", encoding="utf-8") as out_file:
-        # Write prefixes directly to the file
-        out_file.write("@prefix emi: <https://purl.org/emi#> .\n")
-        out_file.write("@prefix skos: <http://www.w3.org/2004/02/skos/core#> .\n")
-        out_file.write("@prefix : <https://purl.org/emi/abox#> .\n")
-        out_file.write("@prefix sosa: <http://www.w3.org/ns/sosa/> .\n")
-        out_file.write("@prefix dcterms: <http://purl.org/dc/terms/> .\n")
-        out_file.write("@prefix wd: <http://www.wikidata.org/entity/> .\n")
-        out_file.write("@prefix rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#> .\n")
-        out_file.write("@prefix rdfs: <http://www.w3.org/2000/01/rdf-schema#> .\n")
-        out_file.write("@prefix xsd: <http://www.w3.org/2001/XMLSchema#> .\n")
-        out_file.write("@prefix otol: <https://tree.opentreeoflife.org/taxonomy/browse> .\n\n")
+    # Open the output file for writing, it stays open for all the batches and compresses them in the background
+    out_file = ParallelGzipWriter(output_file, level=compress_level, threads=compress_threads)
+    # Write prefixes directly to the file
+    out_file.write(turtle_prefixes)
+
+    # Labels of the taxonomy schemes, once for the whole file
+    graph = new_batch_graph(streaming)
+    for scheme, label in scheme_labels.items():
+        graph.add((URIRef(scheme), RDFS.label, Literal(label, datatype=XSD.string)))
+    out_file.write(graph.serialize(format="turtle_custom", streaming=streaming, prefixes=turtle_prefixes))
+    metrics.count("triples_emitted", len(graph))
 
 
     # Process in batches
     for start_row in range(0, len(merged_data), batch_size):
         end_row = min(start_row + batch_size, len(merged_data))
+        batchStart = time.perf_counter()
         batch_data = merged_data[start_row:end_row]
-        print(batch_data.shape)
-        print(start_row)
+        metrics.diagnostic("BATCH", start_row, len(batch_data))
         # Initialize a new graph for this batch
-        graph = Graph()
-        graph.bind("", emiBox)  # ":" will now map to "https://purl.org/emi/abox#"
-        graph.bind("emi", emi)  # Bind the 'emi' prefix explicitly
-        graph.bind("sosa", sosa)  # Bind the 'emi' prefix explicitly
-        graph.bind("dcterms", dcterms)  # Bind the 'emi' prefix explicitly
-        graph.bind("wd", wd)  # Bind the 'emi' prefix explicitly
-        graph.bind("otol", otol)  # Bind the 'emi' prefix explicitly
-        graph.bind("skos", skos)  # Bind the 'emi' prefix explicitly
-        #graph.namespace_manager.bind("_", nTemp)
-
-        # Process each row in the batch
-        for _, row in batch_data.iterrows():
-#            graph.namespace_manager.bind("_", nTemp)
-            # Define URIs (ensure spaces are replaced with underscores)
-            taxonomy_uri = otol[f"?id={row['ott']}"] if dp.is_none_na_or_empty(row['ott']) else None
-            wikidata_uri = wd[f"{row['WdID']}"] if dp.is_none_na_or_empty(row['WdID']) else None
-
-            # Add triples to the graph
-            if dp.is_none_na_or_empty(row['ncbi.wd']):
-                if dp.is_none_na_or_empty(wikidata_uri):
-                    graph.add((wikidata_uri, skos.exactMatch, URIRef(f"http://purl.uniprot.org/taxonomy/{row['ncbi.wd']}")))
-                graph.add((taxonomy_uri, skos.exactMatch, URIRef(f"http://purl.uniprot.org/taxonomy/{row['ncbi.wd']}")))
-                graph.add((URIRef(f"http://purl.uniprot.org/taxonomy/{row['ncbi.wd']}"), dcterms.identifier, Literal(row['ncbi.wd'], datatype=XSD.string)))
-                graph.add((URIRef(f"http://purl.uniprot.org/taxonomy/{row['ncbi.wd']}"), skos.inScheme, URIRef("http://purl.obolibrary.org/obo/ncbitaxon.owl")))
-
-            if dp.is_none_na_or_empty(row['gbif.ott']):
-                if dp.is_none_na_or_empty(wikidata_uri):
-                    graph.add((wikidata_uri, skos.exactMatch, URIRef(f"https://www.gbif.org/species/{row['gbif.ott']}")))
-                graph.add((taxonomy_uri, skos.exactMatch, URIRef(f"https://www.gbif.org/species/{row['gbif.ott']}")))
-                graph.add((URIRef(f"https://www.gbif.org/species/{row['gbif.ott']}"), dcterms.identifier, Literal(row['gbif.ott'], datatype=XSD.int)))
-                graph.add((URIRef(f"https://www.gbif.org/species/{row['gbif.ott']}"), skos.inScheme, URIRef("https://www.gbif.org/species")))
-
-            if dp.is_none_na_or_empty(row['eol']):
-                if dp.is_none_na_or_empty(wikidata_uri):
-                    graph.add((wikidata_uri, skos.exactMatch, URIRef(f"https://www.eol.org/pages/{row['eol']}")))
-                graph.add((taxonomy_uri, skos.exactMatch, URIRef(f"https://www.eol.org/pages/{row['eol']}")))
-                graph.add((URIRef(f"https://www.eol.org/pages/{row['eol']}"), dcterms.identifier, Literal(row['eol'], datatype=XSD.int)))
-                graph.add((URIRef(f"https://www.eol.org/pages/{row['eol']}"), skos.inScheme, URIRef("https://www.eol.org")))
-
-            if dp.is_none_na_or_empty(row['itis']):
-                if dp.is_none_na_or_empty(wikidata_uri):
-                    graph.add((wikidata_uri, skos.exactMatch, URIRef(f"https://itis.gov/servlet/SingleRpt/SingleRpt?search_topic=TSN&search_value={row['itis']}")))
-                graph.add((taxonomy_uri, skos.exactMatch, URIRef(f"https://itis.gov/servlet/SingleRpt/SingleRpt?search_topic=TSN&search_value={row['itis']}")))
-                graph.add((URIRef(f"https://itis.gov/servlet/SingleRpt/SingleRpt?search_topic=TSN&search_value={row['itis']}"), dcterms.identifier, Literal(row['itis'], datatype=XSD.string)))
-                graph.add((URIRef(f"https://itis.gov/servlet/SingleRpt/SingleRpt?search_topic=TSN&search_value={row['itis']}"), skos.inScheme, URIRef("https://itis.gov")))
-
-            if dp.is_none_na_or_empty(row['irmng.wd']):
-                if dp.is_none_na_or_empty(wikidata_uri):
-                    graph.add((wikidata_uri, skos.exactMatch, URIRef(f"https://www.irmng.org/aphia.php?p=taxdetails&id={row['irmng.wd']}")))
-                graph.add((taxonomy_uri, skos.exactMatch, URIRef(f"https://www.irmng.org/aphia.php?p=taxdetails&id={row['irmng.wd']}")))
-                graph.add((URIRef(f"https://www.irmng.org/aphia.php?p=taxdetails&id={row['irmng.wd']}"), dcterms.identifier, Literal(row['irmng.wd'], datatype=XSD.string)))
-                graph.add((URIRef(f"https://www.irmng.org/aphia.php?p=taxdetails&id={row['irmng.wd']}"), skos.inScheme, URIRef("https://www.irmng.org")))
-
-            if dp.is_none_na_or_empty(row['worms.wd']):
-                if dp.is_none_na_or_empty(wikidata_uri):
-                    graph.add((wikidata_uri, skos.exactMatch, URIRef(f"https://www.marinespecies.org/aphia.php?p=taxdetails&id={row['worms.wd']}")))
-                graph.add((taxonomy_uri, skos.exactMatch, URIRef(f"https://www.marinespecies.org/aphia.php?p=taxdetails&id={row['worms.wd']}")))
-                graph.add((URIRef(f"https://www.marinespecies.org/aphia.php?p=taxdetails&id={row['worms.wd']}"), dcterms.identifier, Literal(row['worms.wd'], datatype=XSD.string)))
-                graph.add((URIRef(f"https://www.marinespecies.org/aphia.php?p=taxdetails&id={row['worms.wd']}"), skos.inScheme, URIRef("https://www.marinespecies.org")))
-
-            if dp.is_none_na_or_empty(row['col']):
-                if dp.is_none_na_or_empty(wikidata_uri):
-                    graph.add((wikidata_uri, skos.exactMatch, URIRef(f"https://www.catalogueoflife.org/data/taxon/{row['col']}")))
-                graph.add((taxonomy_uri, skos.exactMatch, URIRef(f"https://www.catalogueoflife.org/data/taxon/{row['col']}")))
-                graph.add((URIRef(f"https://www.catalogueoflife.org/data/taxon/{row['col']}"), dcterms.identifier, Literal(row['col'], datatype=XSD.string)))
-                graph.add((URIRef(f"https://www.catalogueoflife.org/data/taxon/{row['col']}"), skos.inScheme, URIRef("https://www.catalogueoflife.org")))
-
-            if dp.is_none_na_or_empty(row['nbn']):
-                if dp.is_none_na_or_empty(wikidata_uri):
-                    graph.add((wikidata_uri, skos.exactMatch, URIRef(f"https://species.nbnatlas.org/species/{row['nbn']}")))
-                graph.add((taxonomy_uri, skos.exactMatch, URIRef(f"https://species.nbnatlas.org/species/{row['nbn']}")))
-                graph.add((URIRef(f"https://species.nbnatlas.org/species/{row['nbn']}"), dcterms.identifier, Literal(row['nbn'], datatype=XSD.string)))
-                graph.add((URIRef(f"https://species.nbnatlas.org/species/{row['nbn']}"), skos.inScheme, URIRef("https://species.nbnatlas.org")))
-
-            if dp.is_none_na_or_empty(row['msw3']):
-                if dp.is_none_na_or_empty(wikidata_uri):
-                    graph.add((wikidata_uri, skos.exactMatch, URIRef(f"https://departments.bucknell.edu/biology/resources/msw3/browse.asp?id={row['msw3']}")))
-                graph.add((taxonomy_uri, skos.exactMatch, URIRef(f"https://departments.bucknell.edu/biology/resources/msw3/browse.asp?id={row['msw3']}")))
-                graph.add((URIRef(f"https://departments.bucknell.edu/biology/resources/msw3/browse.asp?id={row['msw3']}"), dcterms.identifier, Literal(row['msw3'], datatype=XSD.string)))
-                graph.add((URIRef(f"https://departments.bucknell.edu/biology/resources/msw3/browse.asp?id={row['msw3']}"), skos.inScheme, URIRef("https://departments.bucknell.edu/biology/resources/msw3")))
-
-            if dp.is_none_na_or_empty(row['WdID']):
-                graph.add((taxonomy_uri, skos.exactMatch, URIRef(wd[f"{row['WdID']}"])))
-                graph.add((URIRef(wd[f"{row['WdID']}"]), dcterms.identifier, Literal(row['WdID'], datatype=XSD.string)))
-                graph.add((URIRef(wd[f"{row['WdID']}"]), RDF.type, emi.Taxon))
-                graph.add((URIRef(wd[f"{row['WdID']}"]), skos.inScheme, URIRef(f"http://www.wikidata.org/entity")))
-
-            # Add labels for all taxonomies
-            graph.add((URIRef("http://purl.obolibrary.org/obo/ncbitaxon.owl"), RDFS.label, Literal("NCBI organismal classification", datatype=XSD.string)))
-            graph.add((URIRef("https://www.gbif.org/species"), RDFS.label,Literal("The GBIF taxonomy", datatype=XSD.string)))
-            graph.add((URIRef("https://www.eol.org"), RDFS.label,Literal("Encyclopedia of Life", datatype=XSD.string)))
-            graph.add((URIRef("https://itis.gov"), RDFS.label,Literal("Integrated Taxonomic Information System", datatype=XSD.string)))
-            graph.add((URIRef("https://www.irmng.org"), RDFS.label,Literal("Interim Register of Marine and Nonmarine Genera", datatype=XSD.string)))
-            graph.add((URIRef("https://www.marinespecies.org"), RDFS.label,Literal("World Register of Marine Species", datatype=XSD.string)))
-            graph.add((URIRef("https://www.catalogueoflife.org"), RDFS.label,Literal("Catalogue of Life", datatype=XSD.string)))
-            graph.add((URIRef("https://species.nbnatlas.org"), RDFS.label,Literal("National Biodiversity Network", datatype=XSD.string)))
-            graph.add((URIRef("https://departments.bucknell.edu/biology/resources/msw3"), RDFS.label,Literal("Mammal Species of the World", datatype=XSD.string)))
-            graph.add((URIRef(f"http://www.wikidata.org/entity"), RDFS.label,Literal("Wikidata entities", datatype=XSD.string)))
-
-        dp.add_inverse_relationships(graph)
+        graph = new_batch_graph(streaming)
+        with metrics.timer("generate"):
+            add_taxa_to_graph(graph, batch_data)
+
+        if inverse:
+            dp.add_inverse_relationships(graph)
         # Serialize the graph for the batch and write to the file
-        with gzip.open(output_file, "at", encoding="utf-8") as out_file:  # Append mode
-            out_file.write(graph.serialize(format="turtle_custom"))
+        with metrics.timer("write"):
+            out_file.write(graph.serialize(format="turtle_custom", streaming=streaming, prefixes=turtle_prefixes))
         #out_file.flush()
+        metrics.count("triples_emitted", len(graph))
+        metrics.add_time("batch", time.perf_counter() - batchStart)
 
         # Clear the graph to free memory
     #    graph.remove((None, None, None))
         del graph
-        print(out_file)
 
+    out_file.close()  # compress and write the last block
     print(f"RDF triples saved to {output_file}")
 
 # Main execution
@@ -194,6 +212,12 @@ if __name__ == "__main__":
         csv_file1 = config.get('tsv files', 'taxonomy_tsv')
         csv_file2 = config.get('accessory files', 'enpkg_wd')
         output_file = config.get('output files', 'taxonomy_ttl')
+        metrics.configure(config.get('run options', 'log_level', fallback="info"), config.getint('run options', 'log_sample', fallback=1000))
+        metrics_file = config.get('run options', 'metrics_file', fallback="")
+        compress_level = config.getint('run options', 'compress_level', fallback=6)
+        compress_threads = config.getint('run options', 'compress_threads', fallback=0)
+        inverse = config.getboolean('run options', 'inverse_relations', fallback=True)
+        streaming = config.getboolean('run options', 'turtle_streaming', fallback=False)
     else:                               #else use command line arguments
         # Create the argument parser
         parser = argparse.ArgumentParser()
@@ -202,12 +226,26 @@ if __name__ == "__main__":
         parser.add_argument('inputFile', type=str, help="Enter the file name for which you want the triples")
         parser.add_argument('joinFile', type=str, help="Enter the file name which will be used for filtering or joining the input_file")
         parser.add_argument('outputFile', type=str, help="Enter the output file name")
+        parser.add_argument('--log-level', type=str, choices=["quiet", "info", "debug"], default="info", help="Diagnostic output: none, sampled, or one line per row")
+        parser.add_argument('--metrics-file', type=str, default="", help="Write the counters and timings of the run to this file (.json, or .prom for Prometheus text)")
+        parser.add_argument('--compress-level', type=int, default=6, help="gzip compression level of the output file, from 1 (fastest) to 9 (smallest)")
+        parser.add_argument('--compress-threads', type=int, default=0, help="Number of threads compressing the output file (0 for the number of CPUs)")
+        parser.add_argument('--no-inverse', action="store_true", help="Do not add the inverse relationships (e.g. sosa:hasSample of sosa:isSampleOf), for endpoints which infer them at query time")
+        parser.add_argument('--turtle-streaming', action="store_true", help="Write the Turtle of every batch in insertion order, without sorting it")
     
         # Parse the arguments
         args = parser.parse_args()
         csv_file1 = args.inputFile
         csv_file2 = args.joinFile
         output_file = args.outputFile
-
-    generate_rdf_in_batches(csv_file1, csv_file2, output_file, join_column="wd_taxon_id", batch_size=10000)
+        metrics.configure(args.log_level)
+        metrics_file = args.metrics_file
+        compress_level = args.compress_level
+        compress_threads = args.compress_threads
+        inverse = not args.no_inverse
+        streaming = args.turtle_streaming
+
+    generate_rdf_in_batches(csv_file1, csv_file2, output_file, join_column="wd_taxon_id", batch_size=10000, compress_level=compress_level, compress_threads=compress_threads, inverse=inverse, streaming=streaming)
+    if metrics_file:
+        metrics.dump(metrics_file)
 
@@ -15,10 +15,21 @@ import sys
 import configparser
 import os
 import re
+import time
+import collections
+import contextlib
+import multiprocessing
 
 sys.path.append('./functions')  # Add the 'src' directory to the sys.path
 import data_processing as dp
 from config import traitNames
+from run_metrics import metrics
+from gzip_writer import ParallelGzipWriter
+from reject_writer import RejectWriter
+from emit_once import EmitOnce
+from wd_index import WdIdIndex
+from taxon_resolver import TaxonResolver
+import staging
 
 
 rdflib.plugin.register('turtle_custom', rdflib.plugin.Serializer, 'turtle_custom.serializer', 'TurtleSerializerCustom')
@@ -37,7 +48,236 @@ qudtUnit = Namespace("http://qudt.org/vocab/unit/")
 
 
 
-def generate_rdf_in_batches(input_csv_gz, wdMapping_csv, join_csv, output_file, join_column1, join_column2, batch_size=1000, ch=1):
+# Columns of the TRY export which are used, the other ones are not read
+try_columns = ["AccSpeciesName", "ObservationID", "Dataset", "ObsDataID", "Reference", "TraitName", "OrigValueStr",
+               "DataName", "DataID", "OrigUnitStr", "UnitName"]
+
+
+# Function for joining the rows of a batch to the WdIDs of their species, like a left join on the mapping file
+def join_wd_ids(batch_data, wdIds):
+    """
+    Add the WdID column to a batch of TRY rows. A row whose species has several WdIDs is repeated for each of them,
+    and the WdID of a row whose species is not mapped is NaN.
+
+    :param batch_data: DataFrame with the TRY rows of one batch.
+    :param wdIds: Dictionary of the list of WdIDs of the TRY species names, see TaxonResolver.trydb_species.
+    :return: The rows with the WdID column.
+    """
+    batch_data = batch_data.assign(WdID=batch_data["AccSpeciesName"].map(wdIds))
+    return batch_data.explode("WdID", ignore_index=True)
+
+
+# Pattern of the trait values typed as xsd:double, the other values are typed as xsd:string
+#double_pattern = r"[-]?[0-9]+[\.]?[0-9]*"
+double_pattern = r"-?[0-9]+(\.[0-9]+)?(E[+-][0-9]+)?"
+
+
+# Function for the unit of a result, given its original unit string and its unit name
+def resolve_unit(entity, entity1, eNamesDict1, eNamesDict2):
+    """
+    Map the unit of a result to QUDT (eNamesDict1) or to the EMI units (eNamesDict2). OrigUnitStr is tried first
+    in QUDT, then UnitName in QUDT and in EMI, and OrigUnitStr in EMI only if there is no UnitName.
+
+    :param entity: OrigUnitStr of the result.
+    :param entity1: UnitName of the result.
+    :return: The IRI of the unit (None if it is not mapped), and the comment of the result (None if there is no OrigUnitStr).
+    """
+    if not dp.is_none_na_or_empty(entity):
+        return None, None
+    unit = None
+    if entity in eNamesDict1:
+        unit = str(qudtUnit[eNamesDict1[entity]])
+    elif dp.is_none_na_or_empty(entity1):
+        if entity1 in eNamesDict1:
+            unit = str(qudtUnit[eNamesDict1[entity1]])
+        elif entity1 in eNamesDict2:
+            unit = eNamesDict2[entity1.strip()]
+    elif entity in eNamesDict2:
+        unit = eNamesDict2[entity.strip()]
+    return unit, entity.strip()
+
+
+# Function for the units and the value datatypes of the results of a batch
+def type_results(batch_data, eNamesDict1, eNamesDict2):
+    """
+    Add the columns unitIRI and unitComment (see resolve_unit) and valueIsDouble to a batch of TRY rows, column-wise.
+    Every distinct (OrigUnitStr, UnitName) is resolved only once.
+
+    :param batch_data: DataFrame with the TRY rows of one batch.
+    :return: The rows with the added columns.
+    """
+    units = batch_data[["OrigUnitStr", "UnitName"]]
+    distinct = units.drop_duplicates()
+    resolved = [resolve_unit(entity, entity1, eNamesDict1, eNamesDict2) for entity, entity1 in distinct.itertuples(index=False)]
+    distinct = distinct.assign(unitIRI=[unit for unit, _ in resolved], unitComment=[comment for _, comment in resolved])
+    units = units.merge(distinct, how="left", on=["OrigUnitStr", "UnitName"])  # NaN keys match each other
+    return batch_data.assign(unitIRI=units["unitIRI"].to_numpy(), unitComment=units["unitComment"].to_numpy(),
+                             valueIsDouble=batch_data["OrigValueStr"].str.fullmatch(double_pattern, na=False).to_numpy(dtype=bool))
+
+
+# Prefixes written once at the top of the output file
+turtle_prefixes = (
+    "@prefix emi: <https://purl.org/emi#> .\n"
+    "@prefix emiUnit: <https://purl.org/emi/unit#> .\n"
+    "@prefix : <https://purl.org/emi/abox#> .\n"
+    "@prefix sosa: <http://www.w3.org/ns/sosa/> .\n"
+    "@prefix dcterms: <http://purl.org/dc/terms/> .\n"
+    "@prefix wd: <http://www.wikidata.org/entity/> .\n"
+    "@prefix rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#> .\n"
+    "@prefix rdfs: <http://www.w3.org/2000/01/rdf-schema#> .\n"
+    "@prefix xsd: <http://www.w3.org/2001/XMLSchema#> .\n"
+    "@prefix qudt: <https://qudt.org/2.1/schema/qudt#> .\n"
+    "@prefix qudtUnit: <http://qudt.org/vocab/unit/> .\n\n"
+)
+
+
+# Function to initialize the graph of a batch
+def new_batch_graph(streaming):
+    graph = Graph(store="SimpleMemory") if streaming else Graph()  # the simple store keeps the insertion order
+    graph.bind("", emiBox)  # ":" will now map to "https://purl.org/emi/abox#"
+    graph.bind("emi", emi)  # Bind the 'emi' prefix explicitly
+    graph.bind("emiUnit", emiUnit)  # Bind the 'emiUnit' prefix explicitly
+    graph.bind("sosa", sosa)  # Bind the 'sosa' prefix explicitly
+    graph.bind("dcterms", dcterms)  # Bind the 'dcterms' prefix explicitly
+    graph.bind("wd", wd)  # Bind the 'wd' prefix explicitly
+    graph.bind("qudt", qudt)  # Bind the 'qudt' prefix explicitly
+    graph.bind("qudtUnit", qudtUnit)  # Bind the 'qudtUnit' prefix explicitly
+    #graph.namespace_manager.bind("_", nTemp)
+    return graph
+
+
+# Columns of a row which its sample, dataset and organism statements depend on
+entity_columns = ["AccSpeciesName", "ObservationID", "Dataset", "Reference", "WdID"]
+
+
+# Function for the sample, dataset and organism statements of a row, which are repeated by the rows of the same entities
+def entity_statements(row):
+    """
+    :return: Iterator over the (kind, triple) tuples of the statements, kind being the label of the duplicates_suppressed counter.
+    """
+    # Define URIs (ensure spaces are replaced with underscores)
+    sample_uri = emiBox[f"SAMPLE-{dp.format_uri(row['AccSpeciesName'])}-{row['ObservationID']}"]
+    dataset_uri = emiBox[f"DATASET-{dp.format_uri(row['Dataset'])}"] if dp.is_none_na_or_empty(row['Dataset']) else None
+    observation_uri = emiBox[f"OBSERVATION-{dp.format_uri(row['ObservationID'])}"]
+    organism_uri = emiBox[f"ORGANISM-{dp.format_uri(row['AccSpeciesName'])}"]
+
+    yield "sample", (sample_uri, RDF.type, sosa.Sample)
+    yield "sample", (sample_uri, RDFS.label, Literal(row['AccSpeciesName'], datatype=XSD.string))
+    yield "sample", (sample_uri, sosa.isSampleOf, organism_uri)
+    yield "sample", (sample_uri, sosa.isFeatureOfInterestOf, observation_uri)
+    if dp.is_none_na_or_empty(dataset_uri):
+        yield "sample", (sample_uri, dcterms.isPartOf, dataset_uri)
+    yield "dataset", (dataset_uri, dcterms.bibliographicCitation, Literal(row['Reference'], datatype=XSD.string))
+    if pd.notna(row['WdID']):
+        yield "organism", (organism_uri, emi.inTaxon, URIRef(wd[dp.format_uri(row['WdID'])]))
+
+
+# Function to select the sample, dataset and organism statements of a batch which were not written yet
+def new_entity_statements(batch_data, emitted):
+    """
+    :param emitted: EmitOnce of the output file.
+    :return: List of the statements to write with the batch, in the order of their first row.
+    """
+    statements = []
+    for row in batch_data[entity_columns].drop_duplicates().to_dict("records"):
+        statements.extend(triple for kind, triple in entity_statements(row) if emitted.keep(triple, kind))
+    return statements
+
+
+# Function to add the triples of the TRY rows of a batch
+def add_batch_to_graph(graph, batch_data, emitted):
+    """
+    Add the triples of every row of a batch to the graph.
+
+    :param graph: rdflib.Graph receiving the triples.
+    :param batch_data: Batch returned by type_results.
+    :param emitted: EmitOnce of the output file, or None if the sample, dataset and organism statements of the batch
+        are added by the caller (see new_entity_statements).
+    """
+    for row in batch_data.to_dict("records"):
+#            graph.namespace_manager.bind("_", nTemp)
+        if emitted is not None:
+            for kind, triple in entity_statements(row):
+                emitted.add(graph, triple, kind)
+
+        # Define URIs (ensure spaces are replaced with underscores)
+        observation_uri = emiBox[f"OBSERVATION-{dp.format_uri(row['ObservationID'])}"]
+        result_bnode = emiBox[f"RESULT-{row['ObsDataID']}"] if dp.is_none_na_or_empty(row['Dataset']) else None
+        #result_bnode = BNode("RESULT-" + row['ObsDataID'])
+
+        # Add triples to the graph
+        graph.add((observation_uri, sosa.hasResult, result_bnode))
+        if dp.is_none_na_or_empty(result_bnode):
+        #    if dp.is_none_na_or_empty(row['DataType']):
+        #        if (row['DataType'] == "Trait"):
+            if dp.is_none_na_or_empty(row['TraitName']):
+                graph.add((result_bnode, RDF.type, emi.Trait))
+                if dp.is_none_na_or_empty(row['OrigValueStr']):
+                    if row['valueIsDouble']:
+                        graph.add((result_bnode, RDF.value, Literal(row['OrigValueStr'], datatype=XSD.double)))
+                    else:
+                        graph.add((result_bnode, RDF.value, Literal(row['OrigValueStr'], datatype=XSD.string)))
+        #       elif (row['DataType'] == "Non-trait"):
+            else:
+                graph.add((result_bnode, RDF.type, emi.NonTrait))
+                if dp.is_none_na_or_empty(row['OrigValueStr']):
+                    graph.add((result_bnode, RDF.value, Literal(row['OrigValueStr'], datatype=XSD.string)))
+        if dp.is_none_na_or_empty(row['DataName']):
+            graph.add((result_bnode, RDFS.label, Literal(row['DataName'], datatype=XSD.string)))
+        if dp.is_none_na_or_empty(row['DataID']):
+            graph.add((result_bnode, dcterms.identifier, Literal(row['DataID'], datatype=XSD.string)))
+        #if dp.is_none_na_or_empty(row['OrigValueStr']):
+        #    graph.add((result_bnode, RDF.value, Literal(row['OrigValueStr'], datatype=XSD.string)))
+
+        #Add units, resolved for the whole batch by type_results
+        if pd.notna(row['unitComment']):
+            if pd.notna(row['unitIRI']):
+                graph.add((result_bnode, qudt.hasUnit, URIRef(row['unitIRI'])))
+            graph.add((result_bnode, RDFS.comment, Literal(row['unitComment'], datatype=XSD.string)))
+
+
+# Function to serialize the graph of a batch, with the inverse relationships
+def serialize_batch_graph(graph, inverse, streaming):
+    if inverse:
+        dp.add_inverse_relationships(graph)
+    # Serialize the graph for the batch
+    with metrics.timer("write"):
+        text = graph.serialize(format="turtle_custom", streaming=streaming, prefixes=turtle_prefixes)
+    metrics.count("triples_emitted", len(graph))
+    return text
+
+
+# Unit mappings of the worker processes, set before they are forked so that they share them (copy-on-write) instead
+# of receiving them with every partition
+worker_state = {}
+
+
+# Function to split a batch in consecutive partitions of about the same size, one per worker process
+def partition_batch(batch_data, workers):
+    """
+    :return: Iterator over the non-empty partitions, in order.
+    """
+    size = max(1, -(-len(batch_data) // workers))
+    return (batch_data.iloc[start:start + size] for start in range(0, len(batch_data), size))
+
+
+# Function to generate the triples of one partition of a batch in a worker process
+def generate_partition(task):
+    batch_data, statements, level, inverse, streaming = task
+    metrics.reset()  # the metrics of the partition are returned to the parent, which merges them
+    batch_data = type_results(batch_data, worker_state["eNamesDict1"], worker_state["eNamesDict2"])
+    graph = new_batch_graph(streaming)
+    with metrics.timer("generate"):
+        for triple in statements:
+            graph.add(triple)
+        add_batch_to_graph(graph, batch_data, None)
+    text = serialize_batch_graph(graph, inverse, streaming)
+    with metrics.timer("compress"):
+        member = gzip.compress(text.encode("utf-8"), level, mtime=0)
+    return member, metrics.snapshot()
+
+
+def generate_rdf_in_batches(input_csv_gz, wdMapping_csv, join_csv, output_file, join_column1, join_column2, batch_size=1000, ch=1, reject_file=None, compress_level=6, compress_threads=None, inverse=True, streaming=False, emit_once_capacity=2000000, workers=0, resolver_file="taxon_resolver.sqlite"):
     """
     Generate RDF triples in compact Turtle format using batches of rows and rdflib for serialization.
 
@@ -45,11 +285,20 @@ def generate_rdf_in_batches(input_csv_gz, wdMapping_csv, join_csv, output_file,
     :param join_csv: Path to the secondary CSV file for joining.
     :param output_file: Path to the output Turtle file.
     :param join_column: Column name for joining the two CSVs.
-    :param batch_size: The number of rows to process per batch.
+    :param batch_size: The number of input rows to process per batch.
+    :param reject_file: Path to the gzipped TSV file of the dropped rows with their reason (see RejectWriter). Defaults to <output_file>.rejects.tsv.gz.
+    :param compress_level: gzip compression level of the output file.
+    :param compress_threads: Number of threads compressing the output file (see ParallelGzipWriter), the number of CPUs by default.
+    :param inverse: Add the inverse relationships of dp.INVERSE_RELATIONS.
+    :param streaming: Serialize the graph of every batch in insertion order instead of sorting it (see TurtleSerializerCustom.serialize_streaming).
+    :param emit_once_capacity: Number of sample, dataset and organism statements remembered to write them once (see EmitOnce), 0 to write them for every batch.
+    :param workers: 0 to process the batches one after the other in this process, otherwise the number of worker processes.
+        Every batch is split in consecutive partitions, generated and compressed by the workers and written in order.
+    :param resolver_file: Path to the taxon resolver file, built from wdMapping_csv by the first run and shared with the other generators (see TaxonResolver).
     """
-    # Load input data
-    data1 = pd.read_csv(input_csv_gz, compression="gzip", sep="\t", dtype=str, encoding="iso-8859-1")
-    data2 = pd.read_csv(wdMapping_csv, compression="gzip", sep="\t", dtype=str)
+    # mapping of the TRY species names to WD, a name can be mapped to several WdIDs. It is looked up for every batch in
+    # the resolver file, which is (re)built from the mapping file only when it changed
+    resolver = TaxonResolver(resolver_file).update(trydb_wd_file=wdMapping_csv, trydb_name_column=join_column1)
     
     # read units dict file
     dictFileNameQudt = "../ontology/data/trydb/qudtMappingToTryDb.txt"
@@ -57,139 +306,81 @@ def generate_rdf_in_batches(input_csv_gz, wdMapping_csv, join_csv, output_file,
     eNamesDict1 = dp.create_dict_from_csv(dictFileNameQudt, "origUnit", "mapUnit")
     eNamesDict2 = dp.create_dict_from_csv(dictFileNameEmi, "origUnit", "mapUnit")
 
-    # Perform the join
-    merged_data = pd.merge(data1, data2[[join_column1, "WdID"]],
-                           left_on="AccSpeciesName", right_on=join_column1, how="left")
-    merged_data.drop(columns=[join_column1], inplace=True)
+    # WdIDs of ENPKG, the rows of other taxa are dropped
     if(ch == 1):
-        data3 = pd.read_csv(join_csv, compression="gzip", sep="\t", dtype=str)
-        merged_data = merged_data[merged_data['WdID'].isin(data3[join_column2])]
-
-        #merged_data = dp.filter_file_runtime(input_csv_gz, data3, key_column=join_column2)
-    #print(merged_data.shape)
-
-    
-    # Open the output file for writing
-    with gzip.open(output_file, "wt", encoding="utf-8") as out_file:
+        enpkgIds = WdIdIndex.load(join_csv, join_column2)
+        rejects = RejectWriter(reject_file or f"{output_file}.rejects.tsv.gz")
+
+    # statements of the samples, datasets and organisms which are repeated by many rows, written once per file
+    emitted = EmitOnce(emit_once_capacity)
+
+    # the workers are forked before the compression threads of the output file are started. The sample, dataset and
+    # organism statements are selected by this process (see new_entity_statements) and sent with the partitions, so
+    # that every statement is written once whatever the worker which generates its rows. The workers are terminated if
+    # the run fails
+    worker_state.update(eNamesDict1=eNamesDict1, eNamesDict2=eNamesDict2)
+    pending = collections.deque()
+    # Open the output file for writing, it stays open for all the batches and compresses them in the background
+    with (multiprocessing.get_context("fork").Pool(workers) if workers > 0 else contextlib.nullcontext()) as pool, \
+            ParallelGzipWriter(output_file, level=compress_level, threads=compress_threads) as out_file:
         # Write prefixes directly to the file
-        out_file.write("@prefix emi: <https://purl.org/emi#> .\n")
-        out_file.write("@prefix emiUnit: <https://purl.org/emi/unit#> .\n")
-        out_file.write("@prefix : <https://purl.org/emi/abox#> .\n")
-        out_file.write("@prefix sosa: <http://www.w3.org/ns/sosa/> .\n")
-        out_file.write("@prefix dcterms: <http://purl.org/dc/terms/> .\n")
-        out_file.write("@prefix wd: <http://www.wikidata.org/entity/> .\n")
-        out_file.write("@prefix rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#> .\n")
-        out_file.write("@prefix rdfs: <http://www.w3.org/2000/01/rdf-schema#> .\n")
-        out_file.write("@prefix xsd: <http://www.w3.org/2001/XMLSchema#> .\n")
-        out_file.write("@prefix qudt: <https://qudt.org/2.1/schema/qudt#> .\n")
-        out_file.write("@prefix qudtUnit: <http://qudt.org/vocab/unit/> .\n\n")
-
-
-    # Process in batches
-    for start_row in range(0, len(merged_data), batch_size):
-        end_row = min(start_row + batch_size, len(merged_data))
-        batch_data = merged_data[start_row:end_row]
-        #print(batch_data.shape)
-        #print(start_row)
-        # Initialize a new graph for this batch
-        graph = Graph()
-        graph.bind("", emiBox)  # ":" will now map to "https://purl.org/emi/abox#"
-        graph.bind("emi", emi)  # Bind the 'emi' prefix explicitly
-        graph.bind("emiUnit", emiUnit)  # Bind the 'emiUnit' prefix explicitly
-        graph.bind("sosa", sosa)  # Bind the 'sosa' prefix explicitly
-        graph.bind("dcterms", dcterms)  # Bind the 'dcterms' prefix explicitly
-        graph.bind("wd", wd)  # Bind the 'wd' prefix explicitly
-        graph.bind("qudt", qudt)  # Bind the 'qudt' prefix explicitly
-        graph.bind("qudtUnit", qudtUnit)  # Bind the 'qudtUnit' prefix explicitly
-        #graph.namespace_manager.bind("_", nTemp)
-
-        # Process each row in the batch
-        for _, row in batch_data.iterrows():
-#            graph.namespace_manager.bind("_", nTemp)
-            # Define URIs
-            # Define URIs (ensure spaces are replaced with underscores)
-            sample_uri = emiBox[f"SAMPLE-{dp.format_uri(row['AccSpeciesName'])}-{row['ObservationID']}"]
-            dataset_uri = emiBox[f"DATASET-{dp.format_uri(row['Dataset'])}"] if dp.is_none_na_or_empty(row['Dataset']) else None
-            observation_uri = emiBox[f"OBSERVATION-{dp.format_uri(row['ObservationID'])}"]
-            organism_uri = emiBox[f"ORGANISM-{dp.format_uri(row['AccSpeciesName'])}"]
-            result_bnode = emiBox[f"RESULT-{row['ObsDataID']}"] if dp.is_none_na_or_empty(row['Dataset']) else None
-            #result_bnode = BNode("RESULT-" + row['ObsDataID'])
-
-
-            # Add triples to the graph
-            graph.add((sample_uri, RDF.type, sosa.Sample))
-            graph.add((sample_uri, RDFS.label, Literal(row['AccSpeciesName'], datatype=XSD.string)))
-            graph.add((sample_uri, sosa.isSampleOf, organism_uri))
-            graph.add((sample_uri, sosa.isFeatureOfInterestOf, observation_uri))
-
-            if dp.is_none_na_or_empty(dataset_uri):
-                graph.add((sample_uri, dcterms.isPartOf, dataset_uri))
-
-            graph.add((dataset_uri, dcterms.bibliographicCitation, Literal(row['Reference'], datatype=XSD.string)))
-
-            graph.add((observation_uri, sosa.hasResult, result_bnode))
-            if dp.is_none_na_or_empty(result_bnode):
-            #    if dp.is_none_na_or_empty(row['DataType']):
-            #        if (row['DataType'] == "Trait"):
-                if dp.is_none_na_or_empty(row['TraitName']):
-                    graph.add((result_bnode, RDF.type, emi.Trait))
-                    if dp.is_none_na_or_empty(row['OrigValueStr']):
-                        #pattern = r"[-]?[0-9]+[\.]?[0-9]*"
-                        pattern = r"-?[0-9]+(\.[0-9]+)?(E[+-][0-9]+)?"
-                        if(re.fullmatch(pattern, row['OrigValueStr'])):
-                            graph.add((result_bnode, RDF.value, Literal(row['OrigValueStr'], datatype=XSD.double)))
-                        else:
-                            graph.add((result_bnode, RDF.value, Literal(row['OrigValueStr'], datatype=XSD.string)))
-            #       elif (row['DataType'] == "Non-trait"):
-                else:
-                    graph.add((result_bnode, RDF.type, emi.NonTrait))
-                    if dp.is_none_na_or_empty(row['OrigValueStr']):
-                        graph.add((result_bnode, RDF.value, Literal(row['OrigValueStr'], datatype=XSD.string)))
-            if dp.is_none_na_or_empty(row['DataName']):
-                graph.add((result_bnode, RDFS.label, Literal(row['DataName'], datatype=XSD.string)))
-            if dp.is_none_na_or_empty(row['DataID']):
-                graph.add((result_bnode, dcterms.identifier, Literal(row['DataID'], datatype=XSD.string)))
-            #if dp.is_none_na_or_empty(row['OrigValueStr']):
-            #    graph.add((result_bnode, RDF.value, Literal(row['OrigValueStr'], datatype=XSD.string)))
-
-            #Add units
-            if dp.is_none_na_or_empty(row['OrigUnitStr']):
-                entity = row['OrigUnitStr']
-                if entity in eNamesDict1:
-                    #print(row['OrigUnitStr']," ",qudtUnit[eNamesDict1[entity]])
-                    graph.add((result_bnode, qudt.hasUnit, URIRef(qudtUnit[eNamesDict1[entity]])))
-#                    graph.add((result_bnode, qudt.hasUnit, URIRef(emiUnit[dp.format_uri(entity.strip())])))
-                elif dp.is_none_na_or_empty(row['UnitName']):
-                    entity1 = row['UnitName']
-                    if entity1 in eNamesDict1:
-                        #print(entity1," ",qudtUnit[eNamesDict1[entity1]])
-                        graph.add((result_bnode, qudt.hasUnit, URIRef(qudtUnit[eNamesDict1[entity1]])))
-                    elif entity1 in eNamesDict2:
-                        #print(entity1," ",eNamesDict2[entity1.strip()])
-                        graph.add((result_bnode, qudt.hasUnit, URIRef(eNamesDict2[entity1.strip()])))
-                elif entity in eNamesDict2:
-                    #print(row['OrigUnitStr']," ",eNamesDict2[entity.strip()])
-                    graph.add((result_bnode, qudt.hasUnit, URIRef(eNamesDict2[entity.strip()])))
-                    #print(row['OrigUnitStr']," ",eNamesDict2[dp.format_uri(entity.strip())])
-                    #graph.add((result_bnode, qudt.hasUnit, URIRef(eNamesDict2[dp.format_uri(entity.strip())])))
-                graph.add((result_bnode, RDFS.comment, Literal(entity.strip(), datatype=XSD.string)))
-
-
-
-            if pd.notna(row['WdID']):
-                graph.add((organism_uri, emi.inTaxon, URIRef(wd[dp.format_uri(row['WdID'])])))
-
-        dp.add_inverse_relationships(graph)
-        # Serialize the graph for the batch and write to the file
-        with gzip.open(output_file, "at", encoding="utf-8") as out_file:  # Append mode
-            out_file.write(graph.serialize(format="turtle_custom"))
-        #out_file.flush()
-
-        # Clear the graph to free memory
-    #    graph.remove((None, None, None))
-        del graph
-        #print(out_file)
-
+        out_file.write(turtle_prefixes)
+
+        # write the triples of a partition, compressed by its worker
+        def write_partition(result):
+            member, partition_metrics = result
+            metrics.merge(partition_metrics)
+            out_file.write_member(member)
+
+        # Process in batches, read from the input file one after the other, so that the memory depends on the batch size only
+        if staging.is_parquet(input_csv_gz):
+            chunks = (chunk for chunk, _ in staging.read_parquet_chunks(input_csv_gz, batch_size, columns=try_columns))
+        else:
+            chunks = pd.read_csv(input_csv_gz, compression="gzip", sep="\t", dtype=str, encoding="iso-8859-1", usecols=try_columns, chunksize=batch_size)
+        for batch_data in chunks:
+            batchStart = time.perf_counter()
+            batch_data = join_wd_ids(batch_data, resolver.trydb_species(batch_data["AccSpeciesName"]))
+            rowsRead = len(batch_data)
+            metrics.count("rows_read", rowsRead)
+            if(ch == 1):
+                inEnpkg = enpkgIds.contains(batch_data['WdID'])
+                noWdId = batch_data['WdID'].isna()
+                # rows which are dropped, with the species name or the WdID which is missing in ENPKG
+                rejects.reject("no_wd_mapping", batch_data[noWdId], batch_data['AccSpeciesName'][noWdId])
+                rejects.reject("not_in_enpkg", batch_data[~inEnpkg & ~noWdId], batch_data['WdID'][~inEnpkg & ~noWdId])
+                rejects.flush()
+                batch_data = batch_data[inEnpkg]
+                metrics.count("rows_dropped", int(noWdId.sum()), reason="no_wd_mapping")
+                metrics.count("rows_dropped", rowsRead - len(batch_data) - int(noWdId.sum()), reason="not_in_enpkg")
+            if workers > 0:
+                for partition_data in partition_batch(batch_data, workers):
+                    statements = new_entity_statements(partition_data, emitted)
+                    pending.append(pool.apply_async(generate_partition, ((partition_data, statements, out_file.level, inverse, streaming),)))
+                while len(pending) > 2 * workers:  # keep at most two partitions per worker in memory
+                    write_partition(pending.popleft().get())
+                metrics.add_time("batch", time.perf_counter() - batchStart)
+                continue
+
+            # units and datatypes of the values of the whole batch
+            batch_data = type_results(batch_data, eNamesDict1, eNamesDict2)
+            # Initialize a new graph for this batch
+            graph = new_batch_graph(streaming)
+            with metrics.timer("generate"):
+                add_batch_to_graph(graph, batch_data, emitted)
+            out_file.write(serialize_batch_graph(graph, inverse, streaming))
+            metrics.add_time("batch", time.perf_counter() - batchStart)
+
+            # Clear the graph to free memory
+            del graph
+
+        while pending:
+            write_partition(pending.popleft().get())
+        if workers > 0:
+            pool.close()
+            pool.join()
+    # the last block is compressed and written when the output file is closed
+
+    print(f"{emitted.suppressed} repeated sample, dataset and organism statements were written only once")
     print(f"RDF triples saved to {output_file}")
 
 # Main execution
@@ -201,7 +392,17 @@ if __name__ == "__main__":
         csv_file1 = config.get('input tsv files', 'trydb_tsv')
         csv_file2 = config.get('accessory files', 'trydb_wd')
         csv_file3 = config.get('accessory files', 'enpkg_wd')
+        resolver_file = config.get('accessory files', 'taxon_resolver', fallback="taxon_resolver.sqlite")
         output_file = config.get('output files', 'trydb_ttl')
+        metrics.configure(config.get('run options', 'log_level', fallback="info"), config.getint('run options', 'log_sample', fallback=1000))
+        metrics_file = config.get('run options', 'metrics_file', fallback="")
+        compress_level = config.getint('run options', 'compress_level', fallback=6)
+        compress_threads = config.getint('run options', 'compress_threads', fallback=0)
+        inverse = config.getboolean('run options', 'inverse_relations', fallback=True)
+        streaming = config.getboolean('run options', 'turtle_streaming', fallback=False)
+        emit_once_capacity = config.getint('run options', 'emit_once_capacity', fallback=2000000)
+        workers = config.getint('run options', 'trydb_workers', fallback=0)
+        reject_file = config.get('output files', 'trydb_rejects', fallback="")
     else:                               #else use command line arguments
         # Create the argument parser
         parser = argparse.ArgumentParser()
@@ -211,6 +412,16 @@ if __name__ == "__main__":
         parser.add_argument('wdMappingFile', type=str, help="Enter the file name which will be used for mapping to WdIDs")
         parser.add_argument('joinFile', type=str, help="Enter the file name which will be used for filtering or joining the input_file")
         parser.add_argument('outputFile', type=str, help="Enter the output file name")
+        parser.add_argument('--log-level', type=str, choices=["quiet", "info", "debug"], default="info", help="Diagnostic output: none, sampled, or one line per row")
+        parser.add_argument('--metrics-file', type=str, default="", help="Write the counters and timings of the run to this file (.json, or .prom for Prometheus text)")
+        parser.add_argument('--compress-level', type=int, default=6, help="gzip compression level of the output file, from 1 (fastest) to 9 (smallest)")
+        parser.add_argument('--compress-threads', type=int, default=0, help="Number of threads compressing the output file (0 for the number of CPUs)")
+        parser.add_argument('--no-inverse', action="store_true", help="Do not add the inverse relationships (e.g. sosa:hasSample of sosa:isSampleOf), for endpoints which infer them at query time")
+        parser.add_argument('--turtle-streaming', action="store_true", help="Write the Turtle of every batch in insertion order, without sorting it")
+        parser.add_argument('--workers', type=int, default=0, help="Number of worker processes, every batch is split in consecutive partitions (0 to process the batches in this process)")
+        parser.add_argument('--emit-once-capacity', type=int, default=2000000, help="Number of repeated sample, dataset and organism statements remembered to write them once (0 to write them for every batch)")
+        parser.add_argument('--resolver-file', type=str, default="taxon_resolver.sqlite", help="Taxon resolver file, built from the mapping file and shared with the other generators")
+        parser.add_argument('--rejects-file', type=str, default="", help="Gzipped TSV file of the dropped rows with their reason (default <outputFile>.rejects.tsv.gz)")
     
         # Parse the arguments
         args = parser.parse_args()
@@ -218,6 +429,18 @@ if __name__ == "__main__":
         csv_file2 = args.wdMappingFile
         csv_file3 = args.joinFile
         output_file = args.outputFile
-
-    generate_rdf_in_batches(csv_file1, csv_file2, csv_file3, output_file, join_column1="TRY_AccSpeciesName",  join_column2 = "wd_taxon_id", batch_size=10000)
+        metrics.configure(args.log_level)
+        metrics_file = args.metrics_file
+        compress_level = args.compress_level
+        compress_threads = args.compress_threads
+        inverse = not args.no_inverse
+        streaming = args.turtle_streaming
+        emit_once_capacity = args.emit_once_capacity
+        workers = args.workers
+        reject_file = args.rejects_file
+        resolver_file = args.resolver_file
+
+    generate_rdf_in_batches(csv_file1, csv_file2, csv_file3, output_file, join_column1="TRY_AccSpeciesName",  join_column2 = "wd_taxon_id", batch_size=10000, reject_file=reject_file, compress_level=compress_level, compress_threads=compress_threads, inverse=inverse, streaming=streaming, emit_once_capacity=emit_once_capacity, workers=workers, resolver_file=resolver_file)
+    if metrics_file:
+        metrics.dump(metrics_file)
 
@@ -1,3 +1,6 @@
+import re
+
+from rdflib import Literal
 from rdflib.plugins.serializers.turtle import TurtleSerializer
 
 SUBJECT = 0
@@ -8,6 +11,69 @@ class TurtleSerializerCustom(TurtleSerializer):
     short_name = "turtle"
     indentString = "    "
 
+    def serialize(self, stream, base=None, encoding=None, spacious=None, streaming=False, prefixes="", **args):
+        """
+        Serialize the graph without its prefixes, which the generators write once at the top of the file.
+
+        :param streaming: Write the subjects in the order of the store instead of preprocessing and sorting them,
+            see serialize_streaming.
+        :param prefixes: With streaming, the @prefix lines written at the top of the file. Only these prefixes are used.
+        """
+        if streaming:
+            self.serialize_streaming(stream, base, encoding, prefixes)
+        else:
+            super().serialize(stream, base=base, encoding=encoding, spacious=spacious, **args)
+
+    def serialize_streaming(self, stream, base=None, encoding=None, prefixes=""):
+        """
+        Write one block per run of triples of the same subject, in the order the store gives them, with the objects of
+        the same predicate separated by "," and the predicates by ";". There is no reference counting, no sorting and no
+        nesting of blank nodes, and only the current subject is held. With a store iterating its triples by subject and
+        predicate in insertion order (e.g. Graph(store="SimpleMemory")), every subject gets one block and the output is
+        the same from run to run. Prefixes are never generated: an IRI is abbreviated only with a prefix of the file
+        header (the @prefix lines of prefixes), and written in full otherwise, e.g. in a namespace bound by rdflib by
+        default (owl:, skos:, schema:, ...) which the header does not declare.
+        """
+        self.reset()
+        self.header_prefixes = set(re.findall(r"@prefix\s+([^\s:]*):", prefixes))
+        self.stream = stream
+        if base is not None:
+            self.base = base
+        elif self.store.base is not None:
+            self.base = self.store.base
+
+        subject = predicate = None
+        for s, p, o in self.store.triples((None, None, None)):
+            if s != subject:
+                if subject is not None:
+                    self.write(" .\n\n")
+                self.write(f"{self.streaming_label(s, SUBJECT)} {self.streaming_label(p, VERB)} {self.streaming_label(o, OBJECT)}")
+                subject, predicate = s, p
+            elif p != predicate:
+                self.write(f" ;\n{self.indentString}{self.streaming_label(p, VERB)} {self.streaming_label(o, OBJECT)}")
+                predicate = p
+            else:
+                self.write(f" ,\n{self.indentString * 2}{self.streaming_label(o, OBJECT)}")
+        if subject is not None:
+            self.write(" .\n")
+        stream.write("\n".encode("latin-1"))
+
+        self.base = None
+
+    def streaming_label(self, node, position):
+        if position == VERB and node in self.keywords:
+            return self.keywords[node]
+        if isinstance(node, Literal):
+            return node._literal_n3(use_plain=True, qname_callback=self.header_qname)
+        return self.header_qname(self.relativize(node)) or node.n3()
+
+    def header_qname(self, node):
+        # qname of the node with a prefix of the file header, None for the other nodes
+        qname = self.getQName(node, False)
+        if qname and qname.split(":", 1)[0] in self.header_prefixes:
+            return qname
+        return None
+
     def startDocument(self) -> None:
         self._started = True
         ns_list = sorted(self.namespaces.items())
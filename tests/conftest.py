@@ -0,0 +1,6 @@
+import os
+import sys
+
+# the generators and their helpers are scripts run from src, which import each other from src and src/functions
+src = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+sys.path[:0] = [src, os.path.join(src, "functions")]
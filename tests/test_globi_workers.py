@@ -0,0 +1,46 @@
+import gzip
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+from rdflib import Graph
+from rdflib.compare import isomorphic
+
+repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+data = os.path.join(repo, "tests", "data")
+
+config = """[accessory files]
+bp_fileName = ../ontology/data/globi/correctedBodyPartNamesGlobi.csv
+ls_fileName = ../ontology/data/globi/correctedLifeStageNamesGlobi.csv
+"""
+
+
+# Function to run the GloBI generator on the test interactions, in a copy of src as the generators are run from src
+def generate(tmp_path, engine, workers):
+    run = tmp_path / f"{engine}-{workers}"
+    shutil.copytree(os.path.join(repo, "src"), run / "src", ignore=shutil.ignore_patterns("__pycache__"))
+    shutil.copytree(os.path.join(repo, "ontology"), run / "ontology")
+    (run / "src" / "config.txt").write_text(config)
+    output_file = run / "globi.ttl.gz"
+    code = ("import makeTriples_globi_rdf_v1 as g; "
+            f"g.generate_rdf_in_batches({os.path.join(data, 'globi_interactions.tsv.gz')!r}, None, {os.path.join(data, 'wd_map.csv')!r}, "
+            f"{str(output_file)!r}, 'wd_taxon_id', batch_size=50, engine={engine!r}, workers={workers}, "
+            f"entity_table_file={str(run / 'entity_table.tsv.gz')!r}, resolver_file={str(run / 'resolver.sqlite')!r})")
+    subprocess.run([sys.executable, "-c", code], cwd=run / "src", check=True, capture_output=True)
+    with gzip.open(output_file, "rb") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("engine", ["rdflib", "stream"])
+def test_workers_write_the_triples_of_a_sequential_run(tmp_path, engine):
+    sequential = generate(tmp_path, engine, 0)
+    parallel = generate(tmp_path, engine, 2)
+    expected = Graph().parse(data=sequential, format="turtle")
+    assert len(expected) > 1000
+    assert isomorphic(Graph().parse(data=parallel, format="turtle"), expected)  # the records have blank nodes
+
+
+def test_output_is_the_same_for_any_number_of_workers(tmp_path):
+    assert generate(tmp_path, "stream", 1) == generate(tmp_path, "stream", 3)
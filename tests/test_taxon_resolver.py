@@ -0,0 +1,34 @@
+import os
+import sqlite3
+import threading
+import time
+
+from taxon_resolver import TaxonResolver
+
+data = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+wd_map_file = os.path.join(data, "wd_map.csv")
+
+
+def test_readers_wait_for_a_rebuild(tmp_path):
+    db_file = str(tmp_path / "resolver.sqlite")
+    TaxonResolver(db_file).update(wd_map_file=wd_map_file)
+    writer = sqlite3.connect(db_file, isolation_level=None, check_same_thread=False)
+    writer.execute("BEGIN EXCLUSIVE")  # held like the end of a rebuild
+    release = threading.Timer(1.0, lambda: writer.execute("COMMIT"))
+    release.start()
+    start = time.perf_counter()
+    ids = TaxonResolver(db_file).globi_taxon_ids(["NCBI:1001"])
+    assert time.perf_counter() - start >= 0.9
+    assert ids.loc["NCBI:1001", "Mapped_ID_WD"] == "Q5001"
+    release.join()
+
+
+def test_concurrent_updates_build_the_tables_once(tmp_path, capsys):
+    db_file = str(tmp_path / "resolver.sqlite")
+    threads = [threading.Thread(target=lambda: TaxonResolver(db_file).update(wd_map_file=wd_map_file)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert capsys.readouterr().out.count("Building the globi tables") == 1
+    assert TaxonResolver(db_file).globi_taxon_names(["Genus1 species1"]).loc["Genus1 species1", "Mapped_ID_WD"] == "Q5001"
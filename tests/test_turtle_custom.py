@@ -0,0 +1,40 @@
+import rdflib
+from rdflib import Graph, Literal, Namespace, OWL, RDF, RDFS, SKOS, XSD
+
+rdflib.plugin.register('turtle_custom', rdflib.plugin.Serializer, 'turtle_custom.serializer', 'TurtleSerializerCustom')
+
+emiBox = Namespace("https://purl.org/emi/abox#")
+
+prefixes = (
+    "@prefix : <https://purl.org/emi/abox#> .\n"
+    "@prefix rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#> .\n"
+    "@prefix rdfs: <http://www.w3.org/2000/01/rdf-schema#> .\n"
+    "@prefix xsd: <http://www.w3.org/2001/XMLSchema#> .\n\n"
+)
+
+
+def streamed_graph():
+    graph = Graph(store="SimpleMemory")
+    graph.bind("", emiBox)
+    graph.add((emiBox.taxon, RDF.type, OWL.Class))
+    graph.add((emiBox.taxon, RDFS.label, Literal("taxon", datatype=XSD.string)))
+    graph.add((emiBox.taxon, SKOS.broader, emiBox.organism))
+    graph.add((emiBox.taxon, RDFS.comment, Literal("1", datatype=OWL.rational)))
+    return graph
+
+
+def test_streaming_writes_undeclared_namespaces_in_full():
+    graph = streamed_graph()
+    text = graph.serialize(format="turtle_custom", streaming=True, prefixes=prefixes)
+    assert "owl:" not in text and "skos:" not in text
+    assert "<http://www.w3.org/2002/07/owl#Class>" in text
+    assert ":taxon" in text and "rdfs:label" in text  # prefixes of the header
+
+    parsed = Graph().parse(data=prefixes + text, format="turtle")
+    assert set(parsed) == set(graph)
+
+
+def test_streaming_without_header_writes_every_iri_in_full():
+    graph = streamed_graph()
+    text = graph.serialize(format="turtle_custom", streaming=True)
+    assert set(Graph().parse(data=text, format="turtle")) == set(graph)
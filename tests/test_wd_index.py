@@ -0,0 +1,23 @@
+import numpy as np
+import pandas as pd
+
+from wd_index import WdIdIndex
+
+ids = pd.Series(["Q42", "wd:Q7", "http://www.wikidata.org/entity/Q100", "Q0042x", np.nan], dtype=object)
+
+
+def test_contains_is_isin():
+    values = pd.Series(["Q42", "Q042", "xQ42", "https://example.org/xQ42", "http://www.wikidata.org/entity/Q42", "wd:Q7",
+                        "Q7", "http://www.wikidata.org/entity/Q100", "Q0042x", np.nan, "Q42 ", "Q99999999999999999999999"],
+                       dtype=object)
+    assert WdIdIndex(ids).contains(values).tolist() == values.isin(ids).tolist()
+
+
+def test_load_uses_the_cache(tmp_path):
+    csv_file = tmp_path / "enpkg.tsv.gz"
+    pd.DataFrame({"wd_taxon_id": ids}).to_csv(csv_file, sep="\t", index=False)
+    values = pd.Series(["Q42", "Q042", "Q0042x", "wd:Q7", "Q7"], dtype=object)
+    first = WdIdIndex.load(str(csv_file), "wd_taxon_id")
+    assert (tmp_path / "enpkg.tsv.gz.wd_taxon_id.npz").exists()
+    cached = WdIdIndex.load(str(csv_file), "wd_taxon_id")
+    assert first.contains(values).tolist() == cached.contains(values).tolist() == values.isin(ids).tolist()